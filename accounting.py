@@ -0,0 +1,25 @@
+from database import (
+    create_view_record, increment_file_views, calculate_earnings, update_user_balance, claim_held_views
+)
+from uniques import tracker as unique_visitors
+from trending import tracker as trending_tracker
+from leaderboard import counter as leaderboard_counter
+
+
+def credit_view(short_link_id: str, uploader_id: int, ip: str, country: str, user_agent: str):
+    """Record a view that passed fraud checks and feed every counter that depends on it"""
+    create_view_record(short_link_id, ip, country, user_agent)
+    increment_file_views(short_link_id, country)
+    unique_visitors.add_view(short_link_id, uploader_id, ip)
+    trending_tracker.add_view(short_link_id, uploader_id)
+
+    credits = update_user_balance(uploader_id, calculate_earnings(country))
+    leaderboard_counter.add_view(short_link_id, credits)
+
+
+def release_held_views(uploader_id: int) -> int:
+    """Credit an uploader's held views as if they had passed review"""
+    released = claim_held_views(uploader_id)
+    for held in released:
+        credit_view(held['short_link_id'], uploader_id, held['ip'], held['country'], held.get('user_agent'))
+    return len(released)
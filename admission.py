@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from pymongo import monitoring
+
+SHED_DB_LATENCY_MS = float(os.getenv('SHED_DB_LATENCY_MS', '500'))
+SHED_DB_STALL_SECONDS = float(os.getenv('SHED_DB_STALL_SECONDS', '2'))
+SHED_MAX_IN_FLIGHT = int(os.getenv('SHED_MAX_IN_FLIGHT', '64'))
+SHED_HOLD_SECONDS = float(os.getenv('SHED_HOLD_SECONDS', '15'))
+SHED_RETRY_AFTER_SECONDS = int(os.getenv('SHED_RETRY_AFTER_SECONDS', '30'))
+DEFERRED_VIEWS_MAX = int(os.getenv('DEFERRED_VIEWS_MAX', '10000'))
+# Latency is judged on the 90th percentile of commands finished this recently
+LATENCY_WINDOW_SECONDS = 10
+LATENCY_SAMPLES = 1000
+# Shedding decisions are reused for this long instead of being recomputed per request
+CHECK_INTERVAL_SECONDS = 0.5
+
+
+class DatabaseLatency(monitoring.CommandListener):
+    """pymongo command listener tracking recent latencies and commands still in flight.
+
+    Only commands issued on a thread marked with `sample_thread` are counted,
+    so background flushes and admin queries don't trigger shedding. pymongo
+    calls listeners on the thread running the command.
+    """
+
+    def __init__(self, window_seconds: float = LATENCY_WINDOW_SECONDS, max_samples: int = LATENCY_SAMPLES):
+        self.window_seconds = window_seconds
+        self.samples = deque(maxlen=max_samples)
+        self.in_flight: Dict = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def sample_thread(self, enabled: bool):
+        """Start or stop counting the commands of the current thread"""
+        self.local.enabled = enabled
+
+    def started(self, event):
+        if not getattr(self.local, 'enabled', False):
+            return
+        with self.lock:
+            self.in_flight[(event.connection_id, event.request_id)] = time.monotonic()
+
+    def _finished(self, event):
+        with self.lock:
+            # Commands that were never started here weren't sampled
+            if self.in_flight.pop((event.connection_id, event.request_id), None) is None:
+                return
+            self.samples.append((time.monotonic(), event.duration_micros / 1000))
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def p90_ms(self) -> Optional[float]:
+        cutoff = time.monotonic() - self.window_seconds
+        with self.lock:
+            recent = sorted(ms for at, ms in self.samples if at >= cutoff)
+        if not recent:
+            return None
+        return recent[int(len(recent) * 0.9)]
+
+    def oldest_in_flight_seconds(self) -> float:
+        with self.lock:
+            if not self.in_flight:
+                return 0.0
+            return time.monotonic() - min(self.in_flight.values())
+
+
+class AdmissionController:
+    """Decides when the web tier should stop waiting on MongoDB.
+
+    Shedding starts when recent command latency, a stalled command or the
+    number of requests in flight crosses its threshold, and lasts at least
+    SHED_HOLD_SECONDS so the funnel doesn't flap between modes.
+    """
+
+    def __init__(self, latency: DatabaseLatency):
+        self.latency = latency
+        self.in_flight = 0
+        self.shed_until = 0.0
+        self.checked_at = 0.0
+        self.reason = None
+        self.lock = threading.Lock()
+        self.metrics = {'shed_requests': 0, 'episodes': 0}
+
+    def enter(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _overload_reason(self) -> Optional[str]:
+        if self.in_flight > SHED_MAX_IN_FLIGHT:
+            return f"{self.in_flight} requests in flight"
+        stalled = self.latency.oldest_in_flight_seconds()
+        if stalled > SHED_DB_STALL_SECONDS:
+            return f"database command running for {stalled:.1f}s"
+        p90 = self.latency.p90_ms()
+        if p90 is not None and p90 > SHED_DB_LATENCY_MS:
+            return f"database p90 latency {p90:.0f} ms"
+        return None
+
+    def shedding(self) -> bool:
+        now = time.monotonic()
+        with self.lock:
+            if now - self.checked_at < CHECK_INTERVAL_SECONDS:
+                return now < self.shed_until
+            self.checked_at = now
+            was_shedding = now < self.shed_until
+
+        reason = self._overload_reason()
+        with self.lock:
+            if reason:
+                if not was_shedding:
+                    self.metrics['episodes'] += 1
+                    print(f"⚠️ Shedding load: {reason}")
+                self.shed_until = now + SHED_HOLD_SECONDS
+                self.reason = reason
+            return now < self.shed_until
+
+    def record_shed(self):
+        with self.lock:
+            self.metrics['shed_requests'] += 1
+
+    def stats(self) -> Dict:
+        p90 = self.latency.p90_ms()
+        return {
+            'shedding': self.shedding(),
+            'reason': self.reason,
+            'in_flight': self.in_flight,
+            'db_p90_ms': round(p90, 1) if p90 is not None else None,
+            'db_oldest_in_flight_seconds': round(self.latency.oldest_in_flight_seconds(), 2),
+            **self.metrics
+        }
+
+
+class DeferredQueue:
+    """Bounded queue of work postponed while shedding, drained once the database recovers.
+
+    Items are kept in process memory; when the queue is full the oldest are
+    dropped and counted.
+    """
+
+    def __init__(self, handler: Callable, is_paused: Callable[[], bool], max_items: int = DEFERRED_VIEWS_MAX):
+        self.handler = handler
+        self.is_paused = is_paused
+        self.items = deque()
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        self.thread = None
+        self.metrics = {'deferred': 0, 'drained': 0, 'dropped': 0, 'failed': 0}
+
+    def put(self, *args):
+        with self.lock:
+            if len(self.items) >= self.max_items:
+                self.items.popleft()
+                self.metrics['dropped'] += 1
+            self.items.append(args)
+            self.metrics['deferred'] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            if self.is_paused():
+                time.sleep(1)
+                continue
+            with self.lock:
+                if not self.items:
+                    self.thread = None
+                    return
+                args = self.items.popleft()
+            try:
+                self.handler(*args)
+                self.metrics['drained'] += 1
+            except Exception as e:
+                self.metrics['failed'] += 1
+                print(f"Deferred accounting failed: {e}")
+
+    def stats(self) -> Dict:
+        return {'queued': len(self.items), **self.metrics}
+
+
+db_latency = DatabaseLatency()
+admission = AdmissionController(db_latency)
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import gzip
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database
+from export import iter_batches, serialize_document, parse_date
+from sketches import BloomFilter
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '5000'))
+
+SEGMENT_SUFFIX = '.ndjson.gz'
+INDEX_SUFFIX = '.idx.json'
+
+
+def _partition_dir(day: str) -> str:
+    return os.path.join(ARCHIVE_DIR, 'views', day)
+
+
+def _write_atomic(path: str, write):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_segment(day: str, docs: List[Dict]) -> str:
+    """Write one compressed segment plus its index, returning the segment path.
+
+    Segments are named after their first _id, so re-running a batch that was
+    written but not yet deleted overwrites the same file instead of duplicating it.
+    """
+    directory = _partition_dir(day)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"seg-{docs[0]['_id']}")
+
+    def write_docs(f):
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for doc in docs:
+                gz.write((serialize_document(doc) + '\n').encode('utf-8'))
+
+    _write_atomic(base + SEGMENT_SUFFIX, write_docs)
+
+    links = BloomFilter.for_capacity(len(docs))
+    ips = BloomFilter.for_capacity(len(docs))
+    for doc in docs:
+        links.add(str(doc.get('short_link_id')))
+        ips.add(str(doc.get('ip')))
+
+    timestamps = [doc['timestamp'] for doc in docs if doc.get('timestamp')]
+    index = {
+        'count': len(docs),
+        'first_id': str(docs[0]['_id']),
+        'last_id': str(docs[-1]['_id']),
+        'min_timestamp': min(timestamps).isoformat() if timestamps else None,
+        'max_timestamp': max(timestamps).isoformat() if timestamps else None,
+        'short_link_ids': links.to_dict(),
+        'ips': ips.to_dict()
+    }
+    _write_atomic(base + INDEX_SUFFIX, lambda f: f.write(json.dumps(index).encode('utf-8')))
+
+    return base + SEGMENT_SUFFIX
+
+
+def archive_old_views(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict:
+    """Move views older than `days` into date-partitioned segments on disk"""
+    if database.views_collection is None:
+        return {'archived': 0, 'segments': 0}
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archived = 0
+    segments = 0
+
+    for batch in iter_batches(database.views_collection, until=cutoff, batch_size=batch_size):
+        by_day = {}
+        for doc in batch:
+            timestamp = doc.get('timestamp') or doc['_id'].generation_time.replace(tzinfo=None)
+            by_day.setdefault(timestamp.strftime('%Y-%m-%d'), []).append(doc)
+
+        for day, docs in by_day.items():
+            write_segment(day, docs)
+            segments += 1
+
+        # Only delete once every segment of the batch is safely on disk
+        database.views_collection.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}})
+        archived += len(batch)
+
+    return {'archived': archived, 'segments': segments}
+
+
+def _iter_partitions(since: datetime = None, until: datetime = None) -> Iterator[str]:
+    root = os.path.join(ARCHIVE_DIR, 'views')
+    if not os.path.isdir(root):
+        return
+    for day in sorted(os.listdir(root)):
+        if since and day < since.strftime('%Y-%m-%d'):
+            continue
+        if until and day > until.strftime('%Y-%m-%d'):
+            continue
+        yield os.path.join(root, day)
+
+
+def query_archive(short_link_id: str = None, ip: str = None,
+                  since: datetime = None, until: datetime = None) -> Iterator[Dict]:
+    """Scan archived segments for matching views without restoring them.
+
+    Each segment's Bloom filters are checked first, so only segments that may
+    contain the requested link or IP are decompressed.
+    """
+    for directory in _iter_partitions(since, until):
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(INDEX_SUFFIX):
+                continue
+            base = os.path.join(directory, name[:-len(INDEX_SUFFIX)])
+            with open(base + INDEX_SUFFIX, 'r') as f:
+                index = json.load(f)
+
+            if short_link_id and short_link_id not in BloomFilter.from_dict(index['short_link_ids']):
+                continue
+            if ip and ip not in BloomFilter.from_dict(index['ips']):
+                continue
+
+            with gzip.open(base + SEGMENT_SUFFIX, 'rt', encoding='utf-8') as segment:
+                for line in segment:
+                    doc = json.loads(line)
+                    if short_link_id and doc.get('short_link_id') != short_link_id:
+                        continue
+                    if ip and doc.get('ip') != ip:
+                        continue
+                    yield doc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive and search old view events")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Archive views older than N days")
+    run_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+    run_parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+
+    query_parser = subparsers.add_parser('query', help="Search archived views")
+    query_parser.add_argument('--short-link-id')
+    query_parser.add_argument('--ip')
+    query_parser.add_argument('--since', help="ISO date, inclusive")
+    query_parser.add_argument('--until', help="ISO date, inclusive")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        if database.client is None:
+            print("❌ MONGO_URI is not configured", file=sys.stderr)
+            return 1
+        result = archive_old_views(args.days, args.batch_size)
+        print(f"✅ Archived {result['archived']} views into {result['segments']} segments")
+        return 0
+
+    if not args.short_link_id and not args.ip:
+        parser.error("query needs --short-link-id and/or --ip")
+
+    for doc in query_archive(args.short_link_id, args.ip, parse_date(args.since), parse_date(args.until)):
+        sys.stdout.write(json.dumps(doc, ensure_ascii=False) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,40 @@
 import os
-from datetime import datetime
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+import re
+import math
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List
+from pyrogram import Client, filters, idle
+from pyrogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+    InputMediaPhoto, InputMediaVideo, InputMediaAudio, InputMediaDocument
+)
 from database import (
-    get_or_create_user, create_file_record, get_file_by_short_link_id,
-    get_user_stats, get_all_users_stats, get_cpm_rates, update_cpm_rates,
-    create_withdrawal_request, get_user_withdrawals, get_pending_withdrawals,
-    approve_withdrawal, reject_withdrawal, get_withdrawal_by_id, get_ad_codes, update_ad_code, remove_ad_code,
-    get_referral_stats, award_referral_commission, get_user_files, get_file_stats,
-    delete_file, delete_file_by_short_link, get_file_count
+    get_or_create_user, create_file_record, create_bundle_record, get_file_by_short_link_id,
+    get_user_stats, get_money_totals, get_cpm_rates, get_cpm_settings, update_cpm_rates,
+    create_withdrawal_request, get_user_withdrawals, get_pending_withdrawals, count_pending_withdrawals,
+    approve_withdrawal, approve_withdrawals_batch, settle_stale_withdrawal_batches, reject_withdrawal, get_withdrawal_by_id, get_ad_codes, update_ad_code, remove_ad_code,
+    get_referral_stats, get_user_files, get_file_stats, REFERRAL_TIERS,
+    delete_file, delete_file_by_short_link, get_file_count,
+    get_unique_visitors, file_sketch_key, uploader_sketch_key, get_file_names,
+    get_held_views_summary, discard_held_views, is_file_available, sweep_expired_files,
+    create_broadcast, get_latest_broadcast, update_broadcast, mark_user_blocked, trim_sessions
 )
+from trending import get_trending
+from accounting import release_held_views
+from leaderboard import leaderboard, LEADERBOARD_REFRESH_SECONDS
+from outbound import OutboundQueue, PRIORITY_DELIVERY, PRIORITY_NOTIFICATION, log_failure
+from broadcast import BroadcastRunner, format_progress
+from router import CallbackRouter
+from ratelimit import KeyedTokenBuckets, ConcurrencyLanes
+from state_store import create_state_store, MongoStateStore, STATE_MAX_ENTRIES
+from scheduler import Scheduler
+from delivery_tokens import verify_token as verify_delivery_token
+from cache import LRUCache
+from money import to_micros, format_money
+from export import export_payouts, get_payout_methods
 from dotenv import load_dotenv
+import io
 import secrets
 
 load_dotenv()
@@ -30,14 +54,70 @@ BASE_URL = get_base_url()
 BOT_USERNAME = os.getenv('BOT_USERNAME', 'YourBot').lstrip('@')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
 
+LANE_LIMITS = {
+    'delivery': int(os.getenv('LANE_DELIVERY', '50')),
+    'menus': int(os.getenv('LANE_MENUS', '20')),
+    'admin': int(os.getenv('LANE_ADMIN', '2')),
+    # Broadcasts running at once; their database calls use this lane's threads
+    'broadcast': int(os.getenv('LANE_BROADCAST', '2')),
+}
+
+# Enough dispatcher workers that every lane can be busy at once; handlers hand their
+# bodies to the lanes as tasks, so a full lane never stalls the others
 app = Client(
     "file_monetization_bot",
     api_id=API_ID,
     api_hash=API_HASH,
-    bot_token=BOT_TOKEN
+    bot_token=BOT_TOKEN,
+    workers=sum(LANE_LIMITS.values())
 )
 
-user_sessions = {}
+NEW_LINK_TAG = "#newlink"
+# Upload caption options, e.g. "#expires 7d" or "#maxdownloads 100"
+LINK_OPTION_PATTERN = re.compile(r'#(expires|maxdownloads)\s+(\d+)([hdw]?)', re.IGNORECASE)
+EXPIRY_UNITS = {'h': 3600, 'd': 86400, 'w': 604800}
+EXPIRY_SWEEP_SECONDS = 3600
+MIN_WITHDRAWAL_MICROS = to_micros(5)
+WITHDRAWALS_PAGE_SIZE = 10
+PAYOUT_BATCH_LIMIT = int(os.getenv('PAYOUT_BATCH_LIMIT', '500'))
+# Batches still 'processing' this long after being claimed were interrupted and are settled by a job
+PAYOUT_RESUME_SECONDS = 600
+ALBUM_WINDOW_SECONDS = 1.5
+MEDIA_GROUP_LIMIT = 10
+DELIVERY_CACHE_SIZE = int(os.getenv('DELIVERY_CACHE_SIZE', '5000'))
+DELIVERY_CACHE_SECONDS = 600
+USER_RATE_PER_SECOND = float(os.getenv('USER_RATE_PER_SECOND', '1'))
+USER_RATE_BURST = int(os.getenv('USER_RATE_BURST', '5'))
+# Uploads have their own bucket, so sending a batch of files doesn't use up the one for menus
+UPLOAD_RATE_PER_SECOND = float(os.getenv('UPLOAD_RATE_PER_SECOND', '0.5'))
+UPLOAD_RATE_BURST = int(os.getenv('UPLOAD_RATE_BURST', '20'))
+# A throttled user is told to slow down at most once per this many seconds
+THROTTLE_NOTICE_SECONDS = 10
+SETTINGS_REFRESH_SECONDS = int(os.getenv('SETTINGS_REFRESH_SECONDS', '60'))
+# Unique visitor sketches are only merged every few seconds, so a short cache loses nothing
+UNIQUE_COUNTS_CACHE_SECONDS = 30
+SESSION_TRIM_SECONDS = 3600
+# Cron schedule for moving old views to disk, e.g. "30 3 * * *"; unset leaves archiving manual
+ARCHIVE_CRON = os.getenv('ARCHIVE_CRON')
+
+conversations = create_state_store()
+album_buffers = {}
+# Album flushes in progress; referenced here until they finish so none is garbage collected mid-send
+album_tasks = set()
+outbox = OutboundQueue()
+delivery_files = LRUCache(DELIVERY_CACHE_SIZE, DELIVERY_CACHE_SECONDS)
+user_buckets = KeyedTokenBuckets(USER_RATE_PER_SECOND, USER_RATE_BURST)
+upload_buckets = KeyedTokenBuckets(UPLOAD_RATE_PER_SECOND, UPLOAD_RATE_BURST)
+throttle_notices = LRUCache(10000, THROTTLE_NOTICE_SECONDS)
+charged_media_groups = LRUCache(1000, 60)
+throttled = {'messages': 0, 'callbacks': 0}
+lanes = ConcurrencyLanes(LANE_LIMITS)
+broadcaster = BroadcastRunner(app, outbox, lanes)
+settings_cache = LRUCache(1, SETTINGS_REFRESH_SECONDS)
+screens = LRUCache(64)
+unique_counts = LRUCache(10000, UNIQUE_COUNTS_CACHE_SECONDS)
+scheduler = Scheduler()
+callbacks = CallbackRouter(is_admin=lambda user_id: user_id == ADMIN_ID, lanes=lanes)
 
 
 def get_main_menu_keyboard(is_admin=False):
@@ -48,6 +128,7 @@ def get_main_menu_keyboard(is_admin=False):
         [InlineKeyboardButton("👥 Referral Program", callback_data="menu_referral")],
         [InlineKeyboardButton("💰 Withdraw Earnings", callback_data="menu_withdraw")],
         [InlineKeyboardButton("📜 Withdrawal History", callback_data="menu_history")],
+        [InlineKeyboardButton("🏆 Leaderboard", callback_data="leaderboard_day")],
         [InlineKeyboardButton("ℹ️ Help & Info", callback_data="menu_help")],
     ]
     if is_admin:
@@ -69,6 +150,12 @@ def get_admin_keyboard():
     """Generate admin panel keyboard"""
     keyboard = [
         [InlineKeyboardButton("📊 System Stats", callback_data="admin_stats")],
+        [InlineKeyboardButton("🔥 Trending Now", callback_data="admin_trending")],
+        [InlineKeyboardButton("🏆 Leaderboard", callback_data="admin_leaderboard_day")],
+        [InlineKeyboardButton("🚨 Fraud Review", callback_data="admin_fraud")],
+        [InlineKeyboardButton("📬 Send Queue", callback_data="admin_queue")],
+        [InlineKeyboardButton("⏱ Route Timings", callback_data="admin_routes")],
+        [InlineKeyboardButton("⏰ Scheduled Jobs", callback_data="admin_jobs")],
         [InlineKeyboardButton("💵 CPM Management", callback_data="admin_cpm")],
         [InlineKeyboardButton("💸 Withdrawals", callback_data="admin_withdrawals")],
         [InlineKeyboardButton("📺 Ads Management", callback_data="admin_ads")],
@@ -77,11 +164,401 @@ def get_admin_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_cached_cpm_settings() -> Dict:
+    """CPM settings, re-read at most every SETTINGS_REFRESH_SECONDS so /setcpm in another process shows up"""
+    settings = settings_cache.get('cpm')
+    if settings is None:
+        settings = get_cpm_settings()
+        settings_cache.set('cpm', settings)
+    return settings
+
+
+def get_unique_counts(user_id: int):
+    """All-time and today's unique visitors for an uploader, cached briefly per user"""
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    counts = unique_counts.get((user_id, today))
+    if counts is None:
+        counts = (
+            get_unique_visitors(uploader_sketch_key(user_id)),
+            get_unique_visitors(uploader_sketch_key(user_id, today))
+        )
+        unique_counts.set((user_id, today), counts)
+    return counts
+
+
+def render_screen(name: str, build, *args):
+    """Return a cached (text, keyboard) screen, rebuilt when the CPM settings version changes"""
+    settings = get_cached_cpm_settings()
+    key = (name, settings['version']) + args
+    screen = screens.get(key)
+    if screen is None:
+        screen = build(settings['rates'], *args)
+        screens.set(key, screen)
+    return screen
+
+
+def invalidate_screens():
+    settings_cache.clear()
+    screens.clear()
+
+
+def build_welcome_screen(cpm_rates: Dict, is_admin: bool):
+    welcome_text = f"""
+👋 **Welcome to File Monetization Bot!**
+
+📤 **How it works:**
+1. Send me any file (document, video, photo, etc.)
+2. I'll give you a unique monetized link
+3. Share the link with others
+4. Earn money for every download! 💰
+
+💵 **Current CPM Rates:**
+🇺🇸 US: ${cpm_rates.get('US', 5.0)} per 1000 views
+🇬🇧 UK: ${cpm_rates.get('GB', 4.0)} per 1000 views
+🇮🇳 India: ${cpm_rates.get('IN', 2.0)} per 1000 views
+🌍 Other: ${cpm_rates.get('OTHER', 1.0)} per 1000 views
+
+Start earning now by uploading a file or use the menu below! 🚀
+"""
+    return welcome_text, get_main_menu_keyboard(is_admin)
+
+
+def build_main_menu_screen(cpm_rates: Dict, is_admin: bool):
+    return "📋 **Main Menu**\n\nChoose an option below:", get_main_menu_keyboard(is_admin)
+
+
+def build_help_screen(cpm_rates: Dict):
+    help_text = """
+📖 **Help & Information**
+
+**Available Commands:**
+• /start - Start the bot & main menu
+• /menu - Show main menu
+• /withdraw <amount> <method> <details> - Request withdrawal
+• /leaderboard - Top earners and files
+• /admin - Admin panel (admins only)
+
+**How to Use:**
+1️⃣ Send any file to the bot
+2️⃣ Receive a monetized link
+3️⃣ Share the link
+4️⃣ Earn money from downloads
+5️⃣ Withdraw earnings when you reach minimum
+
+**Earnings:**
+You earn based on visitor's country and our CPM rates.
+
+**Withdrawals:**
+• Minimum: $5.00
+• Methods: PayPal, Bank, Crypto
+• Processing: 24-48 hours
+
+**Support:**
+For support, contact the admin.
+"""
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💵 View CPM Rates", callback_data="help_cpm")],
+        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+    ])
+    return help_text, keyboard
+
+
+def build_cpm_screen(cpm_rates: Dict):
+    cpm_text = "💵 **Current CPM Rates**\n\n"
+    
+    country_names = {
+        'US': '🇺🇸 United States',
+        'GB': '🇬🇧 United Kingdom',
+        'IN': '🇮🇳 India',
+        'OTHER': '🌍 Other Countries'
+    }
+    
+    for code, name in country_names.items():
+        rate = cpm_rates.get(code, 1.0)
+        cpm_text += f"{name}: ${rate:.2f} per 1000 views\n"
+    
+    cpm_text += "\n**What is CPM?**\nCPM (Cost Per Mille) is the amount you earn per 1000 views from a specific country."
+    return cpm_text, get_back_button("menu_help")
+
+
+INPUT_MEDIA_TYPES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'audio': InputMediaAudio,
+    'document': InputMediaDocument,
+}
+
+
+async def deliver_bundle(message: Message, file_record: Dict):
+    """Send an album bundle as media groups of up to ten files"""
+    items = file_record.get('items', [])
+    for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+        media = []
+        for item in items[start:start + MEDIA_GROUP_LIMIT]:
+            input_type = INPUT_MEDIA_TYPES.get(item.get('file_type'), InputMediaDocument)
+            media.append(input_type(item['telegram_file_id']))
+        if start == 0:
+            media[0].caption = f"📁 **{file_record['file_name']}**\n\n✅ Here are your files!"
+        
+        await outbox.send(
+            message.chat.id,
+            lambda media=media: message.reply_media_group(media),
+            PRIORITY_DELIVERY
+        )
+
+
+@lanes.limit('delivery')
+async def deliver_file(message: Message, file_record: Dict):
+    """Send a stored file to the user through the outbound queue"""
+    file_type = file_record.get('file_type', 'document')
+    if file_type == 'bundle':
+        await deliver_bundle(message, file_record)
+        return
+    
+    caption = f"📁 **{file_record['file_name']}**\n\n✅ Here's your file!"
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("📊 View My Stats", callback_data="menu_stats")]])
+    
+    reply_methods = {
+        'photo': (message.reply_photo, 'photo'),
+        'video': (message.reply_video, 'video'),
+        'audio': (message.reply_audio, 'audio'),
+    }
+    reply_method, media_arg = reply_methods.get(file_type, (message.reply_document, 'document'))
+    
+    await outbox.send(
+        message.chat.id,
+        lambda: reply_method(**{media_arg: file_record['telegram_file_id']}, caption=caption, reply_markup=keyboard),
+        PRIORITY_DELIVERY
+    )
+
+
+def get_delivery_record(short_link_id: str):
+    """File record for a verified delivery token, cached so hot files skip MongoDB.
+
+    Links with an expiry or download quota are always read fresh: the web
+    process ends them by updating the record, which a cached copy would miss.
+    """
+    file_record = delivery_files.get(short_link_id)
+    if file_record is None:
+        file_record = get_file_by_short_link_id(short_link_id)
+        if file_record and not file_record.get('max_downloads') and not file_record.get('expires_at'):
+            delivery_files.set(short_link_id, file_record)
+    return file_record
+
+
+def get_fraud_review_screen():
+    """Render the held-views review screen as (text, keyboard)"""
+    summary = get_held_views_summary()
+    
+    if not summary:
+        return "🚨 **Fraud Review**\n\nNo views are currently held for review.", get_back_button("menu_admin")
+    
+    review_text = "🚨 **Fraud Review**\n\nViews held back from crediting, by uploader:\n"
+    keyboard_buttons = []
+    for idx, entry in enumerate(summary, 1):
+        uploader_id = entry['_id']
+        review_text += f"""
+**#{idx} - Uploader:** `{uploader_id}`
+🚫 Held Views: {entry['count']} across {len(entry['files'])} files
+📈 Max Score: {entry['max_score']:.2f}
+📅 Last Seen: {entry['last_seen'].strftime('%Y-%m-%d %H:%M')}
+"""
+        keyboard_buttons.append([
+            InlineKeyboardButton(f"✅ Release #{idx}", callback_data=f"fraud_release_{uploader_id}"),
+            InlineKeyboardButton(f"🗑️ Discard #{idx}", callback_data=f"fraud_discard_{uploader_id}")
+        ])
+    
+    keyboard_buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_fraud")])
+    keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")])
+    return review_text, InlineKeyboardMarkup(keyboard_buttons)
+
+
+def encode_withdrawal_cursor(withdrawal: Dict) -> str:
+    """Keyset cursor for callback data: created_at in epoch milliseconds plus _id"""
+    millis = int((withdrawal['created_at'] - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return f"{millis}_{withdrawal['_id']}"
+
+
+def decode_withdrawal_cursor(value: str):
+    from bson.objectid import ObjectId
+    millis, _, withdrawal_id = value.partition('_')
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(withdrawal_id)
+
+
+def get_withdrawals_screen(cursor: str = None, notice: str = ""):
+    """Render one page of pending withdrawals as (text, keyboard)"""
+    after = decode_withdrawal_cursor(cursor) if cursor else None
+    # One extra row tells whether there is a next page
+    pending = get_pending_withdrawals(WITHDRAWALS_PAGE_SIZE + 1, after)
+    has_more = len(pending) > WITHDRAWALS_PAGE_SIZE
+    pending = pending[:WITHDRAWALS_PAGE_SIZE]
+    
+    if not pending and cursor is None:
+        return f"📋 **Pending Withdrawals**\n\n{notice}No pending withdrawal requests.", get_back_button("menu_admin")
+    
+    withdrawals_text = f"📋 **Pending Withdrawals ({count_pending_withdrawals()})**\n\n{notice}"
+    keyboard_buttons = []
+    
+    for idx, w in enumerate(pending, 1):
+        withdrawal_id = str(w['_id'])
+        withdrawals_text += f"""
+**#{idx} - ID:** `{withdrawal_id[:8]}...`
+👤 User: {w['user_id']}
+💰 Amount: {format_money(w['amount_micros'], 2)}
+💳 Method: {w['payment_method']}
+📝 Details: {w['payment_details']}
+📅 Date: {w['created_at'].strftime('%Y-%m-%d %H:%M')}
+─────────────────────
+"""
+        keyboard_buttons.append([
+            InlineKeyboardButton(f"✅ Approve #{idx}", callback_data=f"withdrawal_approve_{withdrawal_id}"),
+            InlineKeyboardButton(f"❌ Reject #{idx}", callback_data=f"withdrawal_reject_{withdrawal_id}")
+        ])
+    
+    navigation = []
+    if cursor is not None:
+        navigation.append(InlineKeyboardButton("⏮ First Page", callback_data="admin_withdrawals"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(
+            "Next ▶️", callback_data=f"withdrawals_page_{encode_withdrawal_cursor(pending[-1])}"
+        ))
+    if navigation:
+        keyboard_buttons.append(navigation)
+    keyboard_buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_withdrawals")])
+    keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")])
+    return withdrawals_text, InlineKeyboardMarkup(keyboard_buttons)
+
+
+LEADERBOARD_PERIOD_LABELS = {'day': "Today", 'week': "This Week", 'all': "All Time"}
+
+
+def get_leaderboard_screen(period: str, admin: bool = False):
+    """Render the in-memory leaderboard for one period as (text, keyboard)"""
+    def earner_name(entry):
+        username = f"@{entry['name']}" if entry.get('name') else None
+        if admin:
+            return f"{username} ({entry['item']})" if username else entry['item']
+        return username or f"User …{entry['item'][-4:]}"
+    
+    leaderboard_text = f"🏆 **Leaderboard - {LEADERBOARD_PERIOD_LABELS[period]}**\n\n**Top Earners:**\n"
+    earners = leaderboard.top('earners', period)
+    for idx, entry in enumerate(earners, 1):
+        leaderboard_text += f"{idx}. {earner_name(entry)}: {format_money(entry['value'], 2)}\n"
+    if not earners:
+        leaderboard_text += "No earnings yet.\n"
+    
+    leaderboard_text += "\n**Top Files:**\n"
+    files = leaderboard.top('files', period)
+    for idx, entry in enumerate(files, 1):
+        file_name = entry.get('name') or "Unknown"
+        if len(file_name) > 30:
+            file_name = file_name[:27] + "..."
+        leaderboard_text += f"{idx}. {file_name}: {entry['value']} views\n"
+    if not files:
+        leaderboard_text += "No views yet.\n"
+    
+    if leaderboard.refreshed_at:
+        leaderboard_text += f"\n_Updated {leaderboard.refreshed_at.strftime('%Y-%m-%d %H:%M')} UTC_"
+    
+    prefix = "admin_leaderboard_" if admin else "leaderboard_"
+    keyboard = InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(("• " if key == period else "") + label, callback_data=f"{prefix}{key}")
+            for key, label in LEADERBOARD_PERIOD_LABELS.items()
+        ],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin") if admin
+         else InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+    ])
+    return leaderboard_text, keyboard
+
+
+def get_approval_notification(withdrawal: Dict) -> str:
+    return f"""
+✅ **Withdrawal Approved!**
+
+Your withdrawal request has been approved!
+
+💰 **Amount:** {format_money(withdrawal['amount_micros'], 2)}
+💳 **Method:** {withdrawal['payment_method']}
+📝 **Details:** {withdrawal['payment_details']}
+📅 **Approved:** {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}
+
+The payment will be processed to your account shortly.
+
+Thank you for using our service! 🎉
+"""
+
+
+def throttle_delay(user, buckets: KeyedTokenBuckets = user_buckets) -> int:
+    """Charge one token from the user's bucket and return the seconds to wait if it was empty.
+
+    0 means the update is allowed; admins are never throttled.
+    """
+    if user is None or user.id == ADMIN_ID:
+        return 0
+    bucket = buckets.get(user.id)
+    if bucket.try_acquire():
+        return 0
+    return max(math.ceil(bucket.delay()), 1)
+
+
+def notify_throttled(message: Message, text: str):
+    """Tell a throttled user what was dropped, once per THROTTLE_NOTICE_SECONDS"""
+    user_id = message.from_user.id
+    if throttle_notices.get(user_id):
+        return
+    throttle_notices.set(user_id, True)
+    log_failure(outbox.submit(
+        message.chat.id, lambda: message.reply_text(text), PRIORITY_NOTIFICATION
+    ), "throttle notice")
+
+
+@app.on_message(group=-1)
+async def message_flood_guard(client: Client, message: Message):
+    is_upload = bool(message.document or message.video or message.photo or message.audio)
+    # Album parts arrive together: the first part is charged and the verdict applies to
+    # the whole group, so an album is either kept or dropped as one
+    delay = None
+    if message.media_group_id:
+        delay = charged_media_groups.get(message.media_group_id)
+    if delay is None:
+        delay = throttle_delay(message.from_user, upload_buckets if is_upload else user_buckets)
+        if message.media_group_id:
+            charged_media_groups.set(message.media_group_id, delay)
+    if delay:
+        throttled['messages'] += 1
+        if is_upload:
+            notify_throttled(message, f"⏳ Too many uploads at once. This one wasn't saved, please send it again in {delay}s.")
+        else:
+            notify_throttled(message, f"⏳ You're sending messages too fast. Please try again in {delay}s.")
+        message.stop_propagation()
+
+
+@app.on_callback_query(group=-1)
+async def callback_flood_guard(client: Client, callback_query: CallbackQuery):
+    if throttle_delay(callback_query.from_user):
+        throttled['callbacks'] += 1
+        await callback_query.answer("⏳ Too many requests, please slow down.")
+        callback_query.stop_propagation()
+
+
 @app.on_message(filters.command("start"))
+@lanes.spawn('delivery')
 async def start_handler(client: Client, message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
     
+    # Deep links from page 4 carry a signed token; reject bad ones before any database work
+    delivery = None
+    if len(message.command) > 1 and not message.command[1].startswith('ref_'):
+        delivery = verify_delivery_token(message.command[1])
+        if delivery is None:
+            await message.reply_text(
+                "❌ This link is invalid or has expired.\n\nPlease open the file link again to get a fresh one.",
+                reply_markup=get_back_button()
+            )
+            return
+    
     # Check for referral code
     referrer_id = None
     if len(message.command) > 1 and message.command[1].startswith('ref_'):
@@ -92,43 +569,17 @@ async def start_handler(client: Client, message: Message):
         except:
             pass
     
-    get_or_create_user(user_id, username, referrer_id)
+    user = await lanes.run(get_or_create_user, user_id, username, referrer_id)
+    if user.get('blocked'):
+        await lanes.run(mark_user_blocked, user_id, False)
     
-    if len(message.command) > 1:
-        short_link_id = message.command[1]
-        file_record = get_file_by_short_link_id(short_link_id)
+    if delivery:
+        short_link_id, _ = delivery
+        file_record = await lanes.run(get_delivery_record, short_link_id)
         
-        if file_record:
+        if file_record and is_file_available(file_record):
             try:
-                file_type = file_record.get('file_type', 'document')
-                caption = f"📁 **{file_record['file_name']}**\n\n✅ Here's your file!"
-                
-                keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("📊 View My Stats", callback_data="menu_stats")]])
-                
-                if file_type == 'photo':
-                    await message.reply_photo(
-                        photo=file_record['telegram_file_id'],
-                        caption=caption,
-                        reply_markup=keyboard
-                    )
-                elif file_type == 'video':
-                    await message.reply_video(
-                        video=file_record['telegram_file_id'],
-                        caption=caption,
-                        reply_markup=keyboard
-                    )
-                elif file_type == 'audio':
-                    await message.reply_audio(
-                        audio=file_record['telegram_file_id'],
-                        caption=caption,
-                        reply_markup=keyboard
-                    )
-                else:
-                    await message.reply_document(
-                        document=file_record['telegram_file_id'],
-                        caption=caption,
-                        reply_markup=keyboard
-                    )
+                await deliver_file(message, file_record)
             except Exception as e:
                 await message.reply_text(
                     f"❌ Sorry, there was an error retrieving the file.\n\nError: {str(e)}",
@@ -140,59 +591,158 @@ async def start_handler(client: Client, message: Message):
                 reply_markup=get_back_button()
             )
     else:
-        cpm_rates = get_cpm_rates()
-        welcome_text = f"""
-👋 **Welcome to File Monetization Bot!**
+        welcome_text, keyboard = await lanes.run(render_screen, 'welcome', build_welcome_screen, user_id == ADMIN_ID)
+        await message.reply_text(welcome_text, reply_markup=keyboard)
 
-📤 **How it works:**
-1. Send me any file (document, video, photo, etc.)
-2. I'll give you a unique monetized link
-3. Share the link with others
-4. Earn money for every download! 💰
 
-💵 **Current CPM Rates:**
-🇺🇸 US: ${cpm_rates.get('US', 5.0)} per 1000 views
-🇬🇧 UK: ${cpm_rates.get('GB', 4.0)} per 1000 views
-🇮🇳 India: ${cpm_rates.get('IN', 2.0)} per 1000 views
-🌍 Other: ${cpm_rates.get('OTHER', 1.0)} per 1000 views
+@app.on_message(filters.command("menu"))
+@lanes.spawn('menus')
+async def menu_handler(client: Client, message: Message):
+    menu_text, keyboard = await lanes.run(render_screen, 'main_menu', build_main_menu_screen, message.from_user.id == ADMIN_ID)
+    await message.reply_text(menu_text, reply_markup=keyboard)
+
+
+def parse_link_options(caption: str) -> Dict:
+    """Read the optional expiry and download quota for a new link from its caption"""
+    options = {}
+    for name, value, unit in LINK_OPTION_PATTERN.findall(caption or ''):
+        if int(value) <= 0:
+            continue
+        if name.lower() == 'expires':
+            options['expires_at'] = datetime.utcnow() + timedelta(seconds=int(value) * EXPIRY_UNITS[unit.lower() or 'd'])
+        else:
+            options['max_downloads'] = int(value)
+    return options
 
-Start earning now by uploading a file or use the menu below! 🚀
+
+def get_link_limits_text(record: Dict) -> str:
+    limits = ""
+    if record.get('expires_at'):
+        limits += f"⏳ **Expires:** {record['expires_at'].strftime('%Y-%m-%d %H:%M')} UTC\n"
+    if record.get('max_downloads'):
+        limits += f"🔢 **Download Limit:** {record['max_downloads']}\n"
+    return limits
+
+
+def get_upload_success_text(file_name: str, short_link: str, limits: str = "") -> str:
+    return f"""
+✅ **File Uploaded Successfully!**
+
+📁 **File:** {file_name}
+🔗 **Your Monetized Link:**
+{short_link}
+{limits}
+💰 Share this link and earn money for every view!
+
+**How it works:**
+1. Share the link with anyone
+2. They go through a secure verification process
+3. You earn money based on their location
+4. File is delivered automatically
+
+Start sharing now! 🚀
 """
-        is_admin = user_id == ADMIN_ID
-        await message.reply_text(welcome_text, reply_markup=get_main_menu_keyboard(is_admin))
 
 
-@app.on_message(filters.command("menu"))
-async def menu_handler(client: Client, message: Message):
-    user_id = message.from_user.id
-    is_admin = user_id == ADMIN_ID
+def get_duplicate_upload_text(file_record: Dict) -> str:
+    return f"""
+♻️ **You've Already Uploaded This File**
+
+📁 **File:** {file_record['file_name']}
+👁 **Views so far:** {file_record.get('views', 0)}
+🔗 **Your Existing Link:**
+{file_record['short_link']}
+
+Keep sharing this link so all views count towards one file.
+Need a separate link anyway? Tap below or upload again with `{NEW_LINK_TAG}` in the caption.
+"""
+
+
+def get_duplicate_upload_keyboard(file_record: Dict) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🆕 Create New Link", callback_data=f"file_newlink_{file_record['short_link_id']}")],
+        [InlineKeyboardButton("📁 My Files", callback_data="menu_files")],
+        [InlineKeyboardButton("🔙 Main Menu", callback_data="menu_main")]
+    ])
+
+
+def buffer_album_part(message: Message, item: Dict):
+    """Collect parts of a media group; the bundle is created once the album stops arriving"""
+    buffer = album_buffers.setdefault(message.media_group_id, {'items': [], 'task': None})
+    buffer['items'].append((message.id, item))
+    buffer['message'] = message
+    if message.caption:
+        buffer['options'] = parse_link_options(message.caption)
+    
+    if buffer['task']:
+        buffer['task'].cancel()
+    task = asyncio.create_task(flush_album(message.media_group_id))
+    buffer['task'] = task
+    album_tasks.add(task)
+    task.add_done_callback(lambda t: on_album_flushed(t, message))
+
+
+def on_album_flushed(task: asyncio.Task, message: Message):
+    """Log a failed album bundle and let the uploader know, instead of failing silently"""
+    album_tasks.discard(task)
+    if task.cancelled() or task.exception() is None:
+        return
+    
+    print(f"Album {message.media_group_id} failed: {task.exception()}")
+    log_failure(outbox.submit(
+        message.chat.id,
+        lambda: message.reply_text(
+            "❌ Sorry, your album couldn't be saved. Please send it again.",
+            reply_markup=get_back_button()
+        ),
+        PRIORITY_NOTIFICATION
+    ), "album failure notice")
+
+
+async def flush_album(media_group_id: str):
+    await asyncio.sleep(ALBUM_WINDOW_SECONDS)
+    buffer = album_buffers.pop(media_group_id, None)
+    if not buffer:
+        return
+    
+    message = buffer['message']
+    items: List[Dict] = [item for _, item in sorted(buffer['items'], key=lambda x: x[0])]
+    
+    short_link_id = secrets.token_urlsafe(8)
+    short_link = f"{BASE_URL}/download/{short_link_id}"
+    bundle_record = await lanes.run(create_bundle_record, items, message.from_user.id, short_link_id, short_link, **buffer.get('options', {}))
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 View My Stats", callback_data="menu_stats")],
+        [InlineKeyboardButton("📤 Upload Another File", callback_data="upload_more")],
+        [InlineKeyboardButton("🔙 Main Menu", callback_data="menu_main")]
+    ])
     await message.reply_text(
-        "📋 **Main Menu**\n\nChoose an option below:",
-        reply_markup=get_main_menu_keyboard(is_admin)
+        get_upload_success_text(bundle_record.get('file_name', 'Album'), short_link, get_link_limits_text(bundle_record)),
+        reply_markup=keyboard,
+        disable_web_page_preview=True
     )
 
 
 @app.on_message(filters.document | filters.video | filters.photo | filters.audio)
+@lanes.spawn('menus')
 async def file_handler(client: Client, message: Message):
     user_id = message.from_user.id
     username = message.from_user.username
     
-    get_or_create_user(user_id, username)
+    await lanes.run(get_or_create_user, user_id, username)
     
+    media = message.document or message.video or message.photo or message.audio
     if message.document:
-        file_id = message.document.file_id
         file_name = message.document.file_name or "document"
         file_type = "document"
     elif message.video:
-        file_id = message.video.file_id
         file_name = message.video.file_name or "video.mp4"
         file_type = "video"
     elif message.photo:
-        file_id = message.photo.file_id
         file_name = "photo.jpg"
         file_type = "photo"
     elif message.audio:
-        file_id = message.audio.file_id
         file_name = message.audio.file_name or "audio.mp3"
         file_type = "audio"
     else:
@@ -202,10 +752,35 @@ async def file_handler(client: Client, message: Message):
         )
         return
     
+    if message.media_group_id:
+        buffer_album_part(message, {
+            'telegram_file_id': media.file_id,
+            'file_unique_id': media.file_unique_id,
+            'file_name': file_name,
+            'file_type': file_type,
+            'file_size': media.file_size
+        })
+        return
+    
+    options = parse_link_options(message.caption)
+    # Links with their own expiry or quota never reuse an existing link
+    force_new = NEW_LINK_TAG in (message.caption or '').lower() or bool(options)
+    
     short_link_id = secrets.token_urlsafe(8)
     short_link = f"{BASE_URL}/download/{short_link_id}"
     
-    create_file_record(file_id, file_name, user_id, short_link_id, short_link, file_type)
+    file_record = await lanes.run(
+        create_file_record, media.file_id, file_name, user_id, short_link_id, short_link, file_type,
+        file_unique_id=media.file_unique_id, force_new=force_new, file_size=media.file_size, **options
+    )
+    
+    if file_record and file_record['short_link_id'] != short_link_id:
+        await message.reply_text(
+            get_duplicate_upload_text(file_record),
+            reply_markup=get_duplicate_upload_keyboard(file_record),
+            disable_web_page_preview=True
+        )
+        return
     
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("📊 View My Stats", callback_data="menu_stats")],
@@ -213,87 +788,73 @@ async def file_handler(client: Client, message: Message):
         [InlineKeyboardButton("🔙 Main Menu", callback_data="menu_main")]
     ])
     
-    response_text = f"""
-✅ **File Uploaded Successfully!**
-
-📁 **File:** {file_name}
-🔗 **Your Monetized Link:**
-{short_link}
-
-💰 Share this link and earn money for every view!
-
-**How it works:**
-1. Share the link with anyone
-2. They go through a secure verification process
-3. You earn money based on their location
-4. File is delivered automatically
-
-Start sharing now! 🚀
-"""
+    response_text = get_upload_success_text(file_name, short_link, get_link_limits_text(file_record))
     
     await message.reply_text(response_text, reply_markup=keyboard, disable_web_page_preview=True)
 
 
-@app.on_callback_query()
-async def callback_handler(client: Client, callback_query: CallbackQuery):
-    data = callback_query.data
+# Callback Routes
+@callbacks.route("menu_main")
+async def on_menu_main(client: Client, callback_query: CallbackQuery):
+    """Main Menu Navigation"""
+    menu_text, keyboard = await lanes.run(render_screen, 'main_menu', build_main_menu_screen, callback_query.from_user.id == ADMIN_ID)
+    await callback_query.message.edit_text(menu_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("menu_stats")
+async def on_menu_stats(client: Client, callback_query: CallbackQuery):
+    """Statistics"""
     user_id = callback_query.from_user.id
-    is_admin = user_id == ADMIN_ID
+    stats = await lanes.run(get_user_stats, user_id)
     
-    try:
-        # Main Menu Navigation
-        if data == "menu_main":
-            await callback_query.message.edit_text(
-                "📋 **Main Menu**\n\nChoose an option below:",
-                reply_markup=get_main_menu_keyboard(is_admin)
-            )
-            await callback_query.answer()
+    if not stats:
+        await callback_query.message.edit_text(
+            "📊 **Your Statistics**\n\nNo statistics available yet. Upload a file to get started!",
+            reply_markup=get_back_button()
+        )
+    else:
+        geo_text = ""
+        if stats.get('geo_breakdown'):
+            geo_text = "\n\n**📍 Views by Country:**\n"
+            for country, count in sorted(stats['geo_breakdown'].items(), key=lambda x: x[1], reverse=True)[:10]:
+                geo_text += f"• {country}: {count} views\n"
         
-        # Statistics
-        elif data == "menu_stats":
-            stats = get_user_stats(user_id)
-            
-            if not stats:
-                await callback_query.message.edit_text(
-                    "📊 **Your Statistics**\n\nNo statistics available yet. Upload a file to get started!",
-                    reply_markup=get_back_button()
-                )
-            else:
-                geo_text = ""
-                if stats.get('geo_breakdown'):
-                    geo_text = "\n\n**📍 Views by Country:**\n"
-                    for country, count in sorted(stats['geo_breakdown'].items(), key=lambda x: x[1], reverse=True)[:10]:
-                        geo_text += f"• {country}: {count} views\n"
-                
-                stats_text = f"""
+        unique_total, unique_today = await lanes.run(get_unique_counts, user_id)
+        
+        stats_text = f"""
 📊 **Your Statistics**
 
-💰 **Balance:** ${stats.get('balance', 0.0):.4f}
+💰 **Balance:** {format_money(stats.get('balance_micros', 0))}
 👁 **Total Views:** {stats.get('total_views', 0)}
+🧑 **Unique Visitors:** {unique_total} ({unique_today} today)
 📁 **Files Uploaded:** {stats.get('files_uploaded', 0)}
 {geo_text}
 
 Keep sharing your links to earn more! 🚀
 """
-                keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("💰 Withdraw", callback_data="menu_withdraw")],
-                    [InlineKeyboardButton("🔄 Refresh Stats", callback_data="menu_stats")],
-                    [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-                ])
-                await callback_query.message.edit_text(stats_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Withdraw Menu
-        elif data == "menu_withdraw":
-            stats = get_user_stats(user_id)
-            balance = stats.get('balance', 0) if stats else 0
-            
-            withdraw_text = f"""
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("💰 Withdraw", callback_data="menu_withdraw")],
+            [InlineKeyboardButton("🔄 Refresh Stats", callback_data="menu_stats")],
+            [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+        ])
+        await callback_query.message.edit_text(stats_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("menu_withdraw")
+async def on_menu_withdraw(client: Client, callback_query: CallbackQuery):
+    """Withdraw Menu"""
+    user_id = callback_query.from_user.id
+    stats = await lanes.run(get_user_stats, user_id)
+    balance = stats.get('balance_micros', 0) if stats else 0
+    
+    withdraw_text = f"""
 💰 **Withdrawal Request**
 
-**Available Balance:** ${balance:.4f}
-**Minimum Amount:** $5.00
-**Maximum Amount:** ${balance:.4f}
+**Available Balance:** {format_money(balance)}
+**Minimum Amount:** {format_money(MIN_WITHDRAWAL_MICROS, 2)}
+**Maximum Amount:** {format_money(balance)}
 
 **Supported Payment Methods:**
 • PayPal
@@ -310,502 +871,575 @@ Keep sharing your links to earn more! 🚀
 
 Your withdrawal will be processed within 24-48 hours.
 """
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📜 View History", callback_data="menu_history")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-            ])
-            
-            if balance < 5.0:
-                withdraw_text = f"""
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📜 View History", callback_data="menu_history")],
+        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+    ])
+    
+    if balance < MIN_WITHDRAWAL_MICROS:
+        withdraw_text = f"""
 ❌ **Insufficient Balance**
 
-**Your current balance:** ${balance:.4f}
-**Minimum withdrawal:** $5.00
+**Your current balance:** {format_money(balance)}
+**Minimum withdrawal:** {format_money(MIN_WITHDRAWAL_MICROS, 2)}
 
 Keep sharing your links to earn more! 💪
 """
-            
-            await callback_query.message.edit_text(withdraw_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Withdrawal History
-        elif data == "menu_history":
-            withdrawals = get_user_withdrawals(user_id)
-            
-            if not withdrawals:
-                history_text = """
+    
+    await callback_query.message.edit_text(withdraw_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("menu_history")
+async def on_menu_history(client: Client, callback_query: CallbackQuery):
+    """Withdrawal History"""
+    user_id = callback_query.from_user.id
+    withdrawals = await lanes.run(get_user_withdrawals, user_id)
+    
+    if not withdrawals:
+        history_text = """
 📜 **Withdrawal History**
 
 You haven't made any withdrawal requests yet.
 
 Use the menu below to request your first withdrawal!
 """
-            else:
-                history_text = "📜 **Withdrawal History**\n\n"
-                
-                for w in withdrawals[:10]:
-                    status_emoji = {
-                        'pending': '⏳',
-                        'approved': '✅',
-                        'rejected': '❌'
-                    }.get(w['status'], '❓')
-                    
-                    history_text += f"""
-{status_emoji} **${w['amount']:.2f}** - {w['status'].upper()}
+    else:
+        history_text = "📜 **Withdrawal History**\n\n"
+        
+        for w in withdrawals[:10]:
+            status_emoji = {
+                'pending': '⏳',
+                'approved': '✅',
+                'rejected': '❌'
+            }.get(w['status'], '❓')
+            
+            history_text += f"""
+{status_emoji} **{format_money(w['amount_micros'], 2)}** - {w['status'].upper()}
 Method: {w['payment_method']}
 Date: {w['created_at'].strftime('%Y-%m-%d %H:%M')}
 """
-                    if w.get('admin_note'):
-                        history_text += f"Note: {w['admin_note']}\n"
-                    history_text += "─────────────────\n"
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💰 New Withdrawal", callback_data="menu_withdraw")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-            ])
-            await callback_query.message.edit_text(history_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Help Menu
-        elif data == "menu_help":
-            help_text = """
-📖 **Help & Information**
+            if w.get('admin_note'):
+                history_text += f"Note: {w['admin_note']}\n"
+            history_text += "─────────────────\n"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💰 New Withdrawal", callback_data="menu_withdraw")],
+        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+    ])
+    await callback_query.message.edit_text(history_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-**Available Commands:**
-• /start - Start the bot & main menu
-• /menu - Show main menu
-• /withdraw <amount> <method> <details> - Request withdrawal
-• /admin - Admin panel (admins only)
 
-**How to Use:**
-1️⃣ Send any file to the bot
-2️⃣ Receive a monetized link
-3️⃣ Share the link
-4️⃣ Earn money from downloads
-5️⃣ Withdraw earnings when you reach minimum
+@callbacks.route("menu_help")
+async def on_menu_help(client: Client, callback_query: CallbackQuery):
+    """Help Menu"""
+    help_text, keyboard = await lanes.run(render_screen, 'menu_help', build_help_screen)
+    await callback_query.message.edit_text(help_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-**Earnings:**
-You earn based on visitor's country and our CPM rates.
 
-**Withdrawals:**
-• Minimum: $5.00
-• Methods: PayPal, Bank, Crypto
-• Processing: 24-48 hours
+@callbacks.route("help_cpm")
+async def on_help_cpm(client: Client, callback_query: CallbackQuery):
+    """CPM Rates Info"""
+    cpm_text, keyboard = await lanes.run(render_screen, 'help_cpm', build_cpm_screen)
+    await callback_query.message.edit_text(cpm_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-**Support:**
-For support, contact the admin.
+
+@callbacks.prefix("leaderboard_")
+async def on_leaderboard(client: Client, callback_query: CallbackQuery, value: str):
+    """Public Leaderboard"""
+    if value not in LEADERBOARD_PERIOD_LABELS:
+        await callback_query.answer()
+        return
+    leaderboard_text, keyboard = get_leaderboard_screen(value)
+    await callback_query.message.edit_text(leaderboard_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("menu_referral")
+async def on_menu_referral(client: Client, callback_query: CallbackQuery):
+    """Referral Program"""
+    user_id = callback_query.from_user.id
+    ref_stats = await lanes.run(get_referral_stats, user_id)
+    referral_link = f"https://t.me/{BOT_USERNAME}?start=ref_{user_id}"
+    
+    if len(REFERRAL_TIERS) > 1:
+        commission_text = ", ".join(f"{rate:.0%} (level {level})" for level, rate in enumerate(REFERRAL_TIERS, 1))
+    else:
+        commission_text = f"{REFERRAL_TIERS[0]:.0%}" if REFERRAL_TIERS else "0%"
+    ref_text = f"""
+👥 **Referral Program**
+
+💰 **Your Earnings:**
+• Referrals: {ref_stats.get('referral_count', 0)} people
+• Earnings: {format_money(ref_stats.get('referral_earnings_micros', 0))}
+
+🎁 **Benefits:**
+• Get $0.10 for each friend who joins!
+• Earn {commission_text} commission on their earnings!
+• Unlimited referrals!
+
+🔗 **Your Referral Link:**
+`{referral_link}`
+
+**How it works:**
+1️⃣ Share your link with friends
+2️⃣ They sign up using your link
+3️⃣ You earn bonus + {commission_text} of their earnings
+4️⃣ Withdraw your earnings anytime!
 """
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💵 View CPM Rates", callback_data="help_cpm")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-            ])
-            await callback_query.message.edit_text(help_text, reply_markup=keyboard)
-            await callback_query.answer()
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📋 Copy Link", url=referral_link)],
+        [InlineKeyboardButton("👥 View Referrals", callback_data="view_referrals")],
+        [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+    ])
+    await callback_query.message.edit_text(ref_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("view_referrals")
+async def on_view_referrals(client: Client, callback_query: CallbackQuery):
+    """View Referrals List"""
+    user_id = callback_query.from_user.id
+    ref_stats = await lanes.run(get_referral_stats, user_id)
+    referred_users = ref_stats.get('referred_users', [])
+    
+    if not referred_users:
+        ref_list_text = "👥 **Your Referrals**\n\nYou haven't referred anyone yet.\n\nShare your referral link to start earning!"
+    else:
+        ref_list_text = f"👥 **Your Referrals ({len(referred_users)})**\n\n"
+        for idx, ref_user in enumerate(referred_users[:20], 1):
+            username = ref_user.get('username', 'Unknown')
+            joined = ref_user.get('joined_at')
+            date_str = joined.strftime('%Y-%m-%d') if joined else 'N/A'
+            ref_list_text += f"{idx}. @{username} - {date_str}\n"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔙 Back to Referral", callback_data="menu_referral")],
+        [InlineKeyboardButton("📋 Main Menu", callback_data="menu_main")]
+    ])
+    await callback_query.message.edit_text(ref_list_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("menu_files")
+async def on_menu_files(client: Client, callback_query: CallbackQuery):
+    """File Manager"""
+    user_id = callback_query.from_user.id
+    files = await lanes.run(get_user_files, user_id, limit=10)
+    total_files = await lanes.run(get_file_count, user_id)
+    
+    if not files:
+        files_text = """
+📁 **My Files & Links**
+
+You haven't uploaded any files yet.
+
+Send me a file to get started!
+"""
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📤 Upload File", callback_data="upload_more")],
+            [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
+        ])
+    else:
+        files_text = f"📁 **My Files & Links** ({total_files} total)\n\n"
         
-        # CPM Rates Info
-        elif data == "help_cpm":
-            cpm_rates = get_cpm_rates()
-            cpm_text = "💵 **Current CPM Rates**\n\n"
-            
-            country_names = {
-                'US': '🇺🇸 United States',
-                'GB': '🇬🇧 United Kingdom',
-                'IN': '🇮🇳 India',
-                'OTHER': '🌍 Other Countries'
-            }
+        keyboard_buttons = []
+        for idx, file in enumerate(files, 1):
+            file_name = file.get('file_name', 'Unknown')[:30]
+            views = file.get('views', 0)
+            file_id = str(file.get('_id'))
             
-            for code, name in country_names.items():
-                rate = cpm_rates.get(code, 1.0)
-                cpm_text += f"{name}: ${rate:.2f} per 1000 views\n"
+            files_text += f"{idx}. **{file_name}**\n"
+            files_text += f"   👁 {views} views\n\n"
             
-            cpm_text += "\n**What is CPM?**\nCPM (Cost Per Mille) is the amount you earn per 1000 views from a specific country."
-            
-            await callback_query.message.edit_text(cpm_text, reply_markup=get_back_button("menu_help"))
-            await callback_query.answer()
+            keyboard_buttons.append([
+                InlineKeyboardButton(f"📊 {file_name[:15]}", callback_data=f"file_view_{file_id}"),
+                InlineKeyboardButton("🗑️", callback_data=f"file_delete_{file_id}")
+            ])
         
-        # Referral Program
-        elif data == "menu_referral":
-            ref_stats = get_referral_stats(user_id)
-            referral_link = f"https://t.me/{BOT_USERNAME}?start=ref_{user_id}"
-            
-            ref_text = f"""
-👥 **Referral Program**
+        keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")])
+        keyboard = InlineKeyboardMarkup(keyboard_buttons)
+    
+    await callback_query.message.edit_text(files_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-💰 **Your Earnings:**
-• Referrals: {ref_stats.get('referral_count', 0)} people
-• Earnings: ${ref_stats.get('referral_earnings', 0.0):.4f}
 
-🎁 **Benefits:**
-• Get $0.10 for each friend who joins!
-• Earn 10% commission on their earnings!
-• Unlimited referrals!
+@callbacks.prefix("file_view_")
+async def on_file_view(client: Client, callback_query: CallbackQuery, value: str):
+    """View File Details"""
+    file_id = value
+    file_stats = await lanes.run(get_file_stats, file_id)
+    
+    if not file_stats:
+        await callback_query.answer("File not found!", show_alert=True)
+        return
+    
+    geo_text = ""
+    if file_stats.get('geo_stats'):
+        geo_text = "\n\n**📍 Views by Country:**\n"
+        for country, count in sorted(file_stats['geo_stats'].items(), key=lambda x: x[1], reverse=True)[:5]:
+            geo_text += f"• {country}: {count} views\n"
+    
+    unique_total = await lanes.run(get_unique_visitors, file_sketch_key(file_stats.get('short_link_id')))
+    
+    file_detail_text = f"""
+📄 **File Details**
+
+**Name:** {file_stats.get('file_name')}
+**Views:** {file_stats.get('views', 0)}
+**Unique Visitors:** {unique_total}
+**Created:** {file_stats.get('created_at').strftime('%Y-%m-%d') if file_stats.get('created_at') else 'N/A'}
+{geo_text}
+
+**Link:** {file_stats.get('short_link')}
+"""
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔗 Copy Link", url=file_stats.get('short_link', ''))],
+        [InlineKeyboardButton("🗑️ Delete File", callback_data=f"file_delete_{file_id}")],
+        [InlineKeyboardButton("🔙 Back to Files", callback_data="menu_files")]
+    ])
+    await callback_query.message.edit_text(file_detail_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.prefix("file_delete_")
+async def on_file_delete(client: Client, callback_query: CallbackQuery, value: str):
+    """Delete File Confirmation"""
+    file_id = value
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Yes, Delete", callback_data=f"file_confirm_{file_id}")],
+        [InlineKeyboardButton("❌ Cancel", callback_data="menu_files")]
+    ])
+    
+    await callback_query.message.edit_text(
+        "🗑️ **Delete File**\n\nAre you sure you want to delete this file?\nThis action cannot be undone!",
+        reply_markup=keyboard
+    )
+    await callback_query.answer()
+
+
+@callbacks.prefix("file_confirm_")
+async def on_file_confirm(client: Client, callback_query: CallbackQuery, value: str):
+    """Confirm File Deletion"""
+    user_id = callback_query.from_user.id
+    file_id = value
+    
+    if await lanes.run(delete_file, file_id, user_id):
+        delivery_files.clear()
+        await callback_query.message.edit_text(
+            "✅ **File Deleted Successfully!**\n\nThe file and its link have been removed.",
+            reply_markup=get_back_button("menu_files")
+        )
+        await callback_query.answer("File deleted!")
+    else:
+        await callback_query.message.edit_text(
+            "❌ **Failed to Delete File**\n\nFile not found or you don't have permission.",
+            reply_markup=get_back_button("menu_files")
+        )
+        await callback_query.answer("Deletion failed!", show_alert=True)
+
+
+@callbacks.prefix("file_newlink_")
+async def on_file_newlink(client: Client, callback_query: CallbackQuery, value: str):
+    """Force a New Link for a Duplicate Upload"""
+    user_id = callback_query.from_user.id
+    existing = await lanes.run(get_file_by_short_link_id, value)
+    if not existing or existing['uploader_id'] != user_id:
+        await callback_query.answer("File not found!", show_alert=True)
+        return
+    
+    short_link_id = secrets.token_urlsafe(8)
+    short_link = f"{BASE_URL}/download/{short_link_id}"
+    await lanes.run(
+        create_file_record, existing['telegram_file_id'], existing['file_name'], user_id, short_link_id, short_link,
+        existing.get('file_type', 'document'), file_unique_id=existing.get('file_unique_id'), force_new=True,
+        file_size=existing.get('file_size')
+    )
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 View My Stats", callback_data="menu_stats")],
+        [InlineKeyboardButton("🔙 Main Menu", callback_data="menu_main")]
+    ])
+    await callback_query.message.edit_text(
+        get_upload_success_text(existing['file_name'], short_link),
+        reply_markup=keyboard,
+        disable_web_page_preview=True
+    )
+    await callback_query.answer("New link created!")
+
+
+@callbacks.route("upload_more")
+async def on_upload_more(client: Client, callback_query: CallbackQuery):
+    """Upload More"""
+    await callback_query.message.edit_text(
+        "📤 **Upload a File**\n\nSend me any file (document, video, photo, audio) to generate a monetized link!",
+        reply_markup=get_back_button()
+    )
+    await callback_query.answer("Send me a file now!")
+
+
+@callbacks.route("menu_admin", admin=True)
+async def on_menu_admin(client: Client, callback_query: CallbackQuery):
+    """Admin Panel"""
+    await callback_query.message.edit_text(
+        "👨‍💼 **Admin Panel**\n\nChoose an option below:",
+        reply_markup=get_admin_keyboard()
+    )
+    await callback_query.answer()
+
 
-🔗 **Your Referral Link:**
-`{referral_link}`
+@callbacks.route("admin_stats", admin=True)
+async def on_admin_stats(client: Client, callback_query: CallbackQuery):
+    """Admin Stats"""
+    totals = await lanes.run(get_money_totals)
+    
+    top_text = "\n**Top 5 Earners (All Time):**\n"
+    for idx, entry in enumerate(leaderboard.top('earners', 'all', 5), 1):
+        top_text += f"{idx}. @{entry.get('name') or 'Unknown'}: {format_money(entry['value'])}\n"
+    
+    admin_text = f"""
+📈 **System Statistics**
 
-**How it works:**
-1️⃣ Share your link with friends
-2️⃣ They sign up using your link
-3️⃣ You earn bonus + 10% of their earnings
-4️⃣ Withdraw your earnings anytime!
+👥 **Total Users:** {totals['users']}
+💰 **Total Payouts:** {format_money(totals['balance_micros'], 2)}
+👁 **Total Views:** {totals['views']}
+⏳ **Pending Withdrawals:** {totals['pending_count']} ({format_money(totals['pending_micros'], 2)})
+{top_text}
 """
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📋 Copy Link", url=referral_link)],
-                [InlineKeyboardButton("👥 View Referrals", callback_data="view_referrals")],
-                [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-            ])
-            await callback_query.message.edit_text(ref_text, reply_markup=keyboard)
-            await callback_query.answer()
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="admin_stats")],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
+    ])
+    await callback_query.message.edit_text(admin_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("admin_trending", admin=True)
+async def on_admin_trending(client: Client, callback_query: CallbackQuery):
+    """Admin Trending Files"""
+    trending_text = "🔥 **Trending Now**\n"
+    for window, label in (('hour', 'Last Hour'), ('day', 'Last 24 Hours')):
+        top_files = await lanes.run(get_trending, window, 'files', 10)
+        top_uploaders = await lanes.run(get_trending, window, 'uploaders', 5)
+        file_names = await lanes.run(get_file_names, [item for item, _ in top_files])
         
-        # View Referrals List
-        elif data == "view_referrals":
-            ref_stats = get_referral_stats(user_id)
-            referred_users = ref_stats.get('referred_users', [])
-            
-            if not referred_users:
-                ref_list_text = "👥 **Your Referrals**\n\nYou haven't referred anyone yet.\n\nShare your referral link to start earning!"
-            else:
-                ref_list_text = f"👥 **Your Referrals ({len(referred_users)})**\n\n"
-                for idx, ref_user in enumerate(referred_users[:20], 1):
-                    username = ref_user.get('username', 'Unknown')
-                    joined = ref_user.get('joined_at')
-                    date_str = joined.strftime('%Y-%m-%d') if joined else 'N/A'
-                    ref_list_text += f"{idx}. @{username} - {date_str}\n"
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 Back to Referral", callback_data="menu_referral")],
-                [InlineKeyboardButton("📋 Main Menu", callback_data="menu_main")]
-            ])
-            await callback_query.message.edit_text(ref_list_text, reply_markup=keyboard)
-            await callback_query.answer()
+        trending_text += f"\n**📈 {label} - Files:**\n"
+        if not top_files:
+            trending_text += "No views yet.\n"
+        for idx, (short_link_id, count) in enumerate(top_files, 1):
+            name = file_names.get(short_link_id, short_link_id)[:30]
+            trending_text += f"{idx}. {name}: {count} views\n"
         
-        # File Manager
-        elif data == "menu_files":
-            files = get_user_files(user_id, limit=10)
-            total_files = get_file_count(user_id)
-            
-            if not files:
-                files_text = """
-📁 **My Files & Links**
+        trending_text += f"\n**👤 {label} - Uploaders:**\n"
+        for idx, (uploader_id, count) in enumerate(top_uploaders, 1):
+            trending_text += f"{idx}. {uploader_id}: {count} views\n"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="admin_trending")],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
+    ])
+    await callback_query.message.edit_text(trending_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-You haven't uploaded any files yet.
 
-Send me a file to get started!
-"""
-                keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📤 Upload File", callback_data="upload_more")],
-                    [InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")]
-                ])
-            else:
-                files_text = f"📁 **My Files & Links** ({total_files} total)\n\n"
-                
-                keyboard_buttons = []
-                for idx, file in enumerate(files, 1):
-                    file_name = file.get('file_name', 'Unknown')[:30]
-                    views = file.get('views', 0)
-                    file_id = str(file.get('_id'))
-                    
-                    files_text += f"{idx}. **{file_name}**\n"
-                    files_text += f"   👁 {views} views\n\n"
-                    
-                    keyboard_buttons.append([
-                        InlineKeyboardButton(f"📊 {file_name[:15]}", callback_data=f"file_view_{file_id}"),
-                        InlineKeyboardButton("🗑️", callback_data=f"file_delete_{file_id}")
-                    ])
-                
-                keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="menu_main")])
-                keyboard = InlineKeyboardMarkup(keyboard_buttons)
-            
-            await callback_query.message.edit_text(files_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # View File Details
-        elif data.startswith("file_view_"):
-            file_id = data.replace("file_view_", "")
-            file_stats = get_file_stats(file_id)
-            
-            if not file_stats:
-                await callback_query.answer("File not found!", show_alert=True)
-                return
-            
-            geo_text = ""
-            if file_stats.get('geo_stats'):
-                geo_text = "\n\n**📍 Views by Country:**\n"
-                for country, count in sorted(file_stats['geo_stats'].items(), key=lambda x: x[1], reverse=True)[:5]:
-                    geo_text += f"• {country}: {count} views\n"
-            
-            file_detail_text = f"""
-📄 **File Details**
+@callbacks.route("admin_fraud", admin=True)
+async def on_admin_fraud(client: Client, callback_query: CallbackQuery):
+    """Admin Fraud Review"""
+    await callback_query.message.edit_text(*await lanes.run(get_fraud_review_screen))
+    await callback_query.answer()
 
-**Name:** {file_stats.get('file_name')}
-**Views:** {file_stats.get('views', 0)}
-**Created:** {file_stats.get('created_at').strftime('%Y-%m-%d') if file_stats.get('created_at') else 'N/A'}
-{geo_text}
 
-**Link:** {file_stats.get('short_link')}
-"""
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔗 Copy Link", url=file_stats.get('short_link', ''))],
-                [InlineKeyboardButton("🗑️ Delete File", callback_data=f"file_delete_{file_id}")],
-                [InlineKeyboardButton("🔙 Back to Files", callback_data="menu_files")]
-            ])
-            await callback_query.message.edit_text(file_detail_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Delete File Confirmation
-        elif data.startswith("file_delete_"):
-            file_id = data.replace("file_delete_", "")
-            
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Yes, Delete", callback_data=f"file_confirm_{file_id}")],
-                [InlineKeyboardButton("❌ Cancel", callback_data="menu_files")]
-            ])
-            
-            await callback_query.message.edit_text(
-                "🗑️ **Delete File**\n\nAre you sure you want to delete this file?\nThis action cannot be undone!",
-                reply_markup=keyboard
-            )
-            await callback_query.answer()
-        
-        # Confirm File Deletion
-        elif data.startswith("file_confirm_"):
-            file_id = data.replace("file_confirm_", "")
-            
-            if delete_file(file_id, user_id):
-                await callback_query.message.edit_text(
-                    "✅ **File Deleted Successfully!**\n\nThe file and its link have been removed.",
-                    reply_markup=get_back_button("menu_files")
-                )
-                await callback_query.answer("File deleted!")
-            else:
-                await callback_query.message.edit_text(
-                    "❌ **Failed to Delete File**\n\nFile not found or you don't have permission.",
-                    reply_markup=get_back_button("menu_files")
-                )
-                await callback_query.answer("Deletion failed!", show_alert=True)
-        
-        # Upload More
-        elif data == "upload_more":
-            await callback_query.message.edit_text(
-                "📤 **Upload a File**\n\nSend me any file (document, video, photo, audio) to generate a monetized link!",
-                reply_markup=get_back_button()
-            )
-            await callback_query.answer("Send me a file now!")
-        
-        # Admin Panel
-        elif data == "menu_admin":
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            await callback_query.message.edit_text(
-                "👨‍💼 **Admin Panel**\n\nChoose an option below:",
-                reply_markup=get_admin_keyboard()
-            )
-            await callback_query.answer()
-        
-        # Admin Stats
-        elif data == "admin_stats":
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            all_stats = get_all_users_stats()
-            total_users = len(all_stats)
-            total_balance = sum(user.get('balance', 0) for user in all_stats)
-            total_views = sum(user.get('total_views', 0) for user in all_stats)
-            
-            pending_withdrawals = get_pending_withdrawals()
-            pending_count = len(pending_withdrawals)
-            pending_amount = sum(w.get('amount', 0) for w in pending_withdrawals)
-            
-            top_users = sorted(all_stats, key=lambda x: x.get('balance', 0), reverse=True)[:5]
-            
-            top_text = "\n**Top 5 Earners:**\n"
-            for idx, user in enumerate(top_users, 1):
-                username = user.get('username', 'Unknown')
-                balance = user.get('balance', 0)
-                top_text += f"{idx}. @{username}: ${balance:.4f}\n"
-            
-            admin_text = f"""
-📈 **System Statistics**
+@callbacks.prefix("fraud_release_", admin=True)
+async def on_fraud_release(client: Client, callback_query: CallbackQuery, value: str):
+    """Release Held Views"""
+    count = await lanes.run(release_held_views, int(value))
+    await callback_query.answer(f"✅ Released {count} views", show_alert=True)
+    await callback_query.message.edit_text(*await lanes.run(get_fraud_review_screen))
 
-👥 **Total Users:** {total_users}
-💰 **Total Payouts:** ${total_balance:.2f}
-👁 **Total Views:** {total_views}
-⏳ **Pending Withdrawals:** {pending_count} (${pending_amount:.2f})
-{top_text}
+
+@callbacks.prefix("fraud_discard_", admin=True)
+async def on_fraud_discard(client: Client, callback_query: CallbackQuery, value: str):
+    """Discard Held Views"""
+    count = await lanes.run(discard_held_views, int(value))
+    await callback_query.answer(f"🗑️ Discarded {count} views", show_alert=True)
+    await callback_query.message.edit_text(*await lanes.run(get_fraud_review_screen))
+
+
+@callbacks.route("admin_queue", admin=True)
+async def on_admin_queue(client: Client, callback_query: CallbackQuery):
+    """Admin Send Queue Metrics"""
+    queue_stats = outbox.stats()
+    queue_text = f"""
+📬 **Outbound Send Queue**
+
+📥 **Queue Depth:** {queue_stats['depth']}
+👷 **Workers:** {queue_stats['workers']}
+✅ **Sent:** {queue_stats['sent']}
+❌ **Failed:** {queue_stats['failed']}
+⏳ **Flood Waits:** {queue_stats['flood_waits']}
+⏱ **Latency:** {queue_stats['latency_avg_ms']:.0f} ms avg, {queue_stats['latency_max_ms']:.0f} ms max
+
+🚦 **Concurrency Lanes:**
 """
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔄 Refresh", callback_data="admin_stats")],
-                [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
-            ])
-            await callback_query.message.edit_text(admin_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Admin CPM Management
-        elif data == "admin_cpm":
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            cpm_rates = get_cpm_rates()
-            cpm_text = "💵 **CPM Rate Management**\n\n**Current Rates:**\n\n"
-            
-            for country, rate in cpm_rates.items():
-                cpm_text += f"• {country}: ${rate}\n"
-            
-            cpm_text += "\n**To update rates, use:**\n`/setcpm <COUNTRY> <RATE>`\n\n**Example:**\n`/setcpm US 6.0`"
-            
-            await callback_query.message.edit_text(cpm_text, reply_markup=get_back_button("menu_admin"))
-            await callback_query.answer()
-        
-        # Admin Withdrawals
-        elif data == "admin_withdrawals":
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            pending = get_pending_withdrawals()
-            
-            if not pending:
-                await callback_query.message.edit_text(
-                    "📋 **Pending Withdrawals**\n\nNo pending withdrawal requests.",
-                    reply_markup=get_back_button("menu_admin")
-                )
-            else:
-                withdrawals_text = f"📋 **Pending Withdrawals ({len(pending)})**\n\n"
-                keyboard_buttons = []
-                
-                for idx, w in enumerate(pending[:10], 1):
-                    withdrawal_id = str(w['_id'])
-                    withdrawals_text += f"""
-**#{idx} - ID:** `{withdrawal_id[:8]}...`
-👤 User: {w['user_id']}
-💰 Amount: ${w['amount']:.2f}
-💳 Method: {w['payment_method']}
-📝 Details: {w['payment_details']}
-📅 Date: {w['created_at'].strftime('%Y-%m-%d %H:%M')}
-─────────────────────
+    for name, lane in lanes.stats().items():
+        queue_text += f"• {name}: {lane['active']}/{lane['limit']} active, {lane['waiting']} waiting\n"
+    queue_text += f"\n🛑 **Throttled:** {throttled['messages']} messages, {throttled['callbacks']} button presses\n"
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="admin_queue")],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
+    ])
+    await callback_query.message.edit_text(queue_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("admin_routes", admin=True)
+async def on_admin_routes(client: Client, callback_query: CallbackQuery):
+    """Admin Callback Route Timings"""
+    routes_text = "⏱ **Route Timings**\n\nSlowest screens first (since restart):\n\n"
+    route_stats = callbacks.stats()
+    
+    if not route_stats:
+        routes_text += "No button presses recorded yet."
+    for entry in route_stats[:15]:
+        routes_text += f"• `{entry['route']}`: {entry['avg_ms']:.1f} ms avg, {entry['max_ms']:.0f} ms max, {entry['calls']} calls"
+        if entry['errors']:
+            routes_text += f", ❌ {entry['errors']} errors"
+        routes_text += "\n"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="admin_routes")],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
+    ])
+    await callback_query.message.edit_text(routes_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("admin_jobs", admin=True)
+async def on_admin_jobs(client: Client, callback_query: CallbackQuery):
+    """Admin Scheduled Jobs"""
+    jobs_text = "⏰ **Scheduled Jobs**\n\nDurations since restart:\n"
+    for job in scheduler.stats():
+        status = "🟢 running" if job['running'] else "⚪ idle"
+        last_run = job['last_run_at'].strftime('%H:%M:%S') if job['last_run_at'] else "never"
+        next_run = job['next_run_at'].strftime('%H:%M:%S') if job['next_run_at'] else "-"
+        jobs_text += f"""
+**{job['name']}** ({job['schedule']}{', locked' if job['distributed'] else ''}) {status}
+⏱ {job['avg_ms']:.0f} ms avg, {job['max_ms']:.0f} ms max, {job['runs']} runs
+🕐 Last: {last_run} • Next: {next_run} UTC
 """
-                    keyboard_buttons.append([
-                        InlineKeyboardButton(f"✅ Approve #{idx}", callback_data=f"withdrawal_approve_{withdrawal_id}"),
-                        InlineKeyboardButton(f"❌ Reject #{idx}", callback_data=f"withdrawal_reject_{withdrawal_id}")
-                    ])
-                
-                keyboard_buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_withdrawals")])
-                keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")])
-                keyboard = InlineKeyboardMarkup(keyboard_buttons)
-                await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
-            await callback_query.answer()
-        
-        # Approve Withdrawal
-        elif data.startswith("withdrawal_approve_"):
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            withdrawal_id = data.replace("withdrawal_approve_", "")
-            
-            # Get withdrawal details before approving
-            withdrawal = get_withdrawal_by_id(withdrawal_id)
-            
-            if withdrawal and approve_withdrawal(withdrawal_id):
-                # Send notification to user
-                try:
-                    user_notification_keyboard = InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📊 View Stats", callback_data="menu_stats")],
-                        [InlineKeyboardButton("📜 View History", callback_data="menu_history")]
-                    ])
-                    
-                    await client.send_message(
-                        withdrawal['user_id'],
-                        f"""
-✅ **Withdrawal Approved!**
+        skipped = job['skipped_overlap'] + job['skipped_lock']
+        if job['failures'] or skipped:
+            jobs_text += f"❌ {job['failures']} failed • ⏭ {skipped} skipped\n"
+        if job['last_error']:
+            jobs_text += f"Last error: `{job['last_error'][:100]}`\n"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data="admin_jobs")],
+        [InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")]
+    ])
+    await callback_query.message.edit_text(jobs_text, reply_markup=keyboard)
+    await callback_query.answer()
 
-Your withdrawal request has been approved!
 
-💰 **Amount:** ${withdrawal['amount']:.2f}
-💳 **Method:** {withdrawal['payment_method']}
-📝 **Details:** {withdrawal['payment_details']}
-📅 **Approved:** {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}
+@callbacks.route("admin_cpm", admin=True)
+async def on_admin_cpm(client: Client, callback_query: CallbackQuery):
+    """Admin CPM Management"""
+    cpm_rates = await lanes.run(get_cpm_rates)
+    cpm_text = "💵 **CPM Rate Management**\n\n**Current Rates:**\n\n"
+    
+    for country, rate in cpm_rates.items():
+        cpm_text += f"• {country}: ${rate}\n"
+    
+    cpm_text += "\n**To update rates, use:**\n`/setcpm <COUNTRY> <RATE>`\n\n**Example:**\n`/setcpm US 6.0`"
+    
+    await callback_query.message.edit_text(cpm_text, reply_markup=get_back_button("menu_admin"))
+    await callback_query.answer()
 
-The payment will be processed to your account shortly.
 
-Thank you for using our service! 🎉
-""",
-                        reply_markup=user_notification_keyboard
-                    )
-                except Exception as e:
-                    print(f"Failed to send notification to user: {e}")
-                
-                await callback_query.answer("✅ Withdrawal approved!", show_alert=True)
-                
-                # Refresh the withdrawals list
-                pending = get_pending_withdrawals()
-                
-                if not pending:
-                    await callback_query.message.edit_text(
-                        "📋 **Pending Withdrawals**\n\n✅ Withdrawal approved successfully!\n\nNo more pending withdrawal requests.",
-                        reply_markup=get_back_button("menu_admin")
-                    )
-                else:
-                    withdrawals_text = f"📋 **Pending Withdrawals ({len(pending)})**\n\n✅ Last action: Approved withdrawal\n\n"
-                    keyboard_buttons = []
-                    
-                    for idx, w in enumerate(pending[:10], 1):
-                        wid = str(w['_id'])
-                        withdrawals_text += f"""
-**#{idx} - ID:** `{wid[:8]}...`
-👤 User: {w['user_id']}
-💰 Amount: ${w['amount']:.2f}
-💳 Method: {w['payment_method']}
-📝 Details: {w['payment_details']}
-📅 Date: {w['created_at'].strftime('%Y-%m-%d %H:%M')}
-─────────────────────
-"""
-                        keyboard_buttons.append([
-                            InlineKeyboardButton(f"✅ Approve #{idx}", callback_data=f"withdrawal_approve_{wid}"),
-                            InlineKeyboardButton(f"❌ Reject #{idx}", callback_data=f"withdrawal_reject_{wid}")
-                        ])
-                    
-                    keyboard_buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_withdrawals")])
-                    keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")])
-                    keyboard = InlineKeyboardMarkup(keyboard_buttons)
-                    await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
-            else:
-                await callback_query.answer("❌ Failed to approve withdrawal!", show_alert=True)
+@callbacks.prefix("admin_leaderboard_", admin=True)
+async def on_admin_leaderboard(client: Client, callback_query: CallbackQuery, value: str):
+    """Admin Leaderboard, with user IDs"""
+    if value not in LEADERBOARD_PERIOD_LABELS:
+        await callback_query.answer()
+        return
+    leaderboard_text, keyboard = get_leaderboard_screen(value, admin=True)
+    await callback_query.message.edit_text(leaderboard_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.route("admin_withdrawals", admin=True)
+async def on_admin_withdrawals(client: Client, callback_query: CallbackQuery):
+    """Admin Withdrawals"""
+    withdrawals_text, keyboard = await lanes.run(get_withdrawals_screen)
+    await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.prefix("withdrawals_page_", admin=True)
+async def on_withdrawals_page(client: Client, callback_query: CallbackQuery, value: str):
+    """Next page of pending withdrawals"""
+    withdrawals_text, keyboard = await lanes.run(get_withdrawals_screen, value)
+    await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+@callbacks.prefix("withdrawal_approve_", admin=True)
+async def on_withdrawal_approve(client: Client, callback_query: CallbackQuery, value: str):
+    """Approve Withdrawal"""
+    withdrawal_id = value
+    
+    # Get withdrawal details before approving
+    withdrawal = await lanes.run(get_withdrawal_by_id, withdrawal_id)
+    
+    if withdrawal and await lanes.run(approve_withdrawal, withdrawal_id):
+        # Send notification to user
+        user_notification_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📊 View Stats", callback_data="menu_stats")],
+            [InlineKeyboardButton("📜 View History", callback_data="menu_history")]
+        ])
+        notification_text = get_approval_notification(withdrawal)
+        log_failure(outbox.submit(
+            withdrawal['user_id'],
+            lambda: client.send_message(withdrawal['user_id'], notification_text, reply_markup=user_notification_keyboard),
+            PRIORITY_NOTIFICATION
+        ), "approval notification")
         
-        # Reject Withdrawal
-        elif data.startswith("withdrawal_reject_"):
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            withdrawal_id = data.replace("withdrawal_reject_", "")
-            
-            # Get withdrawal details before rejecting
-            withdrawal = get_withdrawal_by_id(withdrawal_id)
-            
-            if withdrawal and reject_withdrawal(withdrawal_id):
-                # Send notification to user
-                try:
-                    user_notification_keyboard = InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📊 View Stats", callback_data="menu_stats")],
-                        [InlineKeyboardButton("💰 Try Again", callback_data="menu_withdraw")]
-                    ])
-                    
-                    await client.send_message(
-                        withdrawal['user_id'],
-                        f"""
+        await callback_query.answer("✅ Withdrawal approved!", show_alert=True)
+        
+        # Refresh the withdrawals list
+        withdrawals_text, keyboard = await lanes.run(get_withdrawals_screen, notice="✅ Last action: Approved withdrawal\n\n")
+        await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
+    else:
+        await callback_query.answer("❌ Failed to approve withdrawal!", show_alert=True)
+
+
+@callbacks.prefix("withdrawal_reject_", admin=True)
+async def on_withdrawal_reject(client: Client, callback_query: CallbackQuery, value: str):
+    """Reject Withdrawal"""
+    withdrawal_id = value
+    
+    # Get withdrawal details before rejecting
+    withdrawal = await lanes.run(get_withdrawal_by_id, withdrawal_id)
+    
+    if withdrawal and await lanes.run(reject_withdrawal, withdrawal_id):
+        # Send notification to user
+        user_notification_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📊 View Stats", callback_data="menu_stats")],
+            [InlineKeyboardButton("💰 Try Again", callback_data="menu_withdraw")]
+        ])
+        notification_text = f"""
 ❌ **Withdrawal Rejected**
 
 Unfortunately, your withdrawal request has been rejected.
 
-💰 **Amount:** ${withdrawal['amount']:.2f}
+💰 **Amount:** {format_money(withdrawal['amount_micros'], 2)}
 💳 **Method:** {withdrawal['payment_method']}
 📝 **Details:** {withdrawal['payment_details']}
 📅 **Processed:** {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}
@@ -813,89 +1447,69 @@ Unfortunately, your withdrawal request has been rejected.
 **Reason:** The withdrawal did not meet our requirements.
 
 Please check your account details and try again. If you have questions, contact support.
-""",
-                        reply_markup=user_notification_keyboard
-                    )
-                except Exception as e:
-                    print(f"Failed to send notification to user: {e}")
-                
-                await callback_query.answer("❌ Withdrawal rejected!", show_alert=True)
-                
-                # Refresh the withdrawals list
-                pending = get_pending_withdrawals()
-                
-                if not pending:
-                    await callback_query.message.edit_text(
-                        "📋 **Pending Withdrawals**\n\n❌ Withdrawal rejected successfully!\n\nNo more pending withdrawal requests.",
-                        reply_markup=get_back_button("menu_admin")
-                    )
-                else:
-                    withdrawals_text = f"📋 **Pending Withdrawals ({len(pending)})**\n\n❌ Last action: Rejected withdrawal\n\n"
-                    keyboard_buttons = []
-                    
-                    for idx, w in enumerate(pending[:10], 1):
-                        wid = str(w['_id'])
-                        withdrawals_text += f"""
-**#{idx} - ID:** `{wid[:8]}...`
-👤 User: {w['user_id']}
-💰 Amount: ${w['amount']:.2f}
-💳 Method: {w['payment_method']}
-📝 Details: {w['payment_details']}
-📅 Date: {w['created_at'].strftime('%Y-%m-%d %H:%M')}
-─────────────────────
 """
-                        keyboard_buttons.append([
-                            InlineKeyboardButton(f"✅ Approve #{idx}", callback_data=f"withdrawal_approve_{wid}"),
-                            InlineKeyboardButton(f"❌ Reject #{idx}", callback_data=f"withdrawal_reject_{wid}")
-                        ])
-                    
-                    keyboard_buttons.append([InlineKeyboardButton("🔄 Refresh", callback_data="admin_withdrawals")])
-                    keyboard_buttons.append([InlineKeyboardButton("🔙 Back to Admin", callback_data="menu_admin")])
-                    keyboard = InlineKeyboardMarkup(keyboard_buttons)
-                    await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
-            else:
-                await callback_query.answer("❌ Failed to reject withdrawal!", show_alert=True)
-        
-        # Admin Ads Management
-        elif data == "admin_ads":
-            if user_id != ADMIN_ID:
-                await callback_query.answer("❌ Admin only!", show_alert=True)
-                return
-            
-            ad_codes = get_ad_codes()
-            
-            status_text = "📺 **Ad Codes Management**\n\n"
-            ad_types = {
-                'popunder': '🔄 Popunder',
-                'banner': '📊 Banner',
-                'native': '🎯 Native',
-                'smartlink': '🔗 Smartlink',
-                'social_bar': '📱 Social Bar'
-            }
-            
-            for ad_type, label in ad_types.items():
-                code = ad_codes.get(ad_type, '')
-                status = "✅ Active" if code else "❌ Not Set"
-                status_text += f"{label}: {status}\n"
-            
-            status_text += "\n**Commands:**\n`/ads set <type>` - Set ad\n`/ads remove <type>` - Remove ad\n\n**Types:** popunder, banner, native, smartlink, social_bar"
-            
-            await callback_query.message.edit_text(status_text, reply_markup=get_back_button("menu_admin"))
-            await callback_query.answer()
+        log_failure(outbox.submit(
+            withdrawal['user_id'],
+            lambda: client.send_message(withdrawal['user_id'], notification_text, reply_markup=user_notification_keyboard),
+            PRIORITY_NOTIFICATION
+        ), "rejection notification")
         
-        # Cancel Operation
-        elif data == "cancel":
-            if user_id in user_sessions:
-                del user_sessions[user_id]
-            await callback_query.message.edit_text(
-                "❌ **Operation Cancelled**",
-                reply_markup=get_back_button()
-            )
-            await callback_query.answer("Operation cancelled")
+        await callback_query.answer("❌ Withdrawal rejected!", show_alert=True)
         
-        else:
-            await callback_query.answer("Unknown action")
+        # Refresh the withdrawals list
+        withdrawals_text, keyboard = await lanes.run(get_withdrawals_screen, notice="❌ Last action: Rejected withdrawal\n\n")
+        await callback_query.message.edit_text(withdrawals_text, reply_markup=keyboard)
+    else:
+        await callback_query.answer("❌ Failed to reject withdrawal!", show_alert=True)
+
+
+@callbacks.route("admin_ads", admin=True)
+async def on_admin_ads(client: Client, callback_query: CallbackQuery):
+    """Admin Ads Management"""
+    ad_codes = await lanes.run(get_ad_codes)
+    
+    status_text = "📺 **Ad Codes Management**\n\n"
+    ad_types = {
+        'popunder': '🔄 Popunder',
+        'banner': '📊 Banner',
+        'native': '🎯 Native',
+        'smartlink': '🔗 Smartlink',
+        'social_bar': '📱 Social Bar'
+    }
     
+    for ad_type, label in ad_types.items():
+        code = ad_codes.get(ad_type, '')
+        status = "✅ Active" if code else "❌ Not Set"
+        status_text += f"{label}: {status}\n"
+    
+    status_text += "\n**Commands:**\n`/ads set <type>` - Set ad\n`/ads remove <type>` - Remove ad\n\n**Types:** popunder, banner, native, smartlink, social_bar"
+    
+    await callback_query.message.edit_text(status_text, reply_markup=get_back_button("menu_admin"))
+    await callback_query.answer()
+
+
+@callbacks.route("cancel")
+async def on_cancel(client: Client, callback_query: CallbackQuery):
+    """Cancel Operation"""
+    user_id = callback_query.from_user.id
+    await lanes.run(conversations.delete, user_id)
+    await callback_query.message.edit_text(
+        "❌ **Operation Cancelled**",
+        reply_markup=get_back_button()
+    )
+    await callback_query.answer("Operation cancelled")
+
+
+@app.on_callback_query()
+async def callback_handler(client: Client, callback_query: CallbackQuery):
+    # Run as a task so waiting for the route's lane doesn't hold a dispatcher worker
+    lanes.detach(handle_callback(client, callback_query), "callback handler")
+
+
+async def handle_callback(client: Client, callback_query: CallbackQuery):
+    try:
+        if not await callbacks.dispatch(client, callback_query):
+            await callback_query.answer("Unknown action")
     except Exception as e:
         print(f"Callback error: {e}")
         await callback_query.answer("An error occurred", show_alert=True)
@@ -903,6 +1517,7 @@ Please check your account details and try again. If you have questions, contact
 
 # Legacy command handlers for backward compatibility
 @app.on_message(filters.command("help"))
+@lanes.spawn('menus')
 async def help_command(client: Client, message: Message):
     await message.reply_text(
         "📖 **Help & Information**\n\nUse the menu below to navigate:",
@@ -911,6 +1526,7 @@ async def help_command(client: Client, message: Message):
 
 
 @app.on_message(filters.command("stats"))
+@lanes.spawn('menus')
 async def stats_command(client: Client, message: Message):
     await message.reply_text(
         "📊 **Your Statistics**\n\nClick below to view your stats:",
@@ -918,7 +1534,15 @@ async def stats_command(client: Client, message: Message):
     )
 
 
+@app.on_message(filters.command("leaderboard"))
+@lanes.spawn('menus')
+async def leaderboard_command(client: Client, message: Message):
+    leaderboard_text, keyboard = get_leaderboard_screen('day')
+    await message.reply_text(leaderboard_text, reply_markup=keyboard)
+
+
 @app.on_message(filters.command("admin"))
+@lanes.spawn('admin')
 async def admin_command(client: Client, message: Message):
     user_id = message.from_user.id
     
@@ -933,6 +1557,7 @@ async def admin_command(client: Client, message: Message):
 
 
 @app.on_message(filters.command("setcpm"))
+@lanes.spawn('admin')
 async def setcpm_handler(client: Client, message: Message):
     user_id = message.from_user.id
     
@@ -954,9 +1579,10 @@ async def setcpm_handler(client: Client, message: Message):
         country = message.command[1].upper()
         rate = float(message.command[2])
         
-        current_rates = get_cpm_rates()
+        current_rates = await lanes.run(get_cpm_rates)
         current_rates[country] = rate
-        update_cpm_rates(current_rates)
+        await lanes.run(update_cpm_rates, current_rates)
+        invalidate_screens()
         
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("💵 View All Rates", callback_data="admin_cpm")],
@@ -979,33 +1605,36 @@ async def setcpm_handler(client: Client, message: Message):
 
 
 @app.on_message(filters.command("withdraw"))
+@lanes.spawn('menus')
 async def withdraw_handler(client: Client, message: Message):
     user_id = message.from_user.id
-    stats = get_user_stats(user_id)
+    # Requests are checked against the live balance, not the cached one
+    submitting = len(message.command) >= 4
+    stats = await lanes.run(get_user_stats, user_id, use_cache=not submitting)
     
-    balance = stats.get('balance', 0) if stats else 0
+    balance = stats.get('balance_micros', 0) if stats else 0
     
-    if len(message.command) >= 4:
+    if submitting:
         try:
-            amount = float(message.command[1])
+            amount = to_micros(message.command[1])
             method = message.command[2]
             details = ' '.join(message.command[3:])
             
-            if amount < 5.0:
+            if amount < MIN_WITHDRAWAL_MICROS:
                 await message.reply_text(
-                    "❌ Minimum withdrawal amount is $5.00",
+                    f"❌ Minimum withdrawal amount is {format_money(MIN_WITHDRAWAL_MICROS, 2)}",
                     reply_markup=get_back_button()
                 )
                 return
             
             if amount > balance:
                 await message.reply_text(
-                    f"❌ Insufficient balance. You have ${balance:.4f}",
+                    f"❌ Insufficient balance. You have {format_money(balance)}",
                     reply_markup=get_back_button()
                 )
                 return
             
-            withdrawal = create_withdrawal_request(user_id, amount, method, details)
+            withdrawal = await lanes.run(create_withdrawal_request, user_id, amount, method, details)
             
             if withdrawal:
                 keyboard = InlineKeyboardMarkup([
@@ -1017,7 +1646,7 @@ async def withdraw_handler(client: Client, message: Message):
                     f"""
 ✅ **Withdrawal Request Submitted!**
 
-**Amount:** ${amount:.2f}
+**Amount:** {format_money(amount, 2)}
 **Method:** {method}
 **Status:** Pending Admin Approval
 
@@ -1027,22 +1656,21 @@ You will be notified once it's approved.
                     reply_markup=keyboard
                 )
                 
-                try:
-                    await client.send_message(
-                        ADMIN_ID,
-                        f"""
+                admin_text = f"""
 🔔 **New Withdrawal Request**
 
 User ID: {user_id}
-Amount: ${amount:.2f}
+Amount: {format_money(amount, 2)}
 Method: {method}
 Details: {details}
 
 Use /withdrawals to manage requests.
 """
-                    )
-                except:
-                    pass
+                log_failure(outbox.submit(
+                    ADMIN_ID,
+                    lambda: client.send_message(ADMIN_ID, admin_text),
+                    PRIORITY_NOTIFICATION
+                ), "admin withdrawal notification")
             else:
                 await message.reply_text(
                     "❌ Failed to create withdrawal request. Please try again.",
@@ -1067,6 +1695,7 @@ Use /withdrawals to manage requests.
 
 
 @app.on_message(filters.command("history"))
+@lanes.spawn('menus')
 async def history_command(client: Client, message: Message):
     await message.reply_text(
         "📜 **Withdrawal History**\n\nClick below to view your history:",
@@ -1074,7 +1703,60 @@ async def history_command(client: Client, message: Message):
     )
 
 
+def notify_approved(client: Client, approved: List[Dict]):
+    """Queue an approval message for each withdrawal of a settled batch"""
+    user_notification_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📊 View Stats", callback_data="menu_stats")],
+        [InlineKeyboardButton("📜 View History", callback_data="menu_history")]
+    ])
+    for withdrawal in approved:
+        notification_text = get_approval_notification(withdrawal)
+        log_failure(outbox.submit(
+            withdrawal['user_id'],
+            lambda w=withdrawal, text=notification_text: client.send_message(
+                w['user_id'], text, reply_markup=user_notification_keyboard
+            ),
+            PRIORITY_NOTIFICATION
+        ), "approval notification")
+
+
+async def run_payout_batch(client: Client, message: Message, args: List[str]):
+    """Approve matching pending withdrawals and send one payout CSV per method"""
+    try:
+        method = None if args[0].lower() == 'all' else args[0]
+        min_micros = to_micros(args[1]) if len(args) > 1 else None
+        max_micros = to_micros(args[2]) if len(args) > 2 else None
+    except ValueError:
+        await message.reply_text("❌ Invalid amount. Use: /withdrawals batch <method|all> [min] [max]")
+        return
+    
+    result = await lanes.run(approve_withdrawals_batch, method, min_micros, max_micros, PAYOUT_BATCH_LIMIT)
+    approved = result['approved']
+    if not approved:
+        returned = f"\n{result['returned']} request(s) left pending: insufficient balance." if result['returned'] else ""
+        await message.reply_text(f"📋 No matching withdrawals were approved.{returned}")
+        return
+    
+    notify_approved(client, approved)
+    
+    await message.reply_text(f"""
+✅ **Payout Batch Approved**
+
+🆔 Batch: `{result['batch_id']}`
+📋 Approved: {len(approved)}
+💰 Total: {format_money(result['amount_micros'], 2)}
+↩️ Left pending (insufficient balance): {result['returned']}
+""")
+    
+    for payment_method in await lanes.run(get_payout_methods, result['batch_id']):
+        csv_bytes = await lanes.run(lambda: b''.join(export_payouts(result['batch_id'], payment_method)))
+        document = io.BytesIO(csv_bytes)
+        document.name = f"payouts-{result['batch_id']}-{payment_method}.csv"
+        await message.reply_document(document, caption=f"💳 {payment_method}")
+
+
 @app.on_message(filters.command("withdrawals"))
+@lanes.spawn('admin')
 async def withdrawals_admin_handler(client: Client, message: Message):
     user_id = message.from_user.id
     
@@ -1085,6 +1767,10 @@ async def withdrawals_admin_handler(client: Client, message: Message):
         )
         return
     
+    if len(message.command) >= 3 and message.command[1].lower() == 'batch':
+        await run_payout_batch(client, message, message.command[2:])
+        return
+    
     if len(message.command) >= 3:
         action = message.command[1].lower()
         withdrawal_id = message.command[2]
@@ -1096,7 +1782,7 @@ async def withdrawals_admin_handler(client: Client, message: Message):
         ])
         
         if action == 'approve':
-            if approve_withdrawal(withdrawal_id, note):
+            if await lanes.run(approve_withdrawal, withdrawal_id, note):
                 await message.reply_text(
                     f"✅ Withdrawal {withdrawal_id} approved!",
                     reply_markup=keyboard
@@ -1107,7 +1793,7 @@ async def withdrawals_admin_handler(client: Client, message: Message):
                     reply_markup=keyboard
                 )
         elif action == 'reject':
-            if reject_withdrawal(withdrawal_id, note):
+            if await lanes.run(reject_withdrawal, withdrawal_id, note):
                 await message.reply_text(
                     f"❌ Withdrawal {withdrawal_id} rejected!",
                     reply_markup=keyboard
@@ -1125,12 +1811,14 @@ async def withdrawals_admin_handler(client: Client, message: Message):
         return
     
     await message.reply_text(
-        "💸 **Withdrawal Management**\n\nClick below to view pending withdrawals:",
+        "💸 **Withdrawal Management**\n\nClick below to view pending withdrawals.\n\n"
+        "Approve in bulk with `/withdrawals batch <method|all> [min] [max]`",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("💸 View Withdrawals", callback_data="admin_withdrawals")]])
     )
 
 
 @app.on_message(filters.command("ads"))
+@lanes.spawn('admin')
 async def ads_handler(client: Client, message: Message):
     user_id = message.from_user.id
     
@@ -1150,7 +1838,7 @@ async def ads_handler(client: Client, message: Message):
         ])
         
         if action == "view":
-            ad_codes = get_ad_codes()
+            ad_codes = await lanes.run(get_ad_codes)
             
             status_text = "📺 **Current Ad Codes Status**\n\n"
             ad_types = {
@@ -1184,7 +1872,7 @@ async def ads_handler(client: Client, message: Message):
                 )
                 return
             
-            user_sessions[user_id] = {'action': 'set_ad', 'ad_type': ad_type}
+            await lanes.run(conversations.set, user_id, {'action': 'set_ad', 'ad_type': ad_type})
             
             cancel_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data="cancel")]])
             
@@ -1213,7 +1901,7 @@ Just paste your complete ad code.
         elif action == "remove" and len(message.command) >= 3:
             ad_type = message.command[2].lower()
             
-            if remove_ad_code(ad_type):
+            if await lanes.run(remove_ad_code, ad_type):
                 await message.reply_text(
                     f"✅ {ad_type.upper()} ad code removed successfully!",
                     reply_markup=keyboard
@@ -1231,18 +1919,73 @@ Just paste your complete ad code.
     )
 
 
+@app.on_message(filters.command("broadcast"))
+@lanes.spawn('admin')
+async def broadcast_handler(client: Client, message: Message):
+    user_id = message.from_user.id
+    
+    if user_id != ADMIN_ID:
+        await message.reply_text(
+            "❌ This command is only available to administrators.",
+            reply_markup=get_back_button()
+        )
+        return
+    
+    action = message.command[1].lower() if len(message.command) > 1 else ''
+    
+    if action in ('status', 'cancel'):
+        job = await lanes.run(get_latest_broadcast)
+        if not job:
+            await message.reply_text("📢 No broadcasts yet.")
+            return
+        
+        if action == 'cancel' and job['status'] == 'running':
+            await lanes.run(update_broadcast, job['_id'], {'status': 'cancelled'})
+            job['status'] = 'cancelled'
+        
+        await message.reply_text(format_progress(job))
+        return
+    
+    if message.reply_to_message:
+        source = message.reply_to_message
+    elif len(message.command) > 1:
+        text = message.text.split(None, 1)[1]
+        source = await message.reply_text(text)
+    else:
+        await message.reply_text(
+            """
+📢 **Broadcast**
+
+**Usage:**
+• Reply to any message with `/broadcast` to send a copy to all users
+• `/broadcast <text>` - Send a text announcement
+• `/broadcast status` - Show progress of the latest broadcast
+• `/broadcast cancel` - Stop the running broadcast
+""",
+            reply_markup=get_back_button("menu_admin")
+        )
+        return
+    
+    job = await lanes.run(create_broadcast, user_id, source.chat.id, source.id)
+    if not job:
+        await message.reply_text("❌ Failed to create broadcast.")
+        return
+    
+    broadcaster.start(job)
+
+
 @app.on_message(filters.text & filters.private & ~filters.command(""))
+@lanes.spawn('menus')
 async def text_handler(client: Client, message: Message):
     user_id = message.from_user.id
     
-    if user_id in user_sessions:
-        session = user_sessions[user_id]
-        
+    session = await lanes.run(conversations.get, user_id)
+    if session:
         if session.get('action') == 'set_ad':
             ad_type = session.get('ad_type')
             ad_code = message.text
             
-            if update_ad_code(ad_type, ad_code):
+            if await lanes.run(update_ad_code, ad_type, ad_code):
                 keyboard = InlineKeyboardMarkup([
                     [InlineKeyboardButton("📺 View Ads", callback_data="admin_ads")],
                     [InlineKeyboardButton("🔙 Admin Panel", callback_data="menu_admin")]
@@ -1256,7 +1999,7 @@ Your ad code has been saved and will now appear on all redirect pages.
 """,
                     reply_markup=keyboard
                 )
-                del user_sessions[user_id]
+                await lanes.run(conversations.delete, user_id)
             else:
                 await message.reply_text(
                     "❌ Failed to update ad code. Please try again.",
@@ -1264,9 +2007,69 @@ Your ad code has been saved and will now appear on all redirect pages.
                 )
 
 
+@scheduler.every(EXPIRY_SWEEP_SECONDS, name="expiry_sweep", jitter=60, distributed=True)
+def sweep_expired_links():
+    """Clean up counters of expired links"""
+    swept = sweep_expired_files()
+    if swept:
+        print(f"🧹 Swept {swept} expired links")
+
+
+@scheduler.every(PAYOUT_RESUME_SECONDS, name="payout_resume", jitter=60, distributed=True)
+async def resume_payout_batches():
+    """Settle payout batches whose approval was interrupted, e.g. by a restart"""
+    for result in await asyncio.to_thread(settle_stale_withdrawal_batches, PAYOUT_RESUME_SECONDS):
+        approved = result['approved']
+        print(f"💳 Resumed payout batch {result['batch_id']}: {len(approved)} approved, {result['returned']} returned")
+        notify_approved(app, approved)
+        if approved and ADMIN_ID:
+            text = (f"💳 Interrupted payout batch `{result['batch_id']}` was settled: {len(approved)} approved "
+                    f"({format_money(result['amount_micros'], 2)}), {result['returned']} left pending.\n"
+                    f"CSV: {BASE_URL}/admin/payouts/{result['batch_id']}")
+            log_failure(outbox.submit(
+                ADMIN_ID, lambda text=text: app.send_message(ADMIN_ID, text), PRIORITY_NOTIFICATION
+            ), "payout resume notice")
+
+
+# Every instance serves the leaderboard from its own memory, so this one isn't locked
+@scheduler.every(LEADERBOARD_REFRESH_SECONDS, name="leaderboard_refresh", jitter=10)
+def refresh_leaderboard():
+    leaderboard.refresh()
+
+
+if isinstance(conversations, MongoStateStore):
+    @scheduler.every(SESSION_TRIM_SECONDS, name="session_trim", jitter=60, distributed=True)
+    def trim_conversations():
+        """Cap stored conversations even when few new ones are written"""
+        trim_sessions(STATE_MAX_ENTRIES)
+
+
+if ARCHIVE_CRON:
+    @scheduler.cron(ARCHIVE_CRON, name="view_archive", distributed=True)
+    def archive_views():
+        from archive import archive_old_views
+        result = archive_old_views()
+        print(f"📦 Archived {result['archived']} views into {result['segments']} segments")
+
+
+async def main():
+    await app.start()
+    outbox.start()
+    print("✅ Outbound send queue started")
+    await broadcaster.resume_all()
+    scheduler.start()
+    print(f"✅ Scheduler started with {len(scheduler.jobs)} jobs")
+    
+    await idle()
+    
+    await scheduler.stop()
+    await outbox.stop()
+    await app.stop()
+
+
 def run_bot():
     print("🤖 Starting Telegram Bot...")
-    app.run()
+    app.run(main())
 
 
 if __name__ == "__main__":
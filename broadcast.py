@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import Dict
+from pyrogram import Client
+from pyrogram.errors import UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid
+from database import (
+    get_broadcast, get_running_broadcasts, update_broadcast,
+    iter_user_id_batches, mark_user_blocked
+)
+from outbound import OutboundQueue, PRIORITY_BROADCAST, PRIORITY_NOTIFICATION
+from ratelimit import ConcurrencyLanes
+
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '200'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '20'))
+BROADCAST_PROGRESS_SECONDS = 5
+# Lane whose threads run a broadcast's database calls, away from interactive handlers
+BROADCAST_LANE = 'broadcast'
+
+UNREACHABLE_ERRORS = (UserIsBlocked, InputUserDeactivated, UserDeactivated, PeerIdInvalid)
+
+
+def format_progress(job: Dict, rate: float = None) -> str:
+    done = job['sent'] + job['failed'] + job['blocked']
+    percent = done / job['total'] * 100 if job['total'] else 100
+    text = f"""
+📢 **Broadcast {job['status'].upper()}**
+
+📊 **Progress:** {done}/{job['total']} ({percent:.1f}%)
+✅ **Delivered:** {job['sent']}
+🚫 **Blocked/Deleted:** {job['blocked']}
+❌ **Failed:** {job['failed']}
+"""
+    if rate is not None:
+        text += f"⚡ **Throughput:** {rate:.1f} msg/s\n"
+    return text
+
+
+class BroadcastRunner:
+    """Delivers broadcast jobs through the outbound queue, checkpointing per batch.
+
+    Progress is saved after each batch of user IDs, so a restarted bot resumes
+    from the last completed batch. Users who blocked the bot are flagged and
+    skipped by future broadcasts. Each job runs in the broadcast lane, so its
+    database calls use that lane's threads and never block the event loop.
+    """
+
+    def __init__(self, client: Client, outbox: OutboundQueue, lanes: ConcurrencyLanes,
+                 concurrency: int = BROADCAST_CONCURRENCY):
+        self.client = client
+        self.outbox = outbox
+        self.lanes = lanes
+        self.concurrency = concurrency
+        self.tasks: Dict = {}
+
+    def start(self, job: Dict):
+        if job['_id'] in self.tasks:
+            return
+        task = asyncio.create_task(self._run(job))
+        self.tasks[job['_id']] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job['_id'], None))
+
+    async def resume_all(self):
+        for job in await self.lanes.run(get_running_broadcasts):
+            print(f"📢 Resuming broadcast {job['_id']} after user {job['last_user_id']}")
+            self.start(job)
+
+    async def _send(self, user_id: int, job: Dict, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            try:
+                await self.outbox.send(
+                    user_id,
+                    lambda: self.client.copy_message(user_id, job['source_chat_id'], job['source_message_id']),
+                    PRIORITY_BROADCAST
+                )
+                return 'sent'
+            except UNREACHABLE_ERRORS:
+                await self.lanes.run(mark_user_blocked, user_id)
+                return 'blocked'
+            except Exception as e:
+                print(f"Broadcast to {user_id} failed: {e}")
+                return 'failed'
+
+    async def _report(self, job: Dict, rate: float = None):
+        text = format_progress(job, rate)
+        try:
+            if job.get('status_message_id'):
+                await self.outbox.send(
+                    job['admin_id'],
+                    lambda: self.client.edit_message_text(job['admin_id'], job['status_message_id'], text),
+                    PRIORITY_NOTIFICATION
+                )
+            else:
+                message = await self.outbox.send(
+                    job['admin_id'],
+                    lambda: self.client.send_message(job['admin_id'], text),
+                    PRIORITY_NOTIFICATION
+                )
+                job['status_message_id'] = message.id
+                await self.lanes.run(update_broadcast, job['_id'], {'status_message_id': message.id})
+        except Exception as e:
+            print(f"Broadcast progress update failed: {e}")
+
+    async def _run(self, job: Dict):
+        async with self.lanes.acquire(BROADCAST_LANE):
+            await self._deliver(job)
+
+    async def _deliver(self, job: Dict):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started_at = time.monotonic()
+        processed = 0
+        last_report = 0.0
+
+        await self._report(job)
+
+        batches = iter_user_id_batches(job['last_user_id'], BROADCAST_BATCH_SIZE)
+        while True:
+            batch = await self.lanes.run(next, batches, None)
+            if batch is None:
+                job['status'] = 'completed'
+                await self.lanes.run(
+                    update_broadcast, job['_id'], {'status': 'completed', 'completed_at': datetime.utcnow()}
+                )
+                break
+
+            current = await self.lanes.run(get_broadcast, job['_id'])
+            if not current or current['status'] != 'running':
+                job['status'] = current['status'] if current else 'cancelled'
+                break
+
+            results = await asyncio.gather(*(self._send(uid, job, semaphore) for uid in batch))
+            counts = {key: results.count(key) for key in ('sent', 'failed', 'blocked')}
+
+            await self.lanes.run(update_broadcast, job['_id'], {'last_user_id': batch[-1]}, counts)
+            for key, count in counts.items():
+                job[key] += count
+            job['last_user_id'] = batch[-1]
+            processed += len(batch)
+
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_SECONDS:
+                last_report = time.monotonic()
+                await self._report(job, processed / max(last_report - started_at, 0.001))
+
+        await self._report(job, processed / max(time.monotonic() - started_at, 0.001))
@@ -1,13 +1,31 @@
 import os
-from pymongo import MongoClient
-from datetime import datetime
+import re
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from bson.binary import Binary
+from bson.int64 import Int64
+from datetime import datetime, timedelta
 from typing import Optional, Dict, List
 from dotenv import load_dotenv
+from sketches import HyperLogLog
+from cache import LRUCache
+from money import to_micros
+from admission import db_latency
 
 load_dotenv()
 
 MONGO_URI = os.getenv('MONGO_URI')
-client = MongoClient(MONGO_URI) if MONGO_URI else None
+REFERRAL_BONUS_MICROS = 100_000  # $0.10 per referral
+# Commission rate per referral level, nearest referrer first (e.g. "0.10,0.05,0.02")
+REFERRAL_TIERS = [float(rate) for rate in os.getenv('REFERRAL_TIERS', '0.10').split(',') if rate.strip()]
+USER_STATS_CACHE_SECONDS = int(os.getenv('USER_STATS_CACHE_SECONDS', '30'))
+REFERRAL_CHAIN_CACHE_SECONDS = 600
+# An IP is credited at most once per file in this many minutes
+RECENT_VIEW_MINUTES = 5
+# Expired links stay in MongoDB this long (for stats and the sweeper) before the TTL index removes them
+FILE_EXPIRY_GRACE_SECONDS = int(os.getenv('FILE_EXPIRY_GRACE_SECONDS', str(7 * 24 * 3600)))
+# Command latencies feed the web tier's admission control
+client = MongoClient(MONGO_URI, event_listeners=[db_latency]) if MONGO_URI else None
 db = client.file_monetization if client is not None else None
 
 users_collection = db.users if db is not None else None
@@ -15,6 +33,51 @@ files_collection = db.files if db is not None else None
 views_collection = db.views if db is not None else None
 settings_collection = db.settings if db is not None else None
 withdrawals_collection = db.withdrawals if db is not None else None
+sketches_collection = db.sketches if db is not None else None
+trending_collection = db.trending if db is not None else None
+held_views_collection = db.held_views if db is not None else None
+broadcasts_collection = db.broadcasts if db is not None else None
+sessions_collection = db.sessions if db is not None else None
+leaderboard_collection = db.leaderboard if db is not None else None
+locks_collection = db.locks if db is not None else None
+
+# Balances also change in the web process, so entries expire on their own too
+user_stats_cache = LRUCache(10000, USER_STATS_CACHE_SECONDS)
+# referrer_id never changes once set, but a chain read before its upper referrers
+# were saved (or by another process) is incomplete, so entries still expire
+referral_chain_cache = LRUCache(100000, REFERRAL_CHAIN_CACHE_SECONDS)
+
+
+def ensure_indexes():
+    if db is None:
+        return
+    
+    users_collection.create_index([('user_id', ASCENDING)])
+    files_collection.create_index(
+        [('uploader_id', ASCENDING), ('file_unique_id', ASCENDING)],
+        unique=True,
+        partialFilterExpression={'forced': False}
+    )
+    files_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=FILE_EXPIRY_GRACE_SECONDS)
+    sketches_collection.create_index([('key', ASCENDING)], unique=True)
+    sketches_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+    trending_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+    held_views_collection.create_index([('status', ASCENDING), ('uploader_id', ASCENDING)])
+    held_views_collection.create_index([('short_link_id', ASCENDING), ('ip', ASCENDING), ('timestamp', ASCENDING)])
+    broadcasts_collection.create_index([('status', ASCENDING)])
+    sessions_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+    sessions_collection.create_index([('updated_at', ASCENDING)])
+    withdrawals_collection.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+    withdrawals_collection.create_index([('batch_id', ASCENDING)], sparse=True)
+    users_collection.create_index([('earned_micros', DESCENDING)])
+    files_collection.create_index([('views', DESCENDING)])
+    leaderboard_collection.create_index(
+        [('board', ASCENDING), ('period', ASCENDING), ('item', ASCENDING)], unique=True
+    )
+    leaderboard_collection.create_index([('board', ASCENDING), ('period', ASCENDING), ('value', DESCENDING)])
+    leaderboard_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+    # Locks of jobs that were renamed or removed would otherwise stay forever
+    locks_collection.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
 
 
 def init_default_settings():
@@ -58,15 +121,16 @@ def get_or_create_user(user_id: int, username: str = None, referrer_id: int = No
         user = {
             'user_id': user_id,
             'username': username,
-            'balance': 0.0,
+            'balance_micros': Int64(0),
             'total_views': 0,
             'files_uploaded': 0,
             'referrer_id': referrer_id,
             'referral_count': 0,
-            'referral_earnings': 0.0,
+            'referral_earnings_micros': Int64(0),
             'created_at': datetime.utcnow()
         }
         users_collection.insert_one(user)
+        referral_chain_cache.delete(user_id)
         
         # Award bonus to referrer if exists
         if referrer_id:
@@ -75,76 +139,184 @@ def get_or_create_user(user_id: int, username: str = None, referrer_id: int = No
                 {
                     '$inc': {
                         'referral_count': 1,
-                        'balance': 0.10,  # $0.10 bonus per referral
-                        'referral_earnings': 0.10  # Track in referral earnings
+                        'balance_micros': REFERRAL_BONUS_MICROS,
+                        'earned_micros': REFERRAL_BONUS_MICROS,
+                        'referral_earnings_micros': REFERRAL_BONUS_MICROS  # Track in referral earnings
                     }
                 }
             )
+            invalidate_user_stats(referrer_id)
     return user
 
 
-def update_user_balance(user_id: int, amount: float):
+def update_user_balance(user_id: int, amount_micros: int) -> Dict[int, int]:
+    """Credit a view to its uploader and every referral tier above them in one bulk write.
+
+    Returns the micro-dollars credited per user.
+    """
     if users_collection is None:
-        return
+        return {}
     
-    users_collection.update_one(
+    operations = [UpdateOne(
         {'user_id': user_id},
         {
-            '$inc': {'balance': amount, 'total_views': 1},
+            '$inc': {'balance_micros': amount_micros, 'earned_micros': amount_micros, 'total_views': 1},
             '$set': {'updated_at': datetime.utcnow()}
         }
-    )
+    )]
     
-    # Award commission to referrer if exists
-    user = users_collection.find_one({'user_id': user_id})
-    if user and user.get('referrer_id'):
-        award_referral_commission(user['referrer_id'], amount)
+    credited = {user_id: amount_micros}
+    for referrer_id, rate in zip(get_referral_chain(user_id), REFERRAL_TIERS):
+        commission = round(amount_micros * rate)
+        if commission:
+            operations.append(UpdateOne(
+                {'user_id': referrer_id},
+                {'$inc': {'balance_micros': commission, 'earned_micros': commission,
+                          'referral_earnings_micros': commission}}
+            ))
+            credited[referrer_id] = credited.get(referrer_id, 0) + commission
+    
+    users_collection.bulk_write(operations, ordered=False)
+    for credited_id in credited:
+        invalidate_user_stats(credited_id)
+    return credited
+
 
+def create_file_record(telegram_file_id: str, file_name: str, uploader_id: int, short_link_id: str, short_link: str, file_type: str = 'document', file_unique_id: str = None, force_new: bool = False, file_size: int = None,
+                       expires_at: datetime = None, max_downloads: int = None) -> Dict:
+    """Create a file record, or return the uploader's existing one for the same file.
 
-def create_file_record(telegram_file_id: str, file_name: str, uploader_id: int, short_link_id: str, short_link: str, file_type: str = 'document') -> Dict:
+    Uploads are keyed on (uploader_id, file_unique_id) through a unique index, so
+    a re-upload is resolved in a single upsert. The returned record's
+    short_link_id differs from the requested one when an existing link was reused.
+    An existing link that has expired or used up its quota is moved out of the
+    index first, so the upload takes its place and later re-uploads reuse it.
+    force_new always creates a fresh link outside the deduplication index.
+    """
     if files_collection is None:
         return {}
     
     file_record = {
         'telegram_file_id': telegram_file_id,
+        'file_unique_id': file_unique_id,
+        'forced': force_new or not file_unique_id,
         'short_link_id': short_link_id,
         'file_name': file_name,
         'file_type': file_type,
+        'file_size': file_size,
         'uploader_id': uploader_id,
         'short_link': short_link,
         'views': 0,
         'geo_stats': {},
         'created_at': datetime.utcnow()
     }
-    files_collection.insert_one(file_record)
+    if expires_at:
+        file_record['expires_at'] = expires_at
+    if max_downloads:
+        file_record['max_downloads'] = max_downloads
+    
+    if file_record['forced']:
+        files_collection.insert_one(file_record)
+    else:
+        while True:
+            try:
+                existing = files_collection.find_one_and_update(
+                    {'uploader_id': uploader_id, 'file_unique_id': file_unique_id, 'forced': False},
+                    {'$setOnInsert': file_record},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # A concurrent upload of the same file won the insert
+                return files_collection.find_one({'uploader_id': uploader_id, 'file_unique_id': file_unique_id, 'forced': False})
+            
+            if existing['short_link_id'] == short_link_id:
+                file_record = existing
+                break
+            if is_file_available(existing):
+                return existing
+            # Retire the dead link from the deduplication index and try again
+            files_collection.update_one({'_id': existing['_id'], 'forced': False}, {'$set': {'forced': True}})
     
     users_collection.update_one(
         {'user_id': uploader_id},
         {'$inc': {'files_uploaded': 1}}
     )
+    invalidate_user_stats(uploader_id)
     
     return file_record
 
 
+def create_bundle_record(items: List[Dict], uploader_id: int, short_link_id: str, short_link: str,
+                         expires_at: datetime = None, max_downloads: int = None) -> Dict:
+    """Store all parts of an album under one short link with a single insert"""
+    if files_collection is None:
+        return {}
+    
+    bundle_record = {
+        'telegram_file_id': None,
+        'items': items,
+        'forced': True,
+        'short_link_id': short_link_id,
+        'file_name': f"Album ({len(items)} files)",
+        'file_type': 'bundle',
+        'uploader_id': uploader_id,
+        'short_link': short_link,
+        'views': 0,
+        'geo_stats': {},
+        'created_at': datetime.utcnow()
+    }
+    if expires_at:
+        bundle_record['expires_at'] = expires_at
+    if max_downloads:
+        bundle_record['max_downloads'] = max_downloads
+    files_collection.insert_one(bundle_record)
+    
+    users_collection.update_one(
+        {'user_id': uploader_id},
+        {'$inc': {'files_uploaded': 1}}
+    )
+    invalidate_user_stats(uploader_id)
+    
+    return bundle_record
+
+
 def get_file_by_short_link_id(short_link_id: str) -> Optional[Dict]:
     if files_collection is None:
         return None
     return files_collection.find_one({'short_link_id': short_link_id})
 
 
+def is_file_available(file_record: Dict) -> bool:
+    """False once a link has passed its expiry time or used up its download quota"""
+    expires_at = file_record.get('expires_at')
+    if expires_at and expires_at <= datetime.utcnow():
+        return False
+    max_downloads = file_record.get('max_downloads')
+    return not max_downloads or file_record.get('views', 0) < max_downloads
+
+
 def increment_file_views(short_link_id: str, country: str):
     if files_collection is None:
         return
     
-    files_collection.update_one(
+    file_record = files_collection.find_one_and_update(
         {'short_link_id': short_link_id},
         {
             '$inc': {
                 'views': 1,
                 f'geo_stats.{country}': 1
             }
-        }
+        },
+        projection={'views': 1, 'max_downloads': 1, 'expires_at': 1},
+        return_document=ReturnDocument.AFTER
     )
+    
+    # A used-up quota expires the link now, so the TTL index cleans it up like any other
+    if file_record and file_record.get('max_downloads') and file_record['views'] >= file_record['max_downloads']:
+        now = datetime.utcnow()
+        if not file_record.get('expires_at') or file_record['expires_at'] > now:
+            files_collection.update_one({'_id': file_record['_id']}, {'$set': {'expires_at': now}})
 
 
 def create_view_record(short_link_id: str, ip: str, country: str, user_agent: str = None):
@@ -161,20 +333,20 @@ def create_view_record(short_link_id: str, ip: str, country: str, user_agent: st
     views_collection.insert_one(view_record)
 
 
-def check_recent_view(short_link_id: str, ip: str, minutes: int = 5) -> bool:
+def check_recent_view(short_link_id: str, ip: str, minutes: int = RECENT_VIEW_MINUTES) -> bool:
     if views_collection is None:
         return False
     
-    from datetime import timedelta
     cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
-    
-    recent_view = views_collection.find_one({
+    query = {
         'short_link_id': short_link_id,
         'ip': ip,
         'timestamp': {'$gte': cutoff_time}
-    })
-    
-    return recent_view is not None
+    }
+    if views_collection.find_one(query) is not None:
+        return True
+    # Held views count too, so one visitor can't pile up views waiting for review
+    return held_views_collection is not None and held_views_collection.find_one(query) is not None
 
 
 def get_cpm_rates() -> Dict[str, float]:
@@ -187,6 +359,18 @@ def get_cpm_rates() -> Dict[str, float]:
     return {'US': 5.0, 'GB': 4.0, 'IN': 2.0, 'OTHER': 1.0}
 
 
+def get_cpm_settings() -> Dict:
+    """CPM rates together with their version, which every update increments"""
+    default = {'rates': {'US': 5.0, 'GB': 4.0, 'IN': 2.0, 'OTHER': 1.0}, 'version': 0}
+    if settings_collection is None:
+        return default
+    
+    settings = settings_collection.find_one({'type': 'cpm_rates'})
+    if settings:
+        return {'rates': settings.get('rates', {}), 'version': settings.get('version', 0)}
+    return default
+
+
 def update_cpm_rates(rates: Dict[str, float]):
     if settings_collection is None:
         return
@@ -197,16 +381,27 @@ def update_cpm_rates(rates: Dict[str, float]):
             '$set': {
                 'rates': rates,
                 'updated_at': datetime.utcnow()
-            }
+            },
+            '$inc': {'version': 1}
         },
         upsert=True
     )
 
 
-def get_user_stats(user_id: int) -> Dict:
+def invalidate_user_stats(user_id: int):
+    user_stats_cache.delete(user_id)
+
+
+def get_user_stats(user_id: int, use_cache: bool = True) -> Dict:
+    """Balance, views, uploads and geo breakdown, cached briefly per user"""
     if users_collection is None:
         return {}
     
+    if use_cache:
+        stats = user_stats_cache.get(user_id)
+        if stats is not None:
+            return stats
+    
     user = users_collection.find_one({'user_id': user_id})
     if not user:
         return {}
@@ -218,35 +413,51 @@ def get_user_stats(user_id: int) -> Dict:
         for country, count in file.get('geo_stats', {}).items():
             geo_breakdown[country] = geo_breakdown.get(country, 0) + count
     
-    return {
-        'balance': user.get('balance', 0.0),
+    stats = {
+        'balance_micros': user.get('balance_micros', 0),
         'total_views': user.get('total_views', 0),
         'files_uploaded': user.get('files_uploaded', 0),
         'geo_breakdown': geo_breakdown
     }
+    user_stats_cache.set(user_id, stats)
+    return stats
 
 
-def get_all_users_stats() -> List[Dict]:
-    if users_collection is None:
-        return []
-    
-    users = list(users_collection.find().sort('balance', -1))
-    return users
-
-
-def calculate_earnings(country: str) -> float:
+def calculate_earnings(country: str) -> int:
+    """Earnings for one view from `country`, in micro-dollars"""
     rates = get_cpm_rates()
     cpm = rates.get(country, rates.get('OTHER', 1.0))
-    return cpm / 1000
+    return (to_micros(cpm) + 500) // 1000
+
+
+def get_money_totals() -> Dict:
+    """Users, views and balances plus pending withdrawals, summed server-side"""
+    totals = {'users': 0, 'views': 0, 'balance_micros': 0, 'pending_count': 0, 'pending_micros': 0}
+    if users_collection is None:
+        return totals
+    
+    for row in users_collection.aggregate([
+        {'$group': {'_id': None, 'users': {'$sum': 1}, 'views': {'$sum': '$total_views'},
+                    'balance_micros': {'$sum': '$balance_micros'}}}
+    ]):
+        totals.update(users=row['users'], views=row['views'], balance_micros=row['balance_micros'])
+    
+    for row in withdrawals_collection.aggregate([
+        {'$match': {'status': 'pending'}},
+        {'$group': {'_id': None, 'count': {'$sum': 1}, 'amount_micros': {'$sum': '$amount_micros'}}}
+    ]):
+        totals.update(pending_count=row['count'], pending_micros=row['amount_micros'])
+    
+    return totals
 
 
-def create_withdrawal_request(user_id: int, amount: float, payment_method: str, payment_details: str) -> Dict:
+def create_withdrawal_request(user_id: int, amount_micros: int, payment_method: str, payment_details: str) -> Dict:
     if withdrawals_collection is None:
         return {}
     
     withdrawal = {
         'user_id': user_id,
-        'amount': amount,
+        'amount_micros': Int64(amount_micros),
         'payment_method': payment_method,
         'payment_details': payment_details,
         'status': 'pending',
@@ -264,10 +475,45 @@ def get_user_withdrawals(user_id: int) -> List[Dict]:
     return list(withdrawals_collection.find({'user_id': user_id}).sort('created_at', -1))
 
 
-def get_pending_withdrawals() -> List[Dict]:
+def _pending_filter(payment_method: str = None, min_micros: int = None, max_micros: int = None) -> Dict:
+    query = {'status': 'pending'}
+    if payment_method:
+        query['payment_method'] = re.compile(f"^{re.escape(payment_method)}$", re.IGNORECASE)
+    amount_range = {}
+    if min_micros is not None:
+        amount_range['$gte'] = min_micros
+    if max_micros is not None:
+        amount_range['$lte'] = max_micros
+    if amount_range:
+        query['amount_micros'] = amount_range
+    return query
+
+
+def get_pending_withdrawals(limit: int = 10, after: tuple = None, payment_method: str = None,
+                            min_micros: int = None, max_micros: int = None) -> List[Dict]:
+    """One page of pending withdrawals, oldest first.
+
+    Pages are keyed on (created_at, _id) of the last row seen, so each page is
+    a bounded range scan of the status/created_at index however deep it is.
+    """
     if withdrawals_collection is None:
         return []
-    return list(withdrawals_collection.find({'status': 'pending'}).sort('created_at', 1))
+    
+    query = _pending_filter(payment_method, min_micros, max_micros)
+    if after is not None:
+        created_at, last_id = after
+        query['$or'] = [
+            {'created_at': {'$gt': created_at}},
+            {'created_at': created_at, '_id': {'$gt': last_id}}
+        ]
+    cursor = withdrawals_collection.find(query).sort([('created_at', ASCENDING), ('_id', ASCENDING)])
+    return list(cursor.limit(limit))
+
+
+def count_pending_withdrawals() -> int:
+    if withdrawals_collection is None:
+        return 0
+    return withdrawals_collection.count_documents({'status': 'pending'})
 
 
 def get_withdrawal_by_id(withdrawal_id):
@@ -281,31 +527,119 @@ def get_withdrawal_by_id(withdrawal_id):
         return None
 
 
+def settle_withdrawal_batch(batch_id: str, admin_note: str = None) -> Dict:
+    """Debit balances for a claimed batch and approve what could be paid.
+
+    Each user's withdrawals in the batch are debited together, only while the
+    balance covers them; the batch id is added to the user's payout_batches in
+    the same update, so the debit can't be applied twice. Withdrawals whose
+    user could not be debited go back to pending. Once none of the batch is
+    left processing the id is pulled again, so payout_batches only holds
+    unfinished batches. Safe to run again for an interrupted batch.
+    """
+    result = {'batch_id': batch_id, 'approved': [], 'returned': 0, 'amount_micros': 0}
+    if withdrawals_collection is None:
+        return result
+    
+    claimed = list(withdrawals_collection.find({'batch_id': batch_id, 'status': 'processing'}))
+    if not claimed:
+        return result
+    
+    totals = {}
+    for withdrawal in claimed:
+        totals[withdrawal['user_id']] = totals.get(withdrawal['user_id'], 0) + withdrawal['amount_micros']
+    
+    users_collection.bulk_write([
+        UpdateOne(
+            {'user_id': user_id, 'balance_micros': {'$gte': total}, 'payout_batches': {'$ne': batch_id}},
+            {'$inc': {'balance_micros': -total}, '$addToSet': {'payout_batches': batch_id}}
+        )
+        for user_id, total in totals.items()
+    ], ordered=False)
+    
+    debited = {
+        user['user_id'] for user in users_collection.find(
+            {'user_id': {'$in': list(totals)}, 'payout_batches': batch_id}, {'user_id': 1}
+        )
+    }
+    for user_id in debited:
+        invalidate_user_stats(user_id)
+    
+    withdrawals_collection.update_many(
+        {'batch_id': batch_id, 'status': 'processing', 'user_id': {'$in': list(debited)}},
+        {'$set': {'status': 'approved', 'processed_at': datetime.utcnow(), 'admin_note': admin_note}}
+    )
+    result['returned'] = withdrawals_collection.update_many(
+        {'batch_id': batch_id, 'status': 'processing'},
+        {'$set': {'status': 'pending'}, '$unset': {'batch_id': '', 'claimed_at': ''}}
+    ).modified_count
+    # Nothing of the batch is processing any more, so a rerun can't debit again
+    if debited:
+        users_collection.update_many(
+            {'user_id': {'$in': list(debited)}}, {'$pull': {'payout_batches': batch_id}}
+        )
+    
+    result['approved'] = [w for w in claimed if w['user_id'] in debited]
+    result['amount_micros'] = sum(w['amount_micros'] for w in result['approved'])
+    return result
+
+
+def _new_batch_id() -> str:
+    from bson.objectid import ObjectId
+    return f"{datetime.utcnow().strftime('%Y%m%d')}-{ObjectId()}"
+
+
 def approve_withdrawal(withdrawal_id, admin_note: str = None):
     if withdrawals_collection is None:
         return False
     
     from bson.objectid import ObjectId
-    withdrawal = withdrawals_collection.find_one({'_id': ObjectId(withdrawal_id)})
-    if not withdrawal:
+    try:
+        withdrawal_id = ObjectId(withdrawal_id)
+    except Exception:
         return False
     
-    users_collection.update_one(
-        {'user_id': withdrawal['user_id']},
-        {'$inc': {'balance': -withdrawal['amount']}}
+    batch_id = _new_batch_id()
+    claimed = withdrawals_collection.update_one(
+        {'_id': withdrawal_id, 'status': 'pending'},
+        {'$set': {'status': 'processing', 'batch_id': batch_id, 'claimed_at': datetime.utcnow()}}
     )
+    if not claimed.modified_count:
+        return False
+    return bool(settle_withdrawal_batch(batch_id, admin_note)['approved'])
+
+
+def approve_withdrawals_batch(payment_method: str = None, min_micros: int = None, max_micros: int = None,
+                              limit: int = 500, admin_note: str = None) -> Dict:
+    """Approve up to `limit` of the oldest pending withdrawals matching the filters.
+
+    Matching requests are claimed with one update_many (status 'processing'
+    plus a batch id), so a request can only ever land in one batch, then
+    settled with settle_withdrawal_batch.
+    """
+    batch_id = _new_batch_id()
+    selected = get_pending_withdrawals(limit, None, payment_method, min_micros, max_micros)
+    if not selected:
+        return {'batch_id': batch_id, 'approved': [], 'returned': 0, 'amount_micros': 0}
     
-    withdrawals_collection.update_one(
-        {'_id': ObjectId(withdrawal_id)},
-        {
-            '$set': {
-                'status': 'approved',
-                'processed_at': datetime.utcnow(),
-                'admin_note': admin_note
-            }
-        }
+    withdrawals_collection.update_many(
+        {'_id': {'$in': [w['_id'] for w in selected]}, 'status': 'pending'},
+        {'$set': {'status': 'processing', 'batch_id': batch_id, 'claimed_at': datetime.utcnow()}}
     )
-    return True
+    return settle_withdrawal_batch(batch_id, admin_note)
+
+
+def settle_stale_withdrawal_batches(older_than_seconds: int) -> List[Dict]:
+    """Finish batches left in 'processing' by an approval that was interrupted"""
+    if withdrawals_collection is None:
+        return []
+    
+    cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+    batch_ids = withdrawals_collection.distinct('batch_id', {
+        'status': 'processing',
+        '$or': [{'claimed_at': {'$lt': cutoff}}, {'claimed_at': {'$exists': False}}]
+    })
+    return [settle_withdrawal_batch(batch_id) for batch_id in batch_ids]
 
 
 def reject_withdrawal(withdrawal_id, admin_note: str = None):
@@ -313,8 +647,13 @@ def reject_withdrawal(withdrawal_id, admin_note: str = None):
         return False
     
     from bson.objectid import ObjectId
-    withdrawals_collection.update_one(
-        {'_id': ObjectId(withdrawal_id)},
+    try:
+        withdrawal_id = ObjectId(withdrawal_id)
+    except Exception:
+        return False
+    
+    result = withdrawals_collection.update_one(
+        {'_id': withdrawal_id, 'status': 'pending'},
         {
             '$set': {
                 'status': 'rejected',
@@ -323,7 +662,7 @@ def reject_withdrawal(withdrawal_id, admin_note: str = None):
             }
         }
     )
-    return True
+    return result.modified_count > 0
 
 
 def get_ad_codes() -> Dict[str, str]:
@@ -391,7 +730,7 @@ def get_referral_stats(user_id: int) -> Dict:
     
     return {
         'referral_count': user.get('referral_count', 0),
-        'referral_earnings': user.get('referral_earnings', 0.0),
+        'referral_earnings_micros': user.get('referral_earnings_micros', 0),
         'referred_users': [
             {
                 'user_id': u['user_id'],
@@ -403,22 +742,32 @@ def get_referral_stats(user_id: int) -> Dict:
     }
 
 
-def award_referral_commission(referrer_id: int, amount: float, commission_rate: float = 0.10):
-    """Award commission to referrer (10% of referred user's earnings)"""
-    if users_collection is None:
-        return False
+def get_referral_chain(user_id: int) -> List[int]:
+    """IDs of the referrers above `user_id`, nearest first, one per commission tier"""
+    chain = referral_chain_cache.get(user_id)
+    if chain is not None:
+        return chain
     
-    commission = amount * commission_rate
-    users_collection.update_one(
-        {'user_id': referrer_id},
-        {
-            '$inc': {
-                'balance': commission,
-                'referral_earnings': commission
-            }
-        }
-    )
-    return True
+    chain = []
+    if users_collection is not None and REFERRAL_TIERS:
+        rows = list(users_collection.aggregate([
+            {'$match': {'user_id': user_id}},
+            {'$graphLookup': {
+                'from': users_collection.name,
+                'startWith': '$referrer_id',
+                'connectFromField': 'referrer_id',
+                'connectToField': 'user_id',
+                'maxDepth': len(REFERRAL_TIERS) - 1,
+                'depthField': 'depth',
+                'as': 'chain'
+            }},
+            {'$project': {'_id': 0, 'chain.user_id': 1, 'chain.depth': 1}}
+        ]))
+        if rows:
+            chain = [u['user_id'] for u in sorted(rows[0]['chain'], key=lambda u: u['depth'])]
+            # A user not saved yet has no chain to remember
+            referral_chain_cache.set(user_id, chain)
+    return chain
 
 
 # File Management Functions
@@ -446,6 +795,7 @@ def get_file_stats(file_id: str) -> Dict:
     
     return {
         'file_name': file_record.get('file_name'),
+        'short_link_id': file_record.get('short_link_id'),
         'views': file_record.get('views', 0),
         'geo_stats': file_record.get('geo_stats', {}),
         'created_at': file_record.get('created_at'),
@@ -476,11 +826,13 @@ def delete_file(file_id: str, user_id: int) -> bool:
     })
     
     if result.deleted_count > 0:
-        # Update user's file count
-        users_collection.update_one(
-            {'user_id': user_id},
-            {'$inc': {'files_uploaded': -1}}
-        )
+        # Update user's file count (the expiry sweeper already did for swept links)
+        if not file_record.get('swept'):
+            users_collection.update_one(
+                {'user_id': user_id},
+                {'$inc': {'files_uploaded': -1}}
+            )
+            invalidate_user_stats(user_id)
         return True
     
     return False
@@ -507,11 +859,13 @@ def delete_file_by_short_link(short_link_id: str, user_id: int) -> bool:
     })
     
     if result.deleted_count > 0:
-        # Update user's file count
-        users_collection.update_one(
-            {'user_id': user_id},
-            {'$inc': {'files_uploaded': -1}}
-        )
+        # Update user's file count (the expiry sweeper already did for swept links)
+        if not file_record.get('swept'):
+            users_collection.update_one(
+                {'user_id': user_id},
+                {'$inc': {'files_uploaded': -1}}
+            )
+            invalidate_user_stats(user_id)
         return True
     
     return False
@@ -525,5 +879,397 @@ def get_file_count(user_id: int) -> int:
     return files_collection.count_documents({'uploader_id': user_id})
 
 
+def sweep_expired_files(limit: int = 500) -> int:
+    """Drop per-file counters of expired links before the TTL index deletes the links.
+
+    Decrements the uploader's file count, removes the file's unique-visitor
+    sketches and marks the file as swept. Raw view events and held views are
+    kept for accounting and review.
+    """
+    if files_collection is None:
+        return 0
+    
+    expired = list(files_collection.find(
+        {'expires_at': {'$lte': datetime.utcnow()}, 'swept': {'$ne': True}},
+        {'short_link_id': 1, 'uploader_id': 1}
+    ).limit(limit))
+    
+    for file_record in expired:
+        short_link_id = file_record['short_link_id']
+        users_collection.update_one({'user_id': file_record['uploader_id']}, {'$inc': {'files_uploaded': -1}})
+        invalidate_user_stats(file_record['uploader_id'])
+        sketches_collection.delete_many({'key': {'$regex': f'^{re.escape(file_sketch_key(short_link_id))}(:|$)'}})
+        files_collection.update_one({'_id': file_record['_id']}, {'$set': {'swept': True}})
+    
+    return len(expired)
+
+
+# Unique Visitor Sketches
+def file_sketch_key(short_link_id: str, day: str = None) -> str:
+    return f"file:{short_link_id}:{day}" if day else f"file:{short_link_id}"
+
+
+def uploader_sketch_key(uploader_id: int, day: str = None) -> str:
+    return f"uploader:{uploader_id}:{day}" if day else f"uploader:{uploader_id}"
+
+
+def get_sketch(key: str) -> Optional[HyperLogLog]:
+    """Load a stored HyperLogLog sketch"""
+    if sketches_collection is None:
+        return None
+    
+    doc = sketches_collection.find_one({'key': key}, {'registers': 1})
+    if not doc:
+        return None
+    return HyperLogLog(registers=doc['registers'])
+
+
+def merge_sketch_registers(key: str, updates: Dict[int, int], expires_at: datetime = None, retries: int = 5) -> bool:
+    """Merge register updates into a stored sketch with compare-and-swap on its version"""
+    if sketches_collection is None:
+        return False
+    
+    for _ in range(retries):
+        doc = sketches_collection.find_one({'key': key}, {'registers': 1, 'version': 1})
+        sketch = HyperLogLog(registers=doc['registers']) if doc else HyperLogLog()
+        
+        for index, rank in updates.items():
+            sketch.update_register(index, rank)
+        
+        fields = {'registers': Binary(sketch.to_bytes()), 'updated_at': datetime.utcnow()}
+        if expires_at:
+            fields['expires_at'] = expires_at
+        
+        if doc is None:
+            try:
+                sketches_collection.insert_one({'key': key, 'version': 1, **fields})
+                return True
+            except DuplicateKeyError:
+                continue
+        
+        result = sketches_collection.update_one(
+            {'key': key, 'version': doc.get('version', 0)},
+            {'$set': fields, '$inc': {'version': 1}}
+        )
+        if result.modified_count:
+            return True
+    
+    return False
+
+
+def get_unique_visitors(key: str) -> int:
+    """Estimated distinct visitors for a sketch key"""
+    sketch = get_sketch(key)
+    return sketch.count() if sketch else 0
+
+
+# Trending Snapshots
+def save_trending_snapshot(instance_id: str, windows: Dict, expires_at: datetime):
+    """Store one web worker's heavy-hitter summaries"""
+    if trending_collection is None:
+        return
+    
+    trending_collection.update_one(
+        {'_id': instance_id},
+        {'$set': {'windows': windows, 'updated_at': datetime.utcnow(), 'expires_at': expires_at}},
+        upsert=True
+    )
+
+
+def get_trending_snapshots() -> List[Dict]:
+    if trending_collection is None:
+        return []
+    return list(trending_collection.find({'expires_at': {'$gt': datetime.utcnow()}}))
+
+
+# Leaderboard Functions
+def add_leaderboard_counts(counts: Dict, expires_at: Dict[str, datetime]):
+    """Apply buffered {(board, period): {item: value}} increments in one bulk write"""
+    if leaderboard_collection is None or not counts:
+        return
+    
+    operations = [
+        UpdateOne(
+            {'board': board, 'period': period, 'item': item},
+            {'$inc': {'value': value}, '$set': {'expires_at': expires_at[period]}},
+            upsert=True
+        )
+        for (board, period), items in counts.items()
+        for item, value in items.items()
+    ]
+    leaderboard_collection.bulk_write(operations, ordered=False)
+
+
+def get_leaderboard_top(board: str, period: str, limit: int) -> List[Dict]:
+    if leaderboard_collection is None:
+        return []
+    cursor = leaderboard_collection.find(
+        {'board': board, 'period': period}, {'item': 1, 'value': 1}
+    ).sort('value', DESCENDING).limit(limit)
+    return [{'item': doc['item'], 'value': doc['value']} for doc in cursor]
+
+
+def get_top_earners(limit: int) -> List[Dict]:
+    """All-time top earners by lifetime credited earnings"""
+    if users_collection is None:
+        return []
+    cursor = users_collection.find(
+        {'earned_micros': {'$gt': 0}}, {'user_id': 1, 'earned_micros': 1}
+    ).sort('earned_micros', DESCENDING).limit(limit)
+    return [{'item': str(user['user_id']), 'value': user['earned_micros']} for user in cursor]
+
+
+def get_top_files(limit: int) -> List[Dict]:
+    """All-time most viewed files"""
+    if files_collection is None:
+        return []
+    cursor = files_collection.find(
+        {'views': {'$gt': 0}}, {'short_link_id': 1, 'views': 1}
+    ).sort('views', DESCENDING).limit(limit)
+    return [{'item': f['short_link_id'], 'value': f['views']} for f in cursor]
+
+
+def get_usernames(user_ids: List[int]) -> Dict[int, str]:
+    """Map user IDs to usernames in a single query"""
+    if users_collection is None or not user_ids:
+        return {}
+    
+    cursor = users_collection.find({'user_id': {'$in': user_ids}}, {'user_id': 1, 'username': 1})
+    return {u['user_id']: u.get('username') for u in cursor}
+
+
+def get_file_names(short_link_ids: List[str]) -> Dict[str, str]:
+    """Map short link IDs to file names in a single query"""
+    if files_collection is None or not short_link_ids:
+        return {}
+    
+    cursor = files_collection.find(
+        {'short_link_id': {'$in': short_link_ids}},
+        {'short_link_id': 1, 'file_name': 1}
+    )
+    return {f['short_link_id']: f.get('file_name', 'Unknown') for f in cursor}
+
+
+# Fraud Review Functions
+def create_held_view(short_link_id: str, uploader_id: int, ip: str, country: str, user_agent: str, score: float, signals: Dict):
+    """Record a suspicious view that was held back from crediting"""
+    if held_views_collection is None:
+        return
+    
+    held_views_collection.insert_one({
+        'short_link_id': short_link_id,
+        'uploader_id': uploader_id,
+        'ip': ip,
+        'country': country,
+        'user_agent': user_agent,
+        'score': score,
+        'signals': signals,
+        'status': 'held',
+        'timestamp': datetime.utcnow()
+    })
+
+
+def get_held_views_summary(limit: int = 10) -> List[Dict]:
+    """Held views grouped by uploader, most flagged first"""
+    if held_views_collection is None:
+        return []
+    
+    return list(held_views_collection.aggregate([
+        {'$match': {'status': 'held'}},
+        {'$group': {
+            '_id': '$uploader_id',
+            'count': {'$sum': 1},
+            'max_score': {'$max': '$score'},
+            'files': {'$addToSet': '$short_link_id'},
+            'last_seen': {'$max': '$timestamp'}
+        }},
+        {'$sort': {'count': -1}},
+        {'$limit': limit}
+    ]))
+
+
+def claim_held_views(uploader_id: int) -> List[Dict]:
+    """Mark an uploader's held views released and return them for crediting.
+
+    Like live views, an IP is credited at most once per file every
+    RECENT_VIEW_MINUTES; the extra views are marked 'duplicate' instead.
+    """
+    if held_views_collection is None:
+        return []
+    
+    claimed = []
+    last_credited = {}
+    for held in held_views_collection.find({'status': 'held', 'uploader_id': uploader_id}).sort('timestamp', 1):
+        key = (held['short_link_id'], held['ip'])
+        previous = last_credited.get(key)
+        duplicate = previous is not None and held['timestamp'] - previous < timedelta(minutes=RECENT_VIEW_MINUTES)
+        result = held_views_collection.update_one(
+            {'_id': held['_id'], 'status': 'held'},
+            {'$set': {'status': 'duplicate' if duplicate else 'released', 'reviewed_at': datetime.utcnow()}}
+        )
+        if result.modified_count and not duplicate:
+            last_credited[key] = held['timestamp']
+            claimed.append(held)
+    return claimed
+
+
+def discard_held_views(uploader_id: int) -> int:
+    """Reject an uploader's held views without crediting them"""
+    if held_views_collection is None:
+        return 0
+    
+    result = held_views_collection.update_many(
+        {'status': 'held', 'uploader_id': uploader_id},
+        {'$set': {'status': 'discarded', 'reviewed_at': datetime.utcnow()}}
+    )
+    return result.modified_count
+
+
+# Broadcast Functions
+def create_broadcast(admin_id: int, source_chat_id: int, source_message_id: int) -> Dict:
+    """Create a broadcast job that copies one message to every reachable user"""
+    if broadcasts_collection is None:
+        return {}
+    
+    broadcast = {
+        'admin_id': admin_id,
+        'source_chat_id': source_chat_id,
+        'source_message_id': source_message_id,
+        'status': 'running',
+        'last_user_id': None,
+        'total': users_collection.count_documents({'blocked': {'$ne': True}}),
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'status_message_id': None,
+        'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    }
+    result = broadcasts_collection.insert_one(broadcast)
+    broadcast['_id'] = result.inserted_id
+    return broadcast
+
+
+def get_broadcast(broadcast_id) -> Optional[Dict]:
+    if broadcasts_collection is None:
+        return None
+    return broadcasts_collection.find_one({'_id': broadcast_id})
+
+
+def get_running_broadcasts() -> List[Dict]:
+    if broadcasts_collection is None:
+        return []
+    return list(broadcasts_collection.find({'status': 'running'}))
+
+
+def get_latest_broadcast() -> Optional[Dict]:
+    if broadcasts_collection is None:
+        return None
+    return broadcasts_collection.find_one(sort=[('created_at', -1)])
+
+
+def update_broadcast(broadcast_id, fields: Dict = None, counts: Dict[str, int] = None):
+    """Checkpoint broadcast progress"""
+    if broadcasts_collection is None:
+        return
+    
+    update = {'$set': {**(fields or {}), 'updated_at': datetime.utcnow()}}
+    if counts:
+        update['$inc'] = counts
+    broadcasts_collection.update_one({'_id': broadcast_id}, update)
+
+
+def iter_user_id_batches(after_user_id: int = None, batch_size: int = 500):
+    """Yield batches of reachable user IDs in ascending order using the user_id index"""
+    if users_collection is None:
+        return
+    
+    while True:
+        query = {'blocked': {'$ne': True}}
+        if after_user_id is not None:
+            query['user_id'] = {'$gt': after_user_id}
+        
+        batch = [
+            u['user_id'] for u in users_collection.find(query, {'user_id': 1, '_id': 0})
+            .sort('user_id', 1).limit(batch_size)
+        ]
+        if not batch:
+            return
+        yield batch
+        after_user_id = batch[-1]
+        if len(batch) < batch_size:
+            return
+
+
+def mark_user_blocked(user_id: int, blocked: bool = True):
+    """Flag a user who blocked the bot so broadcasts skip them"""
+    if users_collection is None:
+        return
+    users_collection.update_one({'user_id': user_id}, {'$set': {'blocked': blocked}})
+
+
+# Conversation State Functions
+def get_session(user_id: int) -> Optional[Dict]:
+    """Return a user's conversation state, ignoring entries the TTL monitor hasn't removed yet"""
+    if sessions_collection is None:
+        return None
+    doc = sessions_collection.find_one({'_id': user_id, 'expires_at': {'$gt': datetime.utcnow()}})
+    return doc['state'] if doc else None
+
+
+def save_session(user_id: int, state: Dict, expires_at: datetime):
+    if sessions_collection is None:
+        return
+    sessions_collection.update_one(
+        {'_id': user_id},
+        {'$set': {'state': state, 'expires_at': expires_at, 'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def delete_session(user_id: int):
+    if sessions_collection is None:
+        return
+    sessions_collection.delete_one({'_id': user_id})
+
+
+def trim_sessions(max_sessions: int) -> int:
+    """Delete the least recently updated sessions beyond `max_sessions`"""
+    if sessions_collection is None:
+        return 0
+    
+    excess = sessions_collection.estimated_document_count() - max_sessions
+    if excess <= 0:
+        return 0
+    
+    stale_ids = [
+        doc['_id'] for doc in sessions_collection.find({}, {'_id': 1})
+        .sort('updated_at', 1).limit(excess)
+    ]
+    return sessions_collection.delete_many({'_id': {'$in': stale_ids}}).deleted_count
+
+
+# Scheduler Locks
+def acquire_job_lock(name: str, owner: str, expires_at: datetime) -> bool:
+    """Take or renew the lease on a scheduled job; False while another instance holds it.
+
+    Without MongoDB there is only one instance, so the lock is always granted.
+    """
+    if locks_collection is None:
+        return True
+    
+    now = datetime.utcnow()
+    try:
+        locks_collection.update_one(
+            {'_id': name, '$or': [{'expires_at': {'$lte': now}}, {'owner': owner}]},
+            {'$set': {'owner': owner, 'expires_at': expires_at, 'acquired_at': now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
 if client is not None:
+    ensure_indexes()
     init_default_settings()
@@ -0,0 +1,59 @@
+import os
+import hmac
+import time
+import base64
+import struct
+import hashlib
+import secrets
+from typing import Optional, Tuple
+
+# Must be shared by the web and bot processes; a random fallback only works
+# when both run in one process (main.py).
+DELIVERY_SECRET = (os.getenv('DELIVERY_SECRET') or os.getenv('SECRET_KEY') or secrets.token_hex(32)).encode()
+DELIVERY_TOKEN_TTL_SECONDS = int(os.getenv('DELIVERY_TOKEN_TTL_SECONDS', '3600'))
+
+# Telegram start parameters are limited to 64 characters of [A-Za-z0-9_-]
+MAX_TOKEN_LENGTH = 64
+MAC_BYTES = 12
+HEADER = struct.Struct('>IB')
+
+FILE_TYPES = ['document', 'photo', 'video', 'audio', 'bundle']
+
+
+def _mac(body: bytes) -> bytes:
+    return hmac.new(DELIVERY_SECRET, body, hashlib.sha256).digest()[:MAC_BYTES]
+
+
+def issue_token(short_link_id: str, file_type: str = 'document', ttl_seconds: int = DELIVERY_TOKEN_TTL_SECONDS) -> str:
+    """Build a signed, expiring deep-link payload: expiry, file type and short link id"""
+    type_code = FILE_TYPES.index(file_type) if file_type in FILE_TYPES else 0
+    body = HEADER.pack(int(time.time()) + ttl_seconds, type_code) + short_link_id.encode()
+    token = base64.urlsafe_b64encode(body + _mac(body)).rstrip(b'=').decode()
+    if len(token) > MAX_TOKEN_LENGTH:
+        raise ValueError("short_link_id is too long for a delivery token")
+    return token
+
+
+def verify_token(token: str) -> Optional[Tuple[str, str]]:
+    """Return (short_link_id, file_type) for a valid unexpired token, else None"""
+    if not token or len(token) > MAX_TOKEN_LENGTH:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) <= HEADER.size + MAC_BYTES:
+        return None
+
+    body, mac = raw[:-MAC_BYTES], raw[-MAC_BYTES:]
+    if not hmac.compare_digest(mac, _mac(body)):
+        return None
+
+    expires_at, type_code = HEADER.unpack_from(body)
+    if expires_at < time.time() or type_code >= len(FILE_TYPES):
+        return None
+    try:
+        short_link_id = body[HEADER.size:].decode()
+    except UnicodeDecodeError:
+        return None
+    return short_link_id, FILE_TYPES[type_code]
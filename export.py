@@ -0,0 +1,243 @@
+import os
+import io
+import csv
+import sys
+import json
+import zlib
+import argparse
+from datetime import datetime
+from typing import Dict, Iterator, Iterable, Optional, List
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database
+from money import format_money
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Dataset name -> (collection attribute in database.py, CSV columns)
+DATASETS = {
+    'views': ('views_collection', [
+        '_id', 'short_link_id', 'ip', 'country', 'user_agent', 'timestamp'
+    ]),
+    'files': ('files_collection', [
+        '_id', 'short_link_id', 'file_name', 'file_type', 'uploader_id',
+        'short_link', 'views', 'geo_stats', 'created_at'
+    ]),
+    'earnings': ('users_collection', [
+        'user_id', 'username', 'balance_micros', 'total_views', 'files_uploaded',
+        'referrer_id', 'referral_count', 'referral_earnings_micros', 'created_at'
+    ]),
+    'withdrawals': ('withdrawals_collection', [
+        '_id', 'user_id', 'amount_micros', 'payment_method', 'payment_details',
+        'status', 'created_at', 'processed_at', 'admin_note'
+    ]),
+}
+
+FORMATS = ('ndjson', 'csv')
+
+PAYOUT_COLUMNS = [
+    '_id', 'user_id', 'amount', 'payment_method', 'payment_details', 'batch_id', 'processed_at'
+]
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return None
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=_json_default, separators=(',', ':'))
+    if isinstance(value, (ObjectId, datetime)):
+        return _json_default(value)
+    return value
+
+
+def serialize_document(doc: Dict) -> str:
+    """Serialize a Mongo document to a single compact JSON line"""
+    return json.dumps(doc, default=_json_default, separators=(',', ':'), ensure_ascii=False)
+
+
+def iter_batches(collection, since: datetime = None, until: datetime = None,
+                 batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict]]:
+    """Yield lists of documents in _id order, one batch in memory at a time.
+
+    Pages with `_id > last_id` instead of holding one long-lived cursor, so a
+    slow consumer can't hit the server-side cursor timeout and documents may be
+    deleted between batches. Time bounds are translated into ObjectId bounds so
+    the _id index does all the work.
+    """
+    if collection is None:
+        return
+
+    id_range = {}
+    if since:
+        id_range['$gte'] = ObjectId.from_datetime(since)
+    if until:
+        id_range['$lt'] = ObjectId.from_datetime(until)
+
+    last_id = None
+    while True:
+        query_range = dict(id_range)
+        if last_id is not None:
+            query_range['$gt'] = last_id
+        query = {'_id': query_range} if query_range else {}
+
+        batch = list(collection.find(query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]['_id']
+        if len(batch) < batch_size:
+            return
+
+
+def iter_documents(dataset: str, since: datetime = None, until: datetime = None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    attr, _ = DATASETS[dataset]
+    collection = getattr(database, attr)
+    for batch in iter_batches(collection, since, until, batch_size):
+        yield from batch
+
+
+def iter_ndjson(docs: Iterable[Dict]) -> Iterator[str]:
+    for doc in docs:
+        yield serialize_document(doc) + '\n'
+
+
+def iter_csv(docs: Iterable[Dict], columns: List[str]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    for doc in docs:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_csv_value(doc.get(column)) for column in columns])
+        yield buffer.getvalue()
+
+
+def iter_chunks(lines: Iterable[str], chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Group text lines into byte chunks of roughly chunk_size"""
+    pending = []
+    pending_size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= chunk_size:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield b''.join(pending)
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_dataset(dataset: str, fmt: str = 'ndjson', since: datetime = None,
+                   until: datetime = None, compress: bool = False) -> Iterator[bytes]:
+    """Stream a whole dataset as NDJSON or CSV bytes with constant memory"""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    docs = iter_documents(dataset, since, until)
+    if fmt == 'csv':
+        lines = iter_csv(docs, DATASETS[dataset][1])
+    else:
+        lines = iter_ndjson(docs)
+
+    chunks = iter_chunks(lines)
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
+
+
+def iter_payouts(batch_id: str, payment_method: str = None) -> Iterator[Dict]:
+    """Approved withdrawals of a payout batch, with the amount in dollars"""
+    if database.withdrawals_collection is None:
+        return
+    query = {'batch_id': batch_id, 'status': 'approved'}
+    if payment_method:
+        query['payment_method'] = payment_method
+    cursor = database.withdrawals_collection.find(query).sort('_id', 1).batch_size(EXPORT_BATCH_SIZE)
+    for doc in cursor:
+        doc['amount'] = format_money(doc.get('amount_micros'), 2)[1:]
+        yield doc
+
+
+def export_payouts(batch_id: str, payment_method: str = None) -> Iterator[bytes]:
+    """Stream a payout batch as CSV, optionally for one payment method only"""
+    return iter_chunks(iter_csv(iter_payouts(batch_id, payment_method), PAYOUT_COLUMNS))
+
+
+def get_payout_methods(batch_id: str) -> List[str]:
+    if database.withdrawals_collection is None:
+        return []
+    return sorted(database.withdrawals_collection.distinct(
+        'payment_method', {'batch_id': batch_id, 'status': 'approved'}
+    ))
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export bot data as NDJSON or CSV")
+    parser.add_argument('dataset', choices=sorted(DATASETS))
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default='ndjson')
+    parser.add_argument('--since', help="ISO date, inclusive (e.g. 2024-01-01)")
+    parser.add_argument('--until', help="ISO date, exclusive")
+    parser.add_argument('--gzip', action='store_true', help="Gzip the output")
+    parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    if database.client is None:
+        print("❌ MONGO_URI is not configured", file=sys.stderr)
+        return 1
+
+    chunks = export_dataset(
+        args.dataset, args.fmt,
+        since=parse_date(args.since), until=parse_date(args.until),
+        compress=args.gzip
+    )
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        else:
+            out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import os
+import threading
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+DL_CACHE_DIR = os.getenv('DL_CACHE_DIR', 'download_cache')
+DL_CACHE_MAX_BYTES = int(os.getenv('DL_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+DL_CACHE_MAX_FILE_BYTES = int(os.getenv('DL_CACHE_MAX_FILE_BYTES', str(256 * 1024 ** 2)))
+FILL_WAIT_SECONDS = 60
+READ_SIZE = 256 * 1024
+
+
+class Fill:
+    """Progress of one upstream download that any number of readers can follow"""
+
+    def __init__(self, tmp_path: str):
+        self.tmp_path = tmp_path
+        # Switched to the final path, under the condition, once the download is renamed
+        self.current_path = tmp_path
+        self.written = 0
+        self.done = False
+        self.failed = False
+        self.condition = threading.Condition()
+
+
+class DiskFileCache:
+    """Size-bounded on-disk LRU cache of downloaded files, keyed by file_unique_id.
+
+    Hits are plain files that can be served with sendfile. On a miss, one
+    background thread downloads the file into a temporary file and every
+    request for it, including concurrent ones, reads behind that download
+    instead of fetching it again. Recency is tracked through file mtimes.
+    """
+
+    def __init__(self, directory: str = DL_CACHE_DIR, max_bytes: int = DL_CACHE_MAX_BYTES,
+                 max_file_bytes: int = DL_CACHE_MAX_FILE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.fills: Dict[str, Fill] = {}
+        self.lock = threading.Lock()
+        self.metrics = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'failed_fills': 0,
+            'bytes_fetched': 0,
+            'bytes_saved': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def accepts(self, key: Optional[str], size: Optional[int]) -> bool:
+        return self.enabled and bool(key) and bool(size) and size <= min(self.max_file_bytes, self.max_bytes)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of a cached file, marking it recently used; None on a miss"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.metrics['hits'] += 1
+        return path
+
+    def fetch(self, key: str, chunks: Callable[[], Iterator[bytes]]) -> Tuple[Fill, bool]:
+        """Start downloading `key`, or join the download already in progress.
+
+        Returns the fill and whether an existing download was joined.
+        """
+        with self.lock:
+            fill = self.fills.get(key)
+            if fill is not None:
+                self.metrics['coalesced'] += 1
+                return fill, True
+            self.metrics['misses'] += 1
+            os.makedirs(self.directory, exist_ok=True)
+            fill = self.fills[key] = Fill(self.path_for(key) + f'.{threading.get_ident()}.part')
+
+        threading.Thread(target=self._fill, args=(key, fill, chunks), daemon=True).start()
+        return fill, False
+
+    def _fill(self, key: str, fill: Fill, chunks: Callable[[], Iterator[bytes]]):
+        try:
+            with open(fill.tmp_path, 'wb') as f:
+                for chunk in chunks():
+                    f.write(chunk)
+                    f.flush()
+                    with fill.condition:
+                        fill.written += len(chunk)
+                        fill.condition.notify_all()
+            with fill.condition:
+                os.replace(fill.tmp_path, self.path_for(key))
+                fill.current_path = self.path_for(key)
+            with self.lock:
+                self.metrics['bytes_fetched'] += fill.written
+        except Exception as e:
+            print(f"Download cache fill failed for {key}: {e}")
+            fill.failed = True
+            with self.lock:
+                self.metrics['failed_fills'] += 1
+            try:
+                os.remove(fill.tmp_path)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.fills.pop(key, None)
+            with fill.condition:
+                fill.done = True
+                fill.condition.notify_all()
+        if not fill.failed:
+            self.evict()
+
+    def iter_fill(self, fill: Fill, start: int, end: int) -> Iterator[bytes]:
+        """Yield bytes start..end (inclusive) of a file while it is being downloaded"""
+        # Opened once: the descriptor stays valid after the temp file is renamed
+        with fill.condition:
+            while fill.written == 0 and not fill.done:
+                if not fill.condition.wait(FILL_WAIT_SECONDS):
+                    raise IOError("Upstream download stalled")
+            if fill.failed:
+                raise IOError("Upstream download failed")
+            f = open(fill.current_path, 'rb')
+
+        with f:
+            f.seek(start)
+            position = start
+            while position <= end:
+                with fill.condition:
+                    while fill.written <= position and not fill.done:
+                        if not fill.condition.wait(FILL_WAIT_SECONDS):
+                            raise IOError("Upstream download stalled")
+                    if fill.failed:
+                        raise IOError("Upstream download failed")
+                    available = fill.written
+                if available <= position:
+                    return
+                data = f.read(min(READ_SIZE, available - position, end + 1 - position))
+                if not data:
+                    return
+                position += len(data)
+                yield data
+
+    def record_saved(self, nbytes: int):
+        with self.lock:
+            self.metrics['bytes_saved'] += nbytes
+
+    def evict(self):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.part') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self.lock:
+            metrics = dict(self.metrics)
+        requests = metrics['hits'] + metrics['misses'] + metrics['coalesced']
+        metrics['hit_ratio'] = round((metrics['hits'] + metrics['coalesced']) / requests, 3) if requests else 0.0
+        return metrics
+
+
+file_cache = DiskFileCache()
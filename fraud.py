@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple
+from sketches import RotatingCountMin
+
+FRAUD_WINDOW_SECONDS = int(os.getenv('FRAUD_WINDOW_SECONDS', '600'))
+FRAUD_THRESHOLD = float(os.getenv('FRAUD_THRESHOLD', '2.0'))
+
+# Views per window at which a velocity signal reaches 1.0
+IP_PREFIX_LIMIT = int(os.getenv('FRAUD_IP_PREFIX_LIMIT', '30'))
+FILE_LIMIT = int(os.getenv('FRAUD_FILE_LIMIT', '500'))
+# Views per window before share-based signals are considered meaningful
+MIN_VIEWS_FOR_SHARE = int(os.getenv('FRAUD_MIN_VIEWS_FOR_SHARE', '20'))
+# File velocity only counts once an IP signal (ip_prefix or concentration) reaches this
+IP_CORROBORATION = float(os.getenv('FRAUD_IP_CORROBORATION', '0.5'))
+
+MAX_SIGNAL = 1.5
+
+
+def ip_prefix(ip: str) -> str:
+    """Collapse an IPv4 address to its /24 (or an IPv6 address to its /48)"""
+    if ':' in ip:
+        return ':'.join(ip.split(':')[:3]) + '::/48'
+    return '.'.join(ip.split('.')[:3]) + '.0/24'
+
+
+class FraudScorer:
+    """Scores view events for click-fraud using constant-memory rate sketches.
+
+    Velocity signals are scaled so 1.0 means "at the limit" and are capped at
+    MAX_SIGNAL; share signals range from 0 to 1. With the default threshold of
+    2.0 no single signal can hold a view back on its own. A viral file draws a
+    flood of ordinary visitors, so file velocity is only added to the score
+    next to an IP signal of at least IP_CORROBORATION.
+    - ip_prefix:     views from the visitor's /24 across all files
+    - file:          overall velocity of this file
+    - user_agent:    share of this file's recent views with this exact user agent
+    - concentration: share of the uploader's recent views coming from this /24
+    An empty user agent adds a flat 0.5.
+    """
+
+    def __init__(self, window_seconds: int = FRAUD_WINDOW_SECONDS, threshold: float = FRAUD_THRESHOLD):
+        self.threshold = threshold
+        self.ip_prefixes = RotatingCountMin(window_seconds)
+        self.user_agents = RotatingCountMin(window_seconds)
+        self.files = RotatingCountMin(window_seconds)
+        self.uploaders = RotatingCountMin(window_seconds)
+        self.uploader_prefixes = RotatingCountMin(window_seconds)
+        self.lock = threading.Lock()
+
+    def score(self, short_link_id: str, uploader_id: int, ip: str, user_agent: str) -> Tuple[float, Dict[str, float]]:
+        now = time.time()
+        prefix = ip_prefix(ip)
+
+        with self.lock:
+            prefix_rate = self.ip_prefixes.add(prefix, now)
+            user_agent_rate = self.user_agents.add(f"{short_link_id}|{user_agent}", now)
+            file_rate = self.files.add(short_link_id, now)
+            uploader_rate = self.uploaders.add(str(uploader_id), now)
+            uploader_prefix_rate = self.uploader_prefixes.add(f"{uploader_id}|{prefix}", now)
+
+        signals = {
+            'ip_prefix': min(prefix_rate / IP_PREFIX_LIMIT, MAX_SIGNAL),
+            'file': min(file_rate / FILE_LIMIT, MAX_SIGNAL),
+            'user_agent': 0.0,
+            'concentration': 0.0,
+        }
+        if file_rate >= MIN_VIEWS_FOR_SHARE:
+            signals['user_agent'] = min(user_agent_rate / file_rate, 1.0)
+        if uploader_rate >= MIN_VIEWS_FOR_SHARE:
+            signals['concentration'] = min(uploader_prefix_rate / uploader_rate, 1.0)
+        if not user_agent:
+            signals['empty_user_agent'] = 0.5
+
+        score = sum(signals.values())
+        if max(signals['ip_prefix'], signals['concentration']) < IP_CORROBORATION:
+            score -= signals['file']
+        return round(score, 3), signals
+
+    def is_suspicious(self, score: float) -> bool:
+        return score >= self.threshold
+
+
+scorer = FraudScorer()
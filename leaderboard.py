@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+from database import (
+    add_leaderboard_counts, get_leaderboard_top, get_top_earners, get_top_files,
+    get_usernames, get_file_names
+)
+
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '10'))
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', '300'))
+LEADERBOARD_FLUSH_SECONDS = int(os.getenv('LEADERBOARD_FLUSH_SECONDS', '30'))
+
+BOARDS = ('earners', 'files')
+PERIODS = ('day', 'week', 'all')
+# How long a finished day/week keeps its counters before the TTL index drops them
+PERIOD_RETENTION = {
+    'day': timedelta(days=2),
+    'week': timedelta(weeks=2),
+}
+
+
+def period_keys(now: datetime = None) -> Dict[str, str]:
+    """Current UTC day and ISO week, e.g. {'day': 'day:2024-05-01', 'week': 'week:2024-W18'}"""
+    now = now or datetime.utcnow()
+    year, week, _ = now.isocalendar()
+    return {'day': f"day:{now:%Y-%m-%d}", 'week': f"week:{year}-W{week:02d}"}
+
+
+class LeaderboardCounter:
+    """Buffers daily and weekly leaderboard increments in the web process.
+
+    Counts are merged in memory and flushed by a background thread as a single
+    bulk upsert, so crediting a view adds no extra round trip to MongoDB.
+    """
+
+    def __init__(self, flush_seconds: int = LEADERBOARD_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        self.pending: Dict = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _add(self, board: str, item: str, value: int, keys: Dict[str, str]):
+        for key in keys.values():
+            items = self.pending.setdefault((board, key), {})
+            items[item] = items.get(item, 0) + value
+
+    def add_view(self, short_link_id: str, credits: Dict[int, int]):
+        """Count a credited view for its file and the earnings of everyone it paid"""
+        keys = period_keys()
+        with self.lock:
+            self._add('files', short_link_id, 1, keys)
+            for user_id, micros in credits.items():
+                self._add('earners', str(user_id), micros, keys)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def flush(self):
+        with self.lock:
+            counts, self.pending = self.pending, {}
+        if not counts:
+            return
+
+        now = datetime.utcnow()
+        expires_at = {}
+        for _, key in counts:
+            period = key.split(':', 1)[0]
+            expires_at[key] = now + PERIOD_RETENTION[period]
+        try:
+            add_leaderboard_counts(counts, expires_at)
+        except Exception as e:
+            print(f"Leaderboard flush error: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+
+class Leaderboard:
+    """Top earners and files per period, refreshed in the background and read from memory.
+
+    Every list is one indexed sort+limit query: the daily and weekly counters
+    for day/week, and the lifetime fields on users and files for all-time.
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE):
+        self.size = size
+        self.boards: Dict = {(board, period): [] for board in BOARDS for period in PERIODS}
+        self.refreshed_at = None
+
+    def refresh(self):
+        keys = period_keys()
+        boards = {}
+        for board in BOARDS:
+            for period in ('day', 'week'):
+                boards[(board, period)] = get_leaderboard_top(board, keys[period], self.size)
+        boards[('earners', 'all')] = get_top_earners(self.size)
+        boards[('files', 'all')] = get_top_files(self.size)
+
+        user_ids = {int(entry['item']) for period in PERIODS for entry in boards[('earners', period)]}
+        usernames = get_usernames(list(user_ids))
+        short_link_ids = {entry['item'] for period in PERIODS for entry in boards[('files', period)]}
+        file_names = get_file_names(list(short_link_ids))
+
+        for period in PERIODS:
+            for entry in boards[('earners', period)]:
+                entry['name'] = usernames.get(int(entry['item']))
+            for entry in boards[('files', period)]:
+                entry['name'] = file_names.get(entry['item'])
+
+        self.boards = boards
+        self.refreshed_at = datetime.utcnow()
+
+    def top(self, board: str, period: str, k: int = None) -> List[Dict]:
+        return self.boards.get((board, period), [])[:k or self.size]
+
+
+counter = LeaderboardCounter()
+leaderboard = Leaderboard()
@@ -1,25 +1,41 @@
 import os
+import sys
 import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# "web" and "bot" run one half each, so the web tier can be scaled out next to a single bot
+MODES = ('web', 'bot', 'all')
+WEB_PORT = int(os.getenv('PORT', '5000'))
+
 def run_web():
+    # Imported here so bot-only processes never load Flask, and web-only ones never load Pyrogram
     from web import app
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+    app.run(host='0.0.0.0', port=WEB_PORT, debug=False, use_reloader=False)
 
 def run_bot():
     from bot import run_bot
     run_bot()
 
 if __name__ == '__main__':
+    mode = (sys.argv[1] if len(sys.argv) > 1 else os.getenv('APP_MODE', 'all')).lower()
+    if mode not in MODES:
+        print(f"Usage: python main.py [{'|'.join(MODES)}]")
+        sys.exit(2)
+    
     print("=" * 50)
-    print("🚀 Starting File Monetization System")
+    print(f"🚀 Starting File Monetization System ({mode})")
     print("=" * 50)
     
-    web_thread = threading.Thread(target=run_web, daemon=True)
-    web_thread.start()
-    print("✅ Flask Web Server started on port 5000")
-    
-    print("✅ Starting Telegram Bot...")
-    run_bot()
+    if mode == 'web':
+        run_web()
+    elif mode == 'bot':
+        run_bot()
+    else:
+        web_thread = threading.Thread(target=run_web, daemon=True)
+        web_thread.start()
+        print(f"✅ Flask Web Server started on port {WEB_PORT}")
+        
+        print("✅ Starting Telegram Bot...")
+        run_bot()
@@ -0,0 +1,105 @@
+import os
+import sys
+import argparse
+from typing import Dict
+from pymongo import UpdateOne
+from bson.int64 import Int64
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import database
+from export import iter_batches
+from money import to_micros
+
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '1000'))
+
+# Collection attribute in database.py -> {legacy float field: integer micro-dollar field}
+MONEY_FIELDS = {
+    'users_collection': {'balance': 'balance_micros', 'referral_earnings': 'referral_earnings_micros'},
+    'withdrawals_collection': {'amount': 'amount_micros'},
+}
+
+
+def migrate_collection(collection, fields: Dict[str, str], batch_size: int = MIGRATION_BATCH_SIZE) -> Dict:
+    """Convert legacy float money fields to micro-dollars, one bulk write per batch.
+
+    The converted value is added with $inc so credits already made to the new
+    field are kept, and each update only applies while the legacy values are
+    unchanged. Documents skipped because of a concurrent write are picked up by
+    running the migration again.
+    """
+    result = {'scanned': 0, 'migrated': 0, 'skipped': 0}
+
+    for batch in iter_batches(collection, batch_size=batch_size):
+        operations = []
+        for doc in batch:
+            legacy = {old: doc[old] for old in fields if old in doc}
+            if not legacy:
+                continue
+            increments = {fields[old]: Int64(to_micros(value or 0)) for old, value in legacy.items()}
+            operations.append(UpdateOne(
+                {'_id': doc['_id'], **legacy},
+                {'$inc': increments, '$unset': {old: '' for old in legacy}}
+            ))
+
+        result['scanned'] += len(batch)
+        if operations:
+            modified = collection.bulk_write(operations, ordered=False).modified_count
+            result['migrated'] += modified
+            result['skipped'] += len(operations) - modified
+
+    return result
+
+
+def backfill_earned(batch_size: int = MIGRATION_BATCH_SIZE) -> Dict:
+    """Set each user's lifetime earned_micros to balance plus approved withdrawals.
+
+    Every credit raises both balance and earnings and only approvals lower the
+    balance, so the value is recomputed from the live balance in the update
+    itself and the backfill can be re-run at any time.
+    """
+    withdrawn = {
+        row['_id']: row['amount_micros'] for row in database.withdrawals_collection.aggregate([
+            {'$match': {'status': 'approved'}},
+            {'$group': {'_id': '$user_id', 'amount_micros': {'$sum': '$amount_micros'}}}
+        ])
+    }
+
+    result = {'scanned': 0, 'updated': 0}
+    for batch in iter_batches(database.users_collection, batch_size=batch_size):
+        operations = [
+            UpdateOne(
+                {'_id': user['_id']},
+                [{'$set': {'earned_micros': {'$add': [
+                    {'$ifNull': ['$balance_micros', 0]}, Int64(withdrawn.get(user['user_id'], 0))
+                ]}}}]
+            )
+            for user in batch
+        ]
+        result['scanned'] += len(batch)
+        if operations:
+            result['updated'] += database.users_collection.bulk_write(operations, ordered=False).modified_count
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert float balances and amounts to integer micro-dollars and backfill lifetime earnings")
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    if database.client is None:
+        print("❌ MONGO_URI is not configured", file=sys.stderr)
+        return 1
+
+    for attr, fields in MONEY_FIELDS.items():
+        result = migrate_collection(getattr(database, attr), fields, args.batch_size)
+        print(f"✅ {attr}: scanned {result['scanned']}, migrated {result['migrated']}, skipped {result['skipped']}")
+
+    result = backfill_earned(args.batch_size)
+    print(f"✅ earned_micros: scanned {result['scanned']}, updated {result['updated']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
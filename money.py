@@ -0,0 +1,21 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Money is stored and summed as integer micro-dollars so repeated $inc stays exact
+MICROS_PER_DOLLAR = 1_000_000
+
+
+def to_micros(dollars) -> int:
+    """Convert a dollar amount (float, str or Decimal) to integer micro-dollars"""
+    try:
+        value = Decimal(str(dollars))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {dollars!r}")
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {dollars!r}")
+    return int((value * MICROS_PER_DOLLAR).to_integral_value(ROUND_HALF_UP))
+
+
+def format_money(micros: int, places: int = 4) -> str:
+    """Format micro-dollars as "$1.2345" without going through float"""
+    value = Decimal(micros or 0) / MICROS_PER_DOLLAR
+    return f"${value.quantize(Decimal(1).scaleb(-places), ROUND_HALF_UP)}"
@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, Optional
+from pyrogram.errors import FloodWait
+from ratelimit import TokenBucket, KeyedTokenBuckets
+
+# Telegram allows ~30 messages/second overall, ~1/second per private chat and
+# 20/minute per group; stay slightly under each.
+GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '28'))
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+MAX_FLOOD_RETRIES = 3
+
+PRIORITY_DELIVERY = 0
+PRIORITY_REPLY = 1
+PRIORITY_NOTIFICATION = 5
+PRIORITY_BROADCAST = 9
+
+
+class OutboundQueue:
+    """Central priority queue for outgoing Telegram API calls.
+
+    Every send waits for both the global and the per-chat token bucket, and a
+    FloodWait is slept off and retried instead of being dropped. Lower priority
+    numbers go first, so file deliveries overtake notifications and broadcasts.
+    """
+
+    def __init__(self, workers: int = SEND_WORKERS):
+        self.workers = workers
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.tasks = []
+        self.sequence = itertools.count()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.private_buckets = KeyedTokenBuckets(PRIVATE_CHAT_RATE, 3)
+        self.group_buckets = KeyedTokenBuckets(GROUP_CHAT_RATE, 5)
+        self.metrics = {
+            'sent': 0,
+            'failed': 0,
+            'flood_waits': 0,
+            'latency_avg_ms': 0.0,
+            'latency_max_ms': 0.0,
+        }
+
+    def start(self):
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable], priority: int = PRIORITY_NOTIFICATION) -> asyncio.Future:
+        """Queue an API call; the returned future resolves with its result"""
+        if self.queue is None:
+            # Not started (e.g. handlers invoked outside run_bot): send directly
+            return asyncio.ensure_future(call())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((priority, next(self.sequence), chat_id, call, future, time.monotonic()))
+        return future
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable], priority: int = PRIORITY_REPLY):
+        """Queue an API call and wait for its result"""
+        return await self.submit(chat_id, call, priority)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id < 0:
+            return self.group_buckets.get(chat_id)
+        return self.private_buckets.get(chat_id)
+
+    async def _wait_for_tokens(self, chat_id: int):
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            delay = max(self.global_bucket.delay(), chat_bucket.delay())
+            if delay <= 0:
+                self.global_bucket.try_acquire()
+                chat_bucket.try_acquire()
+                return
+            await asyncio.sleep(delay)
+
+    async def _worker(self):
+        while True:
+            priority, _, chat_id, call, future, enqueued_at = await self.queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                result = await self._deliver(chat_id, call)
+                self._record_latency(enqueued_at)
+                self.metrics['sent'] += 1
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.metrics['failed'] += 1
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, chat_id: int, call: Callable[[], Awaitable]):
+        for attempt in range(MAX_FLOOD_RETRIES + 1):
+            await self._wait_for_tokens(chat_id)
+            try:
+                return await call()
+            except FloodWait as e:
+                self.metrics['flood_waits'] += 1
+                if attempt == MAX_FLOOD_RETRIES:
+                    raise
+                print(f"FloodWait for chat {chat_id}: sleeping {e.value}s")
+                await asyncio.sleep(e.value)
+
+    def _record_latency(self, enqueued_at: float):
+        latency_ms = (time.monotonic() - enqueued_at) * 1000
+        self.metrics['latency_avg_ms'] = self.metrics['latency_avg_ms'] * 0.9 + latency_ms * 0.1
+        self.metrics['latency_max_ms'] = max(self.metrics['latency_max_ms'], latency_ms)
+
+    def stats(self) -> Dict:
+        return {
+            'depth': self.queue.qsize() if self.queue is not None else 0,
+            'workers': len(self.tasks),
+            **self.metrics
+        }
+
+
+def log_failure(future: asyncio.Future, description: str):
+    """Attach a callback that logs a failed fire-and-forget send"""
+    def callback(f):
+        if not f.cancelled() and f.exception():
+            print(f"Failed to send {description}: {f.exception()}")
+    future.add_done_callback(callback)
@@ -0,0 +1,151 @@
+import time
+import asyncio
+import functools
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict
+
+# Lane the running coroutine holds a slot in, so blocking calls land on that lane's threads
+current_lane = contextvars.ContextVar('current_lane', default=None)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available (0 if available now)"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class KeyedTokenBuckets:
+    """One token bucket per key, keeping at most `max_keys` of the most recently used"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+
+class ConcurrencyLanes:
+    """Named semaphores, so one kind of work can't use up every slot of another.
+
+    Each lane also has its own thread pool, sized to its limit, for blocking
+    calls such as MongoDB queries; a slow query in one lane never ties up the
+    event loop or the threads of another. Handlers registered with `spawn`
+    run as tasks, so waiting for a busy lane doesn't hold one of the client's
+    dispatcher workers either.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.executors = {
+            name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"lane-{name}")
+            for name, limit in limits.items()
+        }
+        self.active = {name: 0 for name in limits}
+        self.waiting = {name: 0 for name in limits}
+        self.tasks = set()
+
+    @asynccontextmanager
+    async def acquire(self, name: str):
+        # Re-entering the lane already held (e.g. a delivery helper called from a delivery handler) is a no-op
+        if current_lane.get() == name:
+            yield
+            return
+        semaphore = self.semaphores.get(name)
+        if semaphore is None:
+            semaphore = self.semaphores[name] = asyncio.Semaphore(self.limits[name])
+        self.waiting[name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting[name] -= 1
+        self.active[name] += 1
+        token = current_lane.set(name)
+        try:
+            yield
+        finally:
+            current_lane.reset(token)
+            self.active[name] -= 1
+            semaphore.release()
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run a blocking call on the current lane's threads (the default pool outside any lane)"""
+        executor = self.executors.get(current_lane.get())
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def limit(self, name: str):
+        """Decorator running a coroutine function inside the named lane"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                async with self.acquire(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def detach(self, coro: Awaitable, description: str) -> asyncio.Task:
+        """Run a coroutine as a tracked task, logging it if it fails"""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+
+        def done(t):
+            self.tasks.discard(t)
+            if not t.cancelled() and t.exception():
+                print(f"{description} failed: {t.exception()!r}")
+        task.add_done_callback(done)
+        return task
+
+    def spawn(self, name: str):
+        """Decorator for update handlers: the body runs in the named lane as its own task"""
+        def decorator(func):
+            limited = self.limit(name)(func)
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                self.detach(limited(*args, **kwargs), func.__name__)
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {'limit': limit, 'active': self.active[name], 'waiting': self.waiting[name]}
+            for name, limit in self.limits.items()
+        }
@@ -0,0 +1,120 @@
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+ADMIN_LANE = 'admin'
+DEFAULT_LANE = 'menus'
+
+
+class Route:
+    def __init__(self, name: str, handler: Callable[..., Awaitable], admin: bool, prefix: bool, lane: str = None):
+        self.name = name
+        self.handler = handler
+        self.admin = admin
+        self.prefix = prefix
+        self.lane = lane or (ADMIN_LANE if admin else DEFAULT_LANE)
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, failed: bool):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if failed:
+            self.errors += 1
+
+
+class CallbackRouter:
+    """Dispatches callback queries by their data string.
+
+    Exact routes are a dict lookup. Prefix routes (e.g. "file_view_<id>") are
+    first looked up by everything up to the last underscore, falling back to a
+    scan of the registered prefixes for values that contain underscores.
+    Handlers of prefix routes receive the remainder of the data as `value`.
+    With `lanes` set, each handler runs inside its route's concurrency lane.
+    """
+
+    def __init__(self, is_admin: Callable[[int], bool], lanes=None):
+        self.is_admin = is_admin
+        self.lanes = lanes
+        self.exact: Dict[str, Route] = {}
+        self.prefixes: Dict[str, Route] = {}
+
+    def route(self, data: str, admin: bool = False, lane: str = None):
+        def decorator(handler):
+            self.exact[data] = Route(data, handler, admin, prefix=False, lane=lane)
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str, admin: bool = False, lane: str = None):
+        def decorator(handler):
+            self.prefixes[prefix] = Route(prefix + '*', handler, admin, prefix=True, lane=lane)
+            return handler
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Optional[Route], Optional[str]]:
+        route = self.exact.get(data)
+        if route:
+            return route, None
+
+        candidate = data[:data.rfind('_') + 1]
+        route = self.prefixes.get(candidate)
+        if route:
+            return route, data[len(candidate):]
+
+        for prefix, route in self.prefixes.items():
+            if data.startswith(prefix):
+                return route, data[len(prefix):]
+        return None, None
+
+    async def dispatch(self, client, callback_query) -> bool:
+        """Run the handler for a callback query; returns False if no route matched"""
+        route, value = self.resolve(callback_query.data or '')
+        if route is None:
+            return False
+
+        if route.admin and not self.is_admin(callback_query.from_user.id):
+            await callback_query.answer("❌ Admin only!", show_alert=True)
+            return True
+
+        if self.lanes is not None:
+            async with self.lanes.acquire(route.lane):
+                await self._call(route, client, callback_query, value)
+        else:
+            await self._call(route, client, callback_query, value)
+        return True
+
+    @staticmethod
+    async def _call(route: Route, client, callback_query, value: Optional[str]):
+        # Timed from here so the stats measure the handler itself, not the wait for its lane
+        started = time.perf_counter()
+        failed = False
+        try:
+            if route.prefix:
+                await route.handler(client, callback_query, value)
+            else:
+                await route.handler(client, callback_query)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            route.record((time.perf_counter() - started) * 1000, failed)
+
+    def stats(self):
+        """Per-route call counts, error counts and latency, slowest average first"""
+        routes = list(self.exact.values()) + list(self.prefixes.values())
+        return sorted(
+            (
+                {
+                    'route': r.name,
+                    'calls': r.calls,
+                    'errors': r.errors,
+                    'avg_ms': r.total_ms / r.calls if r.calls else 0.0,
+                    'max_ms': r.max_ms,
+                }
+                for r in routes if r.calls
+            ),
+            key=lambda x: x['avg_ms'],
+            reverse=True
+        )
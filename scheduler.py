@@ -0,0 +1,244 @@
+import os
+import socket
+import random
+import asyncio
+import inspect
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+from database import acquire_job_lock
+
+# A job whose lock can't be taken is skipped for this run: another instance has it
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 6),
+)
+
+
+def _parse_cron_field(text: str, low: int, high: int) -> Set[int]:
+    values = set()
+    for part in text.split(','):
+        spec, _, step_text = part.partition('/')
+        step = int(step_text) if step_text else 1
+        if spec == '*':
+            start, end = low, high
+        elif '-' in spec:
+            start, end = (int(v) for v in spec.split('-', 1))
+        else:
+            start = int(spec)
+            end = high if step_text else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field out of range: {part!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Standard five-field cron expression ("minute hour day month weekday", UTC, Sunday = 0)"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError(f"Cron expression needs {len(CRON_FIELDS)} fields: {expression!r}")
+        self.expression = expression
+        parsed = {name: _parse_cron_field(text, low, high) for text, (name, low, high) in zip(fields, CRON_FIELDS)}
+        self.minutes = parsed['minute']
+        self.hours = parsed['hour']
+        self.days = parsed['day']
+        self.months = parsed['month']
+        # Python's weekday() has Monday = 0
+        self.weekdays = {(day - 1) % 7 for day in parsed['weekday']}
+        # Like cron, a restricted day-of-month and day-of-week match either one
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment: datetime) -> bool:
+        in_days = moment.day in self.days
+        in_weekdays = moment.weekday() in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year, month = (candidate.year + 1, 1) if candidate.month == 12 else (candidate.year, candidate.month + 1)
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class Job:
+    def __init__(self, name: str, func: Callable, interval: float = None, cron: str = None,
+                 jitter: float = 0, distributed: bool = False, lease_seconds: float = None):
+        if (interval is None) == (cron is None):
+            raise ValueError("A job needs exactly one of interval or cron")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.distributed = distributed
+        self.lease_seconds = lease_seconds
+        self.running = False
+        self.next_run_at: Optional[datetime] = None
+        self.metrics = {
+            'runs': 0,
+            'failures': 0,
+            'skipped_overlap': 0,
+            'skipped_lock': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'last_ms': None,
+            'last_run_at': None,
+            'last_error': None,
+        }
+
+    @property
+    def schedule(self) -> str:
+        return f"every {self.interval:g}s" if self.interval else f"cron {self.cron.expression}"
+
+    def next_delay(self, first: bool) -> float:
+        """Seconds until the next run, jitter included; interval jobs run right away on start"""
+        if self.interval:
+            delay = 0 if first else self.interval
+        else:
+            now = datetime.utcnow()
+            delay = (self.cron.next_after(now) - now).total_seconds()
+        return delay + random.uniform(0, self.jitter)
+
+    def lease(self) -> float:
+        """How long the distributed lock is held, so other instances skip the same run"""
+        if self.lease_seconds:
+            return self.lease_seconds
+        if self.interval:
+            return self.interval
+        now = datetime.utcnow()
+        return max((self.cron.next_after(now) - now).total_seconds() - 1, 1)
+
+
+class Scheduler:
+    """Runs periodic jobs on the bot's event loop.
+
+    Blocking jobs run in a worker thread. A run that comes due while the
+    previous one is still going is skipped rather than stacked. Distributed
+    jobs take a lease in MongoDB first, so with several bot instances each
+    run happens on only one of them.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.tasks: List[asyncio.Task] = []
+        # Runs in progress; referenced here until they finish so none is garbage collected mid-run
+        self.runs: Set[asyncio.Task] = set()
+
+    def every(self, seconds: float, name: str = None, jitter: float = 0, distributed: bool = False,
+              lease_seconds: float = None):
+        def decorator(func):
+            self.add(Job(name or func.__name__, func, interval=seconds, jitter=jitter,
+                         distributed=distributed, lease_seconds=lease_seconds))
+            return func
+        return decorator
+
+    def cron(self, expression: str, name: str = None, jitter: float = 0, distributed: bool = False,
+             lease_seconds: float = None):
+        def decorator(func):
+            self.add(Job(name or func.__name__, func, cron=expression, jitter=jitter,
+                         distributed=distributed, lease_seconds=lease_seconds))
+            return func
+        return decorator
+
+    def add(self, job: Job):
+        if job.name in self.jobs:
+            raise ValueError(f"Duplicate job name: {job.name}")
+        self.jobs[job.name] = job
+
+    def start(self):
+        for job in self.jobs.values():
+            self.tasks.append(asyncio.create_task(self._loop(job)))
+
+    async def stop(self):
+        tasks = self.tasks + list(self.runs)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        self.runs.clear()
+
+    async def _loop(self, job: Job):
+        first = True
+        while True:
+            delay = job.next_delay(first)
+            first = False
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=delay)
+            await asyncio.sleep(delay)
+
+            if job.running:
+                job.metrics['skipped_overlap'] += 1
+                continue
+            job.running = True
+            run = asyncio.create_task(self._run(job))
+            self.runs.add(run)
+            run.add_done_callback(self.runs.discard)
+
+    async def _run(self, job: Job):
+        try:
+            if job.distributed:
+                expires_at = datetime.utcnow() + timedelta(seconds=job.lease())
+                if not await asyncio.to_thread(acquire_job_lock, job.name, INSTANCE_ID, expires_at):
+                    job.metrics['skipped_lock'] += 1
+                    return
+
+            started = time.perf_counter()
+            job.metrics['last_run_at'] = datetime.utcnow()
+            try:
+                if inspect.iscoroutinefunction(job.func):
+                    await job.func()
+                else:
+                    await asyncio.to_thread(job.func)
+                job.metrics['last_error'] = None
+            except Exception as e:
+                job.metrics['failures'] += 1
+                job.metrics['last_error'] = str(e)
+                print(f"Scheduled job {job.name} failed: {e}")
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                job.metrics['runs'] += 1
+                job.metrics['total_ms'] += elapsed_ms
+                job.metrics['max_ms'] = max(job.metrics['max_ms'], elapsed_ms)
+                job.metrics['last_ms'] = elapsed_ms
+        except Exception as e:
+            job.metrics['skipped_lock'] += 1
+            print(f"Scheduled job {job.name} could not take its lock: {e}")
+        finally:
+            job.running = False
+
+    def stats(self) -> List[Dict]:
+        stats = []
+        for job in self.jobs.values():
+            metrics = dict(job.metrics)
+            metrics['avg_ms'] = metrics['total_ms'] / metrics['runs'] if metrics['runs'] else 0.0
+            stats.append({
+                'name': job.name,
+                'schedule': job.schedule,
+                'distributed': job.distributed,
+                'running': job.running,
+                'next_run_at': job.next_run_at,
+                **metrics
+            })
+        return stats
@@ -0,0 +1,237 @@
+import math
+from array import array
+import base64
+import hashlib
+from typing import Dict, List, Tuple
+
+
+def _hash_pair(value: str) -> Tuple[int, int]:
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter for set membership with no false negatives"""
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytes = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.01) -> 'BloomFilter':
+        capacity = max(capacity, 1)
+        num_bits = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, value: str):
+        h1, h2 = _hash_pair(value)
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value: str):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    def to_dict(self) -> dict:
+        return {
+            'num_bits': self.num_bits,
+            'num_hashes': self.num_hashes,
+            'bits': base64.b64encode(bytes(self.bits)).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'BloomFilter':
+        return cls(data['num_bits'], data['num_hashes'], base64.b64decode(data['bits']))
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """HyperLogLog cardinality estimator with one byte per register.
+
+    With the default precision of 12 a sketch is 4 KB and the standard error is
+    about 1.6%, regardless of how many distinct values are added.
+    """
+
+    def __init__(self, precision: int = 12, registers: bytes = None):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.num_registers)
+
+    @classmethod
+    def position(cls, value: str, precision: int = 12) -> Tuple[int, int]:
+        """Return the (register index, rank) a value maps to"""
+        hashed = _hash64(value)
+        index = hashed >> (64 - precision)
+        remaining = (hashed << precision) & 0xFFFFFFFFFFFFFFFF
+        rank = min(64 - remaining.bit_length(), 64 - precision) + 1
+        return index, rank
+
+    def add(self, value: str):
+        index, rank = self.position(value, self.precision)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update_register(self, index: int, rank: int):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitters summary holding at most `capacity` counters.
+
+    Any item whose true frequency exceeds total/capacity is guaranteed to be
+    tracked; reported counts overestimate by at most the stored error.
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, item: str, count: int = 1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            self.errors.pop(victim, None)
+            self.counts[item] = floor + count
+            self.errors[item] = floor
+
+    def merge(self, other: 'SpaceSaving'):
+        for item, count in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+            self.errors[item] = self.errors.get(item, 0) + other.errors.get(item, 0)
+        if len(self.counts) > self.capacity:
+            keep = sorted(self.counts, key=self.counts.get, reverse=True)[:self.capacity]
+            self.counts = {item: self.counts[item] for item in keep}
+            self.errors = {item: self.errors.get(item, 0) for item in keep}
+
+    def top(self, k: int = 10) -> List[Tuple[str, int]]:
+        return sorted(self.counts.items(), key=lambda x: x[1], reverse=True)[:k]
+
+
+class WindowedSpaceSaving:
+    """Sliding-window heavy hitters built from a ring of per-bucket summaries.
+
+    Memory is fixed at num_buckets * capacity counters; buckets older than the
+    window are reset as time moves forward.
+    """
+
+    def __init__(self, bucket_seconds: int, num_buckets: int, capacity: int = 100):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = num_buckets
+        self.capacity = capacity
+        self.buckets = [SpaceSaving(capacity) for _ in range(num_buckets)]
+        self.epochs = [None] * num_buckets
+
+    def _bucket(self, now: float) -> SpaceSaving:
+        epoch = int(now // self.bucket_seconds)
+        slot = epoch % self.num_buckets
+        if self.epochs[slot] != epoch:
+            self.buckets[slot] = SpaceSaving(self.capacity)
+            self.epochs[slot] = epoch
+        return self.buckets[slot]
+
+    def add(self, item: str, now: float, count: int = 1):
+        self._bucket(now).add(item, count)
+
+    def summary(self, now: float) -> SpaceSaving:
+        oldest = int(now // self.bucket_seconds) - self.num_buckets + 1
+        merged = SpaceSaving(self.capacity)
+        for bucket, epoch in zip(self.buckets, self.epochs):
+            if epoch is not None and epoch >= oldest:
+                merged.merge(bucket)
+        return merged
+
+
+class CountMinSketch:
+    """Count-Min sketch: frequency estimates that never undercount, in fixed memory"""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def columns(self, item: str) -> List[int]:
+        h1, h2 = _hash_pair(item)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item: str, count: int = 1, columns: List[int] = None) -> int:
+        """Add an item and return its new estimated count"""
+        estimate = None
+        for row, column in zip(self.rows, columns or self.columns(item)):
+            row[column] += count
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, item: str, columns: List[int] = None) -> int:
+        return min(row[column] for row, column in zip(self.rows, columns or self.columns(item)))
+
+
+class RotatingCountMin:
+    """Count-Min rate estimates over a sliding window using two rotating sketches.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window, which smooths the reset at each rotation.
+    """
+
+    def __init__(self, window_seconds: int, width: int = 2048, depth: int = 4):
+        self.window_seconds = window_seconds
+        self.width = width
+        self.depth = depth
+        self.current = CountMinSketch(width, depth)
+        self.previous = CountMinSketch(width, depth)
+        self.epoch = None
+
+    def _rotate(self, now: float):
+        epoch = int(now // self.window_seconds)
+        if self.epoch is None:
+            self.epoch = epoch
+        elif epoch != self.epoch:
+            self.previous = self.current if epoch == self.epoch + 1 else CountMinSketch(self.width, self.depth)
+            self.current = CountMinSketch(self.width, self.depth)
+            self.epoch = epoch
+
+    def _weight(self, now: float) -> float:
+        return 1.0 - (now % self.window_seconds) / self.window_seconds
+
+    def add(self, item: str, now: float, count: int = 1) -> float:
+        """Add an item and return its estimated count over the last window"""
+        self._rotate(now)
+        columns = self.current.columns(item)
+        current = self.current.add(item, count, columns)
+        return current + self.previous.estimate(item, columns) * self._weight(now)
+
+    def estimate(self, item: str, now: float) -> float:
+        self._rotate(now)
+        columns = self.current.columns(item)
+        return self.current.estimate(item, columns) + self.previous.estimate(item, columns) * self._weight(now)
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import database
+
+STATE_STORE = os.getenv('STATE_STORE', 'mongo')
+STATE_TTL_SECONDS = int(os.getenv('STATE_TTL_SECONDS', '900'))
+STATE_MAX_ENTRIES = int(os.getenv('STATE_MAX_ENTRIES', '10000'))
+# Writes between enforcing the entry cap on the Mongo store
+STATE_TRIM_EVERY = 500
+
+
+class MemoryStateStore:
+    """Per-user conversation state held in process, with TTL expiry and an LRU cap"""
+
+    def __init__(self, ttl_seconds: int = STATE_TTL_SECONDS, max_entries: int = STATE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            state, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return state
+
+    def set(self, user_id: int, state: Dict, ttl_seconds: int = None):
+        expires_at = time.monotonic() + (ttl_seconds or self.ttl_seconds)
+        with self.lock:
+            self.entries[user_id] = (state, expires_at)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id: int):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MongoStateStore:
+    """Conversation state in the sessions collection, shared by every bot process.
+
+    Expired entries are removed by a TTL index (and ignored on read until then);
+    the entry cap is enforced every few hundred writes by dropping the least
+    recently updated sessions.
+    """
+
+    def __init__(self, ttl_seconds: int = STATE_TTL_SECONDS, max_entries: int = STATE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.writes = 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        return database.get_session(user_id)
+
+    def set(self, user_id: int, state: Dict, ttl_seconds: int = None):
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds or self.ttl_seconds)
+        database.save_session(user_id, state, expires_at)
+        self.writes += 1
+        if self.writes % STATE_TRIM_EVERY == 0:
+            database.trim_sessions(self.max_entries)
+
+    def delete(self, user_id: int):
+        database.delete_session(user_id)
+
+
+def create_state_store():
+    """Build the store selected by STATE_STORE, falling back to memory without MongoDB"""
+    if STATE_STORE == 'mongo' and database.sessions_collection is not None:
+        return MongoStateStore()
+    return MemoryStateStore()
@@ -0,0 +1,170 @@
+import os
+import time
+import fcntl
+import asyncio
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+from pyrogram import Client
+from pyrogram.errors import FloodWait
+
+API_ID = os.getenv('API_ID')
+API_HASH = os.getenv('API_HASH')
+BOT_TOKEN = os.getenv('BOT_TOKEN')
+
+# Pyrogram streams files in whole 1 MiB chunks
+STREAM_CHUNK_SIZE = 1024 * 1024
+DL_MAX_STREAMS = int(os.getenv('DL_MAX_STREAMS', '20'))
+DL_MAX_STREAMS_PER_IP = int(os.getenv('DL_MAX_STREAMS_PER_IP', '2'))
+DL_CHUNK_TIMEOUT_SECONDS = 60
+# Streamer sessions are saved here and reused across restarts, one per web worker
+DL_SESSION_DIR = os.getenv('DL_SESSION_DIR', '.')
+DL_SESSION_SLOTS = 64
+
+
+class StreamLimiter:
+    """Caps concurrent downloads globally and per client IP"""
+
+    def __init__(self, max_streams: int = DL_MAX_STREAMS, max_per_ip: int = DL_MAX_STREAMS_PER_IP):
+        self.max_streams = max_streams
+        self.max_per_ip = max_per_ip
+        self.active: Dict[str, int] = {}
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, ip: str) -> bool:
+        with self.lock:
+            if self.total >= self.max_streams or self.active.get(ip, 0) >= self.max_per_ip:
+                return False
+            self.active[ip] = self.active.get(ip, 0) + 1
+            self.total += 1
+            return True
+
+    def release(self, ip: str):
+        with self.lock:
+            count = self.active.get(ip, 0) - 1
+            if count > 0:
+                self.active[ip] = count
+            else:
+                self.active.pop(ip, None)
+            self.total -= 1
+
+
+def parse_range(header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range "bytes=" header into inclusive (start, end).
+
+    Returns None when there is no usable Range header and raises ValueError
+    for ranges that can't be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start_text, _, end_text = header[len('bytes='):].strip().partition('-')
+    if not start_text:
+        suffix = int(end_text)
+        if suffix <= 0:
+            raise ValueError("Empty suffix range")
+        return max(file_size - suffix, 0), file_size - 1
+    start = int(start_text)
+    end = min(int(end_text), file_size - 1) if end_text else file_size - 1
+    if start >= file_size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+async def _next_chunk(chunks) -> Optional[bytes]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def claim_session_name() -> Tuple[str, object]:
+    """Lock the first free session slot so each worker process reuses a saved session.
+
+    Returns the session name and the open lock file, which must stay open for
+    as long as the session is in use.
+    """
+    os.makedirs(DL_SESSION_DIR, exist_ok=True)
+    for slot in range(DL_SESSION_SLOTS):
+        name = f"web_streamer_{slot}"
+        lock_file = open(os.path.join(DL_SESSION_DIR, f"{name}.lock"), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return name, lock_file
+    raise RuntimeError(f"All {DL_SESSION_SLOTS} streamer session slots are in use")
+
+
+class TelegramStreamer:
+    """Streams Telegram files over the bot's MTProto credentials for the web process.
+
+    The client runs its own event loop in a daemon thread; Flask worker threads
+    fetch one chunk at a time from it, so at most one chunk per stream is held
+    in memory. Sessions are saved to disk so restarted workers don't import the
+    bot authorization again, and a FloodWait at startup makes downloads fail
+    fast until it has passed.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.client = None
+        self.session_lock = None
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.client is not None:
+                return
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                raise RuntimeError(f"Telegram asked to wait, retrying in {wait:.0f}s")
+            if self.session_lock is None:
+                self.session_name, self.session_lock = claim_session_name()
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+            client = Client(
+                self.session_name,
+                api_id=API_ID,
+                api_hash=API_HASH,
+                bot_token=BOT_TOKEN,
+                workdir=DL_SESSION_DIR,
+                no_updates=True
+            )
+            try:
+                asyncio.run_coroutine_threadsafe(client.start(), self.loop).result(DL_CHUNK_TIMEOUT_SECONDS)
+            except FloodWait as e:
+                self.retry_at = time.monotonic() + e.value
+                print(f"⚠️ Download streamer hit a FloodWait of {e.value}s at startup")
+                raise
+            self.client = client
+            print(f"✅ Download streamer connected to Telegram ({self.session_name})")
+
+    def iter_range(self, telegram_file_id: str, start: int, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield the bytes from `start` to `end` (inclusive, None for the rest of the file)"""
+        self.start()
+        first_chunk = start // STREAM_CHUNK_SIZE
+        limit = end // STREAM_CHUNK_SIZE - first_chunk + 1 if end is not None else 0
+        chunks = self.client.stream_media(telegram_file_id, limit=limit, offset=first_chunk)
+        position = first_chunk * STREAM_CHUNK_SIZE
+
+        try:
+            while end is None or position <= end:
+                chunk = asyncio.run_coroutine_threadsafe(
+                    _next_chunk(chunks), self.loop
+                ).result(DL_CHUNK_TIMEOUT_SECONDS)
+                if not chunk:
+                    return
+                chunk_start, position = position, position + len(chunk)
+                low = max(start - chunk_start, 0)
+                high = len(chunk) if end is None else min(end + 1 - chunk_start, len(chunk))
+                if low < high:
+                    yield chunk[low:high]
+        finally:
+            asyncio.run_coroutine_threadsafe(chunks.aclose(), self.loop)
+
+
+streamer = TelegramStreamer()
+limiter = StreamLimiter()
@@ -0,0 +1,52 @@
+import os
+from datetime import datetime, timedelta
+
+os.environ['MONGO_URI'] = ''
+
+import mongomock
+import pytest
+import database
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock_db = mongomock.MongoClient().db
+    mock_db.files.create_index(
+        [('uploader_id', 1), ('file_unique_id', 1)],
+        unique=True,
+        partialFilterExpression={'forced': False}
+    )
+    monkeypatch.setattr(database, 'files_collection', mock_db.files)
+    monkeypatch.setattr(database, 'users_collection', mock_db.users)
+    return mock_db
+
+
+def upload(short_link_id):
+    return database.create_file_record(
+        'telegram-file', 'video.mp4', 42, short_link_id, f"https://example.com/download/{short_link_id}",
+        file_unique_id='unique-1'
+    )
+
+
+def test_reupload_reuses_existing_link(db):
+    assert upload('first')['short_link_id'] == 'first'
+    assert upload('second')['short_link_id'] == 'first'
+    assert db.files.count_documents({}) == 1
+
+
+def test_reupload_after_expiry_then_again_returns_same_new_link(db):
+    upload('first')
+    db.files.update_one({'short_link_id': 'first'}, {'$set': {'expires_at': datetime.utcnow() - timedelta(hours=1)}})
+
+    assert upload('second')['short_link_id'] == 'second'
+    assert upload('third')['short_link_id'] == 'second'
+    assert db.files.count_documents({}) == 2
+    assert db.files.find_one({'short_link_id': 'first'})['forced'] is True
+
+
+def test_reupload_after_quota_used_up(db):
+    upload('first')
+    db.files.update_one({'short_link_id': 'first'}, {'$set': {'max_downloads': 5, 'views': 5}})
+
+    assert upload('second')['short_link_id'] == 'second'
+    assert upload('third')['short_link_id'] == 'second'
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime, timedelta
+
+os.environ['MONGO_URI'] = ''
+
+import mongomock
+import database
+from fraud import FraudScorer, FILE_LIMIT
+
+
+def test_viral_file_with_common_user_agent_is_not_held():
+    scorer = FraudScorer()
+    user_agent = 'Mozilla/5.0 (Linux; Android 14) Chrome/124.0 Mobile'
+    for i in range(FILE_LIMIT * 2):
+        score, signals = scorer.score('viral', 1, f"{i % 250}.{i // 250}.1.1", user_agent)
+    assert signals['file'] == 1.5 and signals['user_agent'] == 1.0
+    assert not scorer.is_suspicious(score)
+
+
+def test_single_prefix_flood_is_held():
+    scorer = FraudScorer()
+    for i in range(100):
+        score, _ = scorer.score('file', 1, f"10.0.0.{i}", 'bot')
+    assert scorer.is_suspicious(score)
+
+
+def test_held_views_count_as_recent_and_release_once_per_ip(monkeypatch):
+    mock_db = mongomock.MongoClient().db
+    monkeypatch.setattr(database, 'views_collection', mock_db.views)
+    monkeypatch.setattr(database, 'held_views_collection', mock_db.held_views)
+
+    database.create_held_view('file', 1, '1.2.3.4', 'US', 'bot', 2.5, {})
+    assert database.check_recent_view('file', '1.2.3.4')
+
+    now = datetime.utcnow()
+    mock_db.held_views.delete_many({})
+    for minutes in (0, 1, 2, 10):
+        mock_db.held_views.insert_one({
+            'short_link_id': 'file', 'uploader_id': 1, 'ip': '1.2.3.4', 'country': 'US',
+            'status': 'held', 'timestamp': now + timedelta(minutes=minutes)
+        })
+    assert len(database.claim_held_views(1)) == 2
+    assert mock_db.held_views.count_documents({'status': 'duplicate'}) == 2
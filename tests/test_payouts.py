@@ -0,0 +1,45 @@
+import os
+
+os.environ['MONGO_URI'] = ''
+
+import mongomock
+import pytest
+import database
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock_db = mongomock.MongoClient().db
+    monkeypatch.setattr(database, 'users_collection', mock_db.users)
+    monkeypatch.setattr(database, 'withdrawals_collection', mock_db.withdrawals)
+    mock_db.users.insert_one({'user_id': 1, 'balance_micros': 10_000_000})
+    return mock_db
+
+
+def claim(db, batch_id, amount_micros):
+    db.withdrawals.insert_one({
+        'user_id': 1, 'amount_micros': amount_micros, 'status': 'processing', 'batch_id': batch_id
+    })
+
+
+def test_batches_debit_once_and_leave_no_batch_ids(db):
+    claim(db, 'batch-1', 3_000_000)
+    assert len(database.settle_withdrawal_batch('batch-1')['approved']) == 1
+    claim(db, 'batch-2', 2_000_000)
+    assert len(database.settle_withdrawal_batch('batch-2')['approved']) == 1
+
+    # Rerunning a finished batch changes nothing
+    assert database.settle_withdrawal_batch('batch-1')['approved'] == []
+
+    user = db.users.find_one({'user_id': 1})
+    assert user['balance_micros'] == 5_000_000
+    assert user['payout_batches'] == []
+
+
+def test_interrupted_batch_is_not_debited_twice(db):
+    claim(db, 'batch-1', 3_000_000)
+    # The debit landed but the approval step never ran
+    db.users.update_one({'user_id': 1}, {'$inc': {'balance_micros': -3_000_000}, '$addToSet': {'payout_batches': 'batch-1'}})
+
+    assert len(database.settle_withdrawal_batch('batch-1')['approved']) == 1
+    assert db.users.find_one({'user_id': 1})['balance_micros'] == 7_000_000
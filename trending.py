@@ -0,0 +1,79 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from sketches import SpaceSaving, WindowedSpaceSaving
+from database import save_trending_snapshot, get_trending_snapshots
+
+TRENDING_CAPACITY = int(os.getenv('TRENDING_CAPACITY', '100'))
+TRENDING_SNAPSHOT_SECONDS = int(os.getenv('TRENDING_SNAPSHOT_SECONDS', '30'))
+
+# Window name -> (bucket seconds, number of buckets)
+WINDOWS = {
+    'hour': (300, 12),
+    'day': (3600, 24),
+}
+KINDS = ('files', 'uploaders')
+
+
+class TrendingTracker:
+    """Tracks the hottest files and uploaders over sliding windows in fixed memory.
+
+    Each web worker keeps its own summaries and periodically publishes them to
+    the trending collection; readers merge the snapshots of all live workers.
+    """
+
+    def __init__(self, capacity: int = TRENDING_CAPACITY, snapshot_seconds: int = TRENDING_SNAPSHOT_SECONDS):
+        self.capacity = capacity
+        self.snapshot_seconds = snapshot_seconds
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.windows = {
+            name: {kind: WindowedSpaceSaving(bucket, count, capacity) for kind in KINDS}
+            for name, (bucket, count) in WINDOWS.items()
+        }
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add_view(self, short_link_id: str, uploader_id: int):
+        now = time.time()
+        with self.lock:
+            for window in self.windows.values():
+                window['files'].add(short_link_id, now)
+                window['uploaders'].add(str(uploader_id), now)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self.lock:
+            return {
+                name: {kind: window[kind].summary(now).top(self.capacity) for kind in KINDS}
+                for name, window in self.windows.items()
+            }
+
+    def publish(self):
+        expires_at = datetime.utcnow() + timedelta(seconds=self.snapshot_seconds * 4)
+        try:
+            save_trending_snapshot(self.instance_id, self.snapshot(), expires_at)
+        except Exception as e:
+            print(f"Trending snapshot error: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_seconds)
+            self.publish()
+
+
+def get_trending(window: str = 'hour', kind: str = 'files', k: int = 10) -> List[Tuple[str, int]]:
+    """Merge the published snapshots of all web workers into one top-k list"""
+    merged = SpaceSaving(TRENDING_CAPACITY)
+    for snapshot in get_trending_snapshots():
+        for item, count in snapshot.get('windows', {}).get(window, {}).get(kind, []):
+            merged.add(item, count)
+    return merged.top(k)
+
+
+tracker = TrendingTracker()
@@ -0,0 +1,79 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict
+from sketches import HyperLogLog
+from database import file_sketch_key, uploader_sketch_key, merge_sketch_registers
+
+UNIQUES_FLUSH_SECONDS = int(os.getenv('UNIQUES_FLUSH_SECONDS', '10'))
+UNIQUES_MAX_PENDING_KEYS = int(os.getenv('UNIQUES_MAX_PENDING_KEYS', '5000'))
+DAILY_SKETCH_RETENTION_DAYS = int(os.getenv('DAILY_SKETCH_RETENTION_DAYS', '90'))
+
+
+class UniqueVisitorTracker:
+    """Buffers HyperLogLog register updates in memory and merges them into Mongo.
+
+    Each view only touches one register per sketch, so the pending buffer holds
+    sparse {index: rank} maps rather than full sketches. A background thread
+    flushes them every few seconds, or as soon as the buffer fills up; merging
+    is idempotent, so concurrent web workers flushing the same key are safe.
+    """
+
+    def __init__(self, flush_seconds: int = UNIQUES_FLUSH_SECONDS, max_pending_keys: int = UNIQUES_MAX_PENDING_KEYS):
+        self.flush_seconds = flush_seconds
+        self.max_pending_keys = max_pending_keys
+        self.pending: Dict[str, Dict[int, int]] = {}
+        self.expiry: Dict[str, datetime] = {}
+        self.lock = threading.Lock()
+        # Set when the buffer fills up so the flusher runs early, off the request thread
+        self.flush_requested = threading.Event()
+        self.thread = None
+
+    def add_view(self, short_link_id: str, uploader_id: int, visitor: str):
+        index, rank = HyperLogLog.position(visitor)
+        day = datetime.utcnow().strftime('%Y-%m-%d')
+        expires_at = datetime.utcnow() + timedelta(days=DAILY_SKETCH_RETENTION_DAYS)
+
+        keys = [
+            file_sketch_key(short_link_id),
+            file_sketch_key(short_link_id, day),
+            uploader_sketch_key(uploader_id),
+            uploader_sketch_key(uploader_id, day),
+        ]
+
+        with self.lock:
+            for key in keys:
+                registers = self.pending.setdefault(key, {})
+                if rank > registers.get(index, 0):
+                    registers[index] = rank
+            self.expiry[keys[1]] = expires_at
+            self.expiry[keys[3]] = expires_at
+            if len(self.pending) >= self.max_pending_keys:
+                self.flush_requested.set()
+            self._ensure_thread()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            expiry, self.expiry = self.expiry, {}
+
+        for key, updates in pending.items():
+            try:
+                merge_sketch_registers(key, updates, expiry.get(key))
+            except Exception as e:
+                print(f"Unique visitor flush error for {key}: {e}")
+
+    def _ensure_thread(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            self.flush_requested.wait(self.flush_seconds)
+            self.flush_requested.clear()
+            self.flush()
+
+
+tracker = UniqueVisitorTracker()
@@ -1,13 +1,26 @@
+import time
+
+# Measured from the first import so the reported startup covers Flask and pymongo too
+_import_started = time.perf_counter()
+
 import os
+import sys
+import hmac
 import hashlib
 import secrets
-from flask import Flask, render_template_string, request, redirect, session, jsonify
+import mimetypes
+from urllib.parse import quote
+from flask import Flask, Response, render_template_string, request, redirect, session, jsonify, stream_with_context, send_file, g
 from datetime import datetime, timedelta
-import requests
 from database import (
-    get_file_by_short_link_id, create_view_record, increment_file_views,
-    check_recent_view, calculate_earnings, update_user_balance, get_ad_codes
+    get_file_by_short_link_id, check_recent_view, get_ad_codes, create_held_view, is_file_available
 )
+from fraud import scorer as fraud_scorer
+from delivery_tokens import issue_token as issue_delivery_token, verify_token as verify_delivery_token
+from trending import get_trending, WINDOWS as TRENDING_WINDOWS
+from accounting import credit_view
+from admission import admission, db_latency, DeferredQueue, SHED_RETRY_AFTER_SECONDS
+from cache import LRUCache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,9 +38,22 @@ def get_base_url():
 
 BASE_URL = get_base_url()
 BOT_USERNAME = os.getenv('BOT_USERNAME', 'YourBot').lstrip('@')
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')
+DIRECT_DOWNLOADS = os.getenv('DIRECT_DOWNLOADS', '').lower() in ('1', 'true', 'yes')
 
 rate_limit_store = {}
 
+AD_CODES_CACHE_SECONDS = 60
+FUNNEL_FILE_CACHE_SIZE = int(os.getenv('FUNNEL_FILE_CACHE_SIZE', '10000'))
+# Requests counted toward admission control; /dl streams and admin endpoints are left out
+FUNNEL_ENDPOINTS = {'download_page', 'page1', 'page2', 'page3', 'page4'}
+
+ad_codes_cache = LRUCache(1, AD_CODES_CACHE_SECONDS)
+# Last ad codes read from MongoDB, served past their TTL while shedding
+stale_ad_codes = {}
+# short_link_id -> file_type, remembered at /download so page 4 can issue a token without MongoDB
+funnel_files = LRUCache(FUNNEL_FILE_CACHE_SIZE, 3600)
+
 
 def get_client_ip():
     if request.headers.get('X-Forwarded-For'):
@@ -40,6 +66,8 @@ def get_country_from_ip(ip):
         return 'OTHER'
     
     try:
+        # requests (and certifi) is only needed here, so it's loaded on the first lookup
+        import requests
         response = requests.get(f'https://ipapi.co/{ip}/json/', timeout=3)
         if response.status_code == 200:
             data = response.json()
@@ -68,6 +96,64 @@ def check_rate_limit(ip, max_requests=10, window_minutes=5):
     return True
 
 
+def check_admin_key():
+    if not ADMIN_API_KEY:
+        return False
+    auth = request.headers.get('Authorization', '')
+    provided = auth[7:] if auth.startswith('Bearer ') else request.args.get('key', '')
+    return hmac.compare_digest(provided.encode(), ADMIN_API_KEY.encode())
+
+
+def get_cached_ad_codes():
+    """Ad codes for the funnel pages, re-read every minute and never from MongoDB while shedding"""
+    ad_codes = ad_codes_cache.get('ad_codes')
+    if ad_codes is None:
+        if admission.shedding():
+            return stale_ad_codes
+        ad_codes = get_ad_codes()
+        ad_codes_cache.set('ad_codes', ad_codes)
+        stale_ad_codes.clear()
+        stale_ad_codes.update(ad_codes)
+    return ad_codes
+
+
+def account_view(file_record, ip, country, user_agent):
+    """Record a completed funnel view and credit its uploader, unless it looks fraudulent"""
+    short_link_id = file_record['short_link_id']
+    uploader_id = file_record['uploader_id']
+    score, signals = fraud_scorer.score(short_link_id, uploader_id, ip, user_agent)
+    
+    if fraud_scorer.is_suspicious(score):
+        create_held_view(short_link_id, uploader_id, ip, country, user_agent, score, signals)
+    else:
+        credit_view(short_link_id, uploader_id, ip, country, user_agent)
+
+
+def account_deferred_view(short_link_id, ip, user_agent):
+    file_record = get_file_by_short_link_id(short_link_id)
+    if file_record:
+        account_view(file_record, ip, get_country_from_ip(ip), user_agent)
+
+
+# Page 4 views reached while shedding, accounted once the database recovers
+deferred_views = DeferredQueue(account_deferred_view, admission.shedding)
+
+
+@app.before_request
+def track_in_flight():
+    if request.endpoint in FUNNEL_ENDPOINTS:
+        admission.enter()
+        db_latency.sample_thread(True)
+        g.admitted = True
+
+
+@app.teardown_request
+def release_in_flight(exc=None):
+    if g.pop('admitted', False):
+        db_latency.sample_thread(False)
+        admission.leave()
+
+
 def generate_token(file_id, page_num):
     data = f"{file_id}-{page_num}-{app.secret_key}"
     return hashlib.sha256(data.encode()).hexdigest()[:16]
@@ -501,6 +587,9 @@ PAGE_4_TEMPLATE = '''
         <p>Your file is ready to download. Click the button below to get your file.</p>
         <div class="timer" id="timer">5</div>
         <button class="btn" id="getBtn" disabled>Get Link</button>
+        {% if direct_url %}
+        <p style="margin: 20px 0 0;"><a href="{{ direct_url }}" id="directLink" style="display: none;">Or download directly in your browser</a></p>
+        {% endif %}
     </div>
     
     <!-- Banner Ad - Bottom -->
@@ -522,6 +611,10 @@ PAGE_4_TEMPLATE = '''
             if (timeLeft <= 0) {
                 clearInterval(countdown);
                 btn.disabled = false;
+                const directLink = document.getElementById('directLink');
+                if (directLink) {
+                    directLink.style.display = 'inline';
+                }
                 btn.onclick = () => {
                     // Open smartlink in new window/tab if URL is provided
                     if (smartlinkUrl && smartlinkUrl !== '') {
@@ -602,6 +695,11 @@ def index():
 
 @app.route('/download/<short_link_id>')
 def download_page(short_link_id):
+    # New visitors are turned away quickly rather than left waiting on a slow database
+    if admission.shedding():
+        admission.record_shed()
+        return 'The service is busy. Please try again shortly.', 503, {'Retry-After': str(SHED_RETRY_AFTER_SECONDS)}
+    
     ip = get_client_ip()
     
     if not check_rate_limit(ip):
@@ -611,9 +709,14 @@ def download_page(short_link_id):
     if not file_record:
         return 'File not found', 404
     
+    if not is_file_available(file_record):
+        return 'This link has expired.', 410
+    
     if check_recent_view(short_link_id, ip):
         return 'You recently viewed this file. Please wait before trying again.', 429
     
+    funnel_files.set(short_link_id, file_record.get('file_type', 'document'))
+    
     token = generate_token(short_link_id, 1)
     session['short_link_id'] = short_link_id
     session['started_at'] = datetime.utcnow().isoformat()
@@ -631,7 +734,7 @@ def page1(short_link_id):
     next_token = generate_token(short_link_id, 2)
     next_url = f'/page2/{short_link_id}?token={next_token}'
     
-    ad_codes = get_ad_codes()
+    ad_codes = get_cached_ad_codes()
     template = PAGE_1_TEMPLATE
     template = template.replace('<!-- Add your Adsterra Popunder code here -->', ad_codes.get('popunder', ''))
     template = template.replace('<!-- Add your Adsterra Banner code here -->', ad_codes.get('banner', ''))
@@ -650,7 +753,7 @@ def page2(short_link_id):
     next_token = generate_token(short_link_id, 3)
     next_url = f'/page3/{short_link_id}?token={next_token}'
     
-    ad_codes = get_ad_codes()
+    ad_codes = get_cached_ad_codes()
     template = PAGE_2_TEMPLATE
     template = template.replace('<!-- Add your Adsterra Popunder code here -->', ad_codes.get('popunder', ''))
     template = template.replace('<!-- Add your Adsterra Banner code here -->', ad_codes.get('banner', ''))
@@ -669,7 +772,7 @@ def page3(short_link_id):
     next_token = generate_token(short_link_id, 4)
     next_url = f'/page4/{short_link_id}?token={next_token}'
     
-    ad_codes = get_ad_codes()
+    ad_codes = get_cached_ad_codes()
     smartlink_url = ad_codes.get('smartlink', '')
     
     template = PAGE_3_TEMPLATE
@@ -688,20 +791,28 @@ def page4(short_link_id):
         return 'Invalid access token', 403
     
     ip = get_client_ip()
-    country = get_country_from_ip(ip)
     user_agent = request.headers.get('User-Agent', '')
     
-    file_record = get_file_by_short_link_id(short_link_id)
-    if file_record:
-        create_view_record(short_link_id, ip, country, user_agent)
-        increment_file_views(short_link_id, country)
-        
-        earnings = calculate_earnings(country)
-        update_user_balance(file_record['uploader_id'], earnings)
+    if admission.shedding():
+        # Accounting waits for the database; the bot resolves the file itself on delivery
+        admission.record_shed()
+        deferred_views.put(short_link_id, ip, user_agent)
+        file_record = None
+        file_type = funnel_files.get(short_link_id, 'document')
+    else:
+        file_record = get_file_by_short_link_id(short_link_id)
+        if file_record and not is_file_available(file_record):
+            return 'This link has expired.', 410
+        if file_record:
+            account_view(file_record, ip, get_country_from_ip(ip), user_agent)
+        file_type = file_record.get('file_type', 'document') if file_record else 'document'
     
-    bot_url = f'https://t.me/{BOT_USERNAME}?start={short_link_id}'
+    delivery_token = issue_delivery_token(short_link_id, file_type)
+    bot_url = f'https://t.me/{BOT_USERNAME}?start={delivery_token}'
+    # The direct link is only offered for files looked up in this request
+    direct_url = f'{BASE_URL}/dl/{delivery_token}' if DIRECT_DOWNLOADS and file_record and file_type != 'bundle' else ''
     
-    ad_codes = get_ad_codes()
+    ad_codes = get_cached_ad_codes()
     smartlink_url = ad_codes.get('smartlink', '')
     
     template = PAGE_4_TEMPLATE
@@ -710,7 +821,202 @@ def page4(short_link_id):
     template = template.replace('<!-- Add your Adsterra Native Banner code here -->', ad_codes.get('native', ''))
     template = template.replace('<!-- Add your Adsterra Social Bar code here -->', ad_codes.get('social_bar', ''))
     
-    return render_template_string(template, bot_url=bot_url, smartlink_url=smartlink_url)
+    return render_template_string(template, bot_url=bot_url, direct_url=direct_url, smartlink_url=smartlink_url)
+
+
+def stream_download(file_record):
+    """Response serving a file from the download cache or streamed from Telegram"""
+    from streamer import streamer, parse_range
+    from filecache import file_cache
+    
+    file_name = file_record['file_name']
+    file_size = file_record.get('file_size')
+    mimetype = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    unique_id = file_record.get('file_unique_id')
+    cacheable = file_cache.accepts(unique_id, file_size)
+    
+    if cacheable:
+        cached_path = file_cache.lookup(unique_id)
+        if cached_path:
+            # send_file handles Range itself and uses the server's sendfile support
+            response = send_file(cached_path, mimetype=mimetype, as_attachment=True,
+                                 download_name=file_name, conditional=True)
+            file_cache.record_saved(response.content_length or 0)
+            return response
+    
+    status = 200
+    start, end = 0, None
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(file_name)}"
+    }
+    
+    # Older records have no size, so they can only be streamed whole
+    if file_size:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), file_size)
+        except ValueError:
+            return Response(status=416, headers={'Content-Range': f'bytes */{file_size}'})
+        start, end = byte_range or (0, file_size - 1)
+        headers['Accept-Ranges'] = 'bytes'
+        headers['Content-Length'] = str(end - start + 1)
+        if byte_range:
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+    
+    try:
+        streamer.start()
+    except Exception as e:
+        print(f"Download streamer unavailable: {e}")
+        return Response('Download temporarily unavailable', status=503)
+    
+    telegram_file_id = file_record['telegram_file_id']
+    if cacheable:
+        fill, joined = file_cache.fetch(unique_id, lambda: streamer.iter_range(telegram_file_id, 0, None))
+        if joined:
+            file_cache.record_saved(end - start + 1)
+        body = file_cache.iter_fill(fill, start, end)
+    else:
+        body = streamer.iter_range(telegram_file_id, start, end)
+    
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+
+@app.route('/dl/<token>')
+def direct_download(token):
+    if not DIRECT_DOWNLOADS:
+        return 'Not found', 404
+    
+    delivery = verify_delivery_token(token)
+    if delivery is None:
+        return 'Invalid or expired link', 403
+    short_link_id, file_type = delivery
+    
+    file_record = get_file_by_short_link_id(short_link_id)
+    if not file_record or file_type == 'bundle' or not file_record.get('telegram_file_id'):
+        return 'File not found', 404
+    if not is_file_available(file_record):
+        return 'This link has expired.', 410
+    
+    from streamer import limiter
+    
+    # Cache hits count against the stream caps too, so they can't be used to get around them
+    ip = get_client_ip()
+    if not limiter.acquire(ip):
+        return Response('Too many concurrent downloads', status=429, headers={'Retry-After': '10'})
+    
+    # The slot is freed when the response is closed, or right away if building it fails
+    try:
+        response = stream_download(file_record)
+    except Exception:
+        limiter.release(ip)
+        raise
+    response.call_on_close(lambda: limiter.release(ip))
+    return response
+
+
+@app.route('/admin/export/<dataset>')
+def admin_export(dataset):
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    from export import DATASETS, FORMATS, export_dataset, parse_date
+    
+    fmt = request.args.get('format', 'ndjson')
+    if dataset not in DATASETS or fmt not in FORMATS:
+        return 'Unknown dataset or format', 404
+    
+    try:
+        since = parse_date(request.args.get('since'))
+        until = parse_date(request.args.get('until'))
+    except ValueError:
+        return 'Invalid date', 400
+    
+    chunks = export_dataset(dataset, fmt, since=since, until=until, compress=True)
+    filename = f"{dataset}-{datetime.utcnow().strftime('%Y%m%d')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={
+            'Content-Encoding': 'gzip',
+            'Content-Disposition': f'attachment; filename={filename}'
+        }
+    )
+
+
+@app.route('/admin/payouts/<batch_id>')
+def admin_payouts(batch_id):
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    from export import export_payouts
+    
+    method = request.args.get('method')
+    filename = f"payouts-{batch_id}-{method}.csv" if method else f"payouts-{batch_id}.csv"
+    return Response(
+        stream_with_context(export_payouts(batch_id, method)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+@app.route('/admin/trending')
+def admin_trending():
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    window = request.args.get('window', 'hour')
+    if window not in TRENDING_WINDOWS:
+        return jsonify({'error': 'Unknown window'}), 400
+    
+    try:
+        k = min(int(request.args.get('k', 10)), 100)
+    except ValueError:
+        return jsonify({'error': 'Invalid k'}), 400
+    
+    return jsonify({
+        'window': window,
+        'files': [{'short_link_id': item, 'views': count} for item, count in get_trending(window, 'files', k)],
+        'uploaders': [{'uploader_id': int(item), 'views': count} for item, count in get_trending(window, 'uploaders', k)],
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+
+@app.route('/admin/download-cache')
+def admin_download_cache():
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    from filecache import file_cache
+    return jsonify({**file_cache.stats(), 'timestamp': datetime.utcnow().isoformat()})
+
+
+@app.route('/admin/process')
+def admin_process():
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    return jsonify({
+        'pid': os.getpid(),
+        'startup_seconds': round(STARTUP_SECONDS, 3),
+        'rss_bytes': resident_memory_bytes(),
+        'pyrogram_loaded': 'pyrogram' in sys.modules,
+        'modules_loaded': len(sys.modules),
+        'timestamp': datetime.utcnow().isoformat()
+    })
+
+
+@app.route('/admin/admission')
+def admin_admission():
+    if not check_admin_key():
+        return 'Forbidden', 403
+    
+    return jsonify({
+        **admission.stats(),
+        'deferred_views': deferred_views.stats(),
+        'timestamp': datetime.utcnow().isoformat()
+    })
 
 
 @app.route('/health')
@@ -718,5 +1024,20 @@ def health():
     return jsonify({'status': 'ok', 'timestamp': datetime.utcnow().isoformat()})
 
 
+def resident_memory_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+STARTUP_SECONDS = time.perf_counter() - _import_started
+print(f"✅ Web worker {os.getpid()} loaded in {STARTUP_SECONDS:.2f}s, "
+      f"{resident_memory_bytes() / 1024 ** 2:.0f} MB resident")
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)